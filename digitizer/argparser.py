@@ -22,6 +22,7 @@ class DigitizerParser( ArgumentParser ):
         self.add_argument( "--records", "-r",                          type=int,   default=1 )
         self.add_argument( "--samples", "-s",                          type=int,   default=200 )
         self.add_argument( "--averages", "-a",                         type=int,   default=1 )
+        self.add_argument( "--host-average", "-ha",                    type=int,   default=0 )
         self.add_argument( "--mode", "-m",                             type=str,   default='DGT', choices=['DGT', 'DDC', 'AVG', 'CFW'] )
         self.add_argument( "--acquire-none", "-an",                                default=False, action='store_true' )
 
@@ -79,6 +80,7 @@ class DigitizerParser( ArgumentParser ):
         grps.add_argument( "--wait-timeout", "-wt",        nargs='?',  type=float, default=1.0 )
         grps.add_argument( "--poll-timeout", "-pt",        nargs=None, type=float, default=None )
         self.add_argument( "--wait-failure", "-wf",                                default=False, action='store_true' )
+        self.add_argument( "--expected-trigger-rate", "-etr", nargs=None, type=float, default=None )
 
         self.add_argument( "--read-records", "-rr",        nargs=None, type=int,   default=None )
         self.add_argument( "--read-samples", "-rs",        nargs=None, type=int,   default=None )
@@ -90,6 +92,18 @@ class DigitizerParser( ArgumentParser ):
         self.add_argument( "--output-1st-sample", "-o1s",  nargs=None, type=int,   default=None )
         self.add_argument( "--output-samples", "-os",      nargs=None, type=int,   default=None )
         self.add_argument( "--output-info", "-oi",                                 default=False, action='store_true' )
+        self.add_argument( "--output-summary", "-osm",                             default=False, action='store_true' )
+        self.add_argument( "--summary-fit", "-smf",                                default=False, action='store_true' )
+        self.add_argument( "--output-shm", "-osh",         nargs=None, type=str,   default=None )
+        self.add_argument( "--shm-slots", "-shs",          nargs=None, type=int,   default=16 )
+        self.add_argument( "--shm-slot-size", "-shz",      nargs=None, type=float, default=None )
+        self.add_argument( "--pipeline-depth", "-pd",      nargs=None, type=int,   default=0 )
+        self.add_argument( "--output-memory", "-om",       nargs=None, type=int,   default=256 )
+        self.add_argument( "--output-policy", "-op",       nargs=None, type=str,   default='block', choices=['block', 'drop-oldest', 'drop-newest'] )
+        self.add_argument( "--fetch-threads", "-ft",       nargs=None, type=int,   default=0 )
+        self.add_argument( "--fetch-per-channel", "-fpc",                          default=False, action='store_true' )
+        self.add_argument( "--telemetry", "-tm",           nargs=None, type=str,   default=None )
+        self.add_argument( "--telemetry-interval", "-tmi", nargs=None, type=float, default=1.0 )
 
         self.add_argument( "--inter-channel-delay-enabled", "-icde",               default=None, action='store_true' )
         self.add_argument( "--channel-sampling-delay-1", "-csd1",      type=float, default=None )
@@ -154,10 +168,11 @@ class DigitizerParser( ArgumentParser ):
         return args
 
 
-def DigitizerArgs( parser=None ):
+def DigitizerArgs( parser=None, argv=None ):
+    """ Parses argv, or the command line when None. """
     if not parser:
         parser = DigitizerParser()
-    args = parser.parse_args()
+    args = parser.parse_args( argv )
 
     if args.sampling_interval!=None:
         args.sampling_frequency = 1.0/args.sampling_interval
@@ -186,6 +201,35 @@ def RefreshArgs( args ):
         args.read_samples = args.samples
 
 
+def FetchRange( args ):
+    """ Returns the first record, the number of records, the offset and the
+        number of samples to fetch: the records and samples read that are
+        output. The range is empty, of 0 records and 0 samples, when the
+        first record or sample output is past the ones read.
+
+    >>> args = DigitizerArgs( argv=["SIM::U5303A", "-r", "100", "-s", "1024", "-o1r", "10", "-or", "5", "-os", "256"] )
+    >>> print( FetchRange( args ) )
+    (10, 5, 0, 256)
+    >>> args = DigitizerArgs( argv=["SIM::U5303A", "-r", "100", "-s", "1024", "-rr", "20", "-o1r", "15", "-o1s", "1000", "-os", "256"] )
+    >>> print( FetchRange( args ) )
+    (15, 5, 1000, 24)
+    >>> args = DigitizerArgs( argv=["SIM::U5303A", "-r", "100", "-s", "1024", "-rr", "20", "-o1r", "50"] )
+    >>> print( FetchRange( args ) )
+    (50, 0, 0, 0)
+    """
+    firstRecord = args.output_1st_record or 0
+    offset = args.output_1st_sample or 0
+    if firstRecord>=max( args.read_records, 1 ) or offset>=max( args.read_samples, 1 ):
+        return firstRecord, 0, offset, 0
+    nbrRecords = max( args.read_records, 1 )-firstRecord
+    if args.output_records:
+        nbrRecords = min( nbrRecords, args.output_records )
+    nbrSamples = max( args.read_samples, 1 )-offset
+    if args.output_samples:
+        nbrSamples = min( nbrSamples, args.output_samples )
+    return firstRecord, nbrRecords, offset, nbrSamples
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+
+""" The attrcache module keeps a shadow of the attributes set in the drivers.
+
+    ApplyArgs is run again each time a command changes the arguments of a
+    runner. Each attribute it sets costs a round trip to the driver, and one
+    more for the Get that checks whether the Set is needed. AttributeCache
+    remembers the value of each attribute, by vi, repeated capability and
+    attribute, so that only the attributes whose value changes reach the
+    driver:
+
+    cache = AttributeCache()
+    cache.Update( vi, "", AGMD2_ATTR_RECORD_SIZE, 1024, AgMD2_SetAttributeViInt64, AgMD2_GetAttributeViInt64 )
+    cache.Assign( vi, "Channels[].Range", 2.5, "Channel1" )
+
+    The value known for an attribute is the one last set, or read from the
+    driver the first time. A driver may coerce the value it is set to, or
+    change an attribute as a consequence of another one: the cache of a vi is
+    to be invalidated when it resets, or calibrates, the instrument.
+
+"""
+
+
+def ResolveProperty( obj, path, repCap="" ):
+    """ Returns the object holding the property of path, and its name. The
+        empty brackets of path are indexed with repCap.
+
+    >>> class Node: pass
+    >>> vi = Node(); vi.Trigger = Node(); vi.Trigger.Sources = { "External1": Node() }
+    >>> vi.Trigger.Sources["External1"].Edge = Node()
+    >>> holder, name = ResolveProperty( vi, "Trigger.Sources[].Edge.Slope", "External1" )
+    >>> print( holder is vi.Trigger.Sources["External1"].Edge, name )
+    True Slope
+    """
+    names = path.split( '.' )
+    for name in names[:-1]:
+        if name.endswith( '[]' ):
+            obj = getattr( obj, name[:-2] )[repCap]
+        else:
+            obj = getattr( obj, name )
+    return obj, names[-1]
+
+
+class AttributeCache:
+    """ Values of the attributes of the drivers, by vi, repCap and attribute.
+
+        reads and writes count the calls to the driver, and skipped the writes
+        that were not needed.
+
+    >>> driver = {}
+    >>> def Get( vi, repCap, attr ): return driver.get( ( vi, repCap, attr ), 0 )
+    >>> def Set( vi, repCap, attr, value ): driver[( vi, repCap, attr )] = value
+    >>> cache = AttributeCache()
+    >>> for value in ( 0, 5, 5, 7 ):
+    ...     cache.Update( 1, "Channel1", 100, value, Set, Get )
+    >>> print( driver, cache.reads, cache.writes, cache.skipped )
+    {(1, 'Channel1', 100): 7} 1 2 2
+    >>> cache.Invalidate( 1 )
+    >>> cache.Update( 1, "Channel1", 100, 7, Set, Get )
+    >>> print( cache.reads, cache.writes, cache.skipped )
+    2 2 3
+    """
+    def __init__( self ):
+        self.values = {}
+        self.reads = 0
+        self.writes = 0
+        self.skipped = 0
+
+    def Get( self, vi, repCap, attr, get ):
+        """ Returns the value of the attribute, read with get( vi, repCap, attr )
+            when it is not known yet.
+        """
+        key = ( vi, repCap, attr )
+        if key not in self.values:
+            self.values[key] = get( vi, repCap, attr )
+            self.reads += 1
+        return self.values[key]
+
+    def Set( self, vi, repCap, attr, value, set ):
+        """ Sets the attribute with set( vi, repCap, attr, value ). When set
+            fails, the value of the attribute is no longer known.
+        """
+        key = ( vi, repCap, attr )
+        try:
+            set( vi, repCap, attr, value )
+        except:
+            self.values.pop( key, None )
+            raise
+        self.writes += 1
+        self.values[key] = value
+
+    def Update( self, vi, repCap, attr, value, set, get=None ):
+        """ Sets the attribute, unless it already has value. Without get, an
+            attribute whose value is not known is always set.
+        """
+        key = ( vi, repCap, attr )
+        if key not in self.values and get is not None:
+            self.Get( vi, repCap, attr, get )
+        if key in self.values and self.values[key]==value:
+            self.skipped += 1
+            return
+        self.Set( vi, repCap, attr, value, set )
+
+    def Assign( self, vi, path, value, repCap="" ):
+        """ Sets the property of path of the object-model driver vi, unless it
+            already has value. See ResolveProperty.
+
+        >>> class Node: pass
+        >>> vi = Node(); vi.Acquisition = Node()
+        >>> cache = AttributeCache()
+        >>> cache.Assign( vi, "Acquisition.RecordSize", 1024 )
+        >>> vi.Acquisition.RecordSize = 0
+        >>> cache.Assign( vi, "Acquisition.RecordSize", 1024 )
+        >>> print( vi.Acquisition.RecordSize, cache.writes, cache.skipped )
+        0 1 1
+        """
+        def SetProperty( vi, repCap, path, value ):
+            holder, name = ResolveProperty( vi, path, repCap )
+            setattr( holder, name, value )
+        self.Update( vi, repCap, path, value, SetProperty )
+
+    def Invalidate( self, vi=None ):
+        """ Forgets the values of the attributes of vi, or of all the vis. """
+        if vi is None:
+            self.values.clear()
+        else:
+            for key in [key for key in self.values if key[0]==vi]:
+                del self.values[key]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
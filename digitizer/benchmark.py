@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+
+from os import environ, devnull, path
+from sys import stdout, stderr
+from io import StringIO
+from queue import Queue
+from itertools import product
+from contextlib import contextmanager
+from subprocess import run
+from argparse import ArgumentParser
+import platform
+import time
+import json
+import numpy
+
+from digitizer.argparser import DigitizerArgs
+from waveforms.sink import ObjectBytes
+from waveforms.telemetry import Telemetry
+from waveforms.packed import UnpackSamples, PackSamples
+
+
+""" The benchmark module measures the acquisition loop of runnermd2 against
+    the simulated digitizer.
+
+    For each combination of mode, channels, records and samples, it runs the
+    loop of the runner, Acquire then FetchChannels, and times its stages:
+
+    acquire     Acquire, i.e. initiating and waiting for the acquisition
+    fetch       The fetch functions of the driver
+    record      The construction of the records from the fetches
+    serialize   The formatting of the records as text, by OutputTraces
+    write       The writing of the text to the output file
+
+    python3 -m digitizer.benchmark -m DGT AVG DDC -r 1 100 -s 1024 65536 -c 1 2 -o results.json
+    python3 -m digitizer.benchmark -m DGT -r 100 -s 1024 --compare results.json
+    python3 -m digitizer.benchmark --unpack 12 --stream-rate 1e9
+
+    The results are a JSON file, with the revision of the tree, so that the
+    numbers of two revisions can be compared.
+
+"""
+
+
+STAGES = ( "acquire", "fetch", "record", "serialize", "write" )
+
+
+class TimingSink:
+    """ Sink for FetchChannels. The output is written to memory, then to file,
+        so that the serialization and the write are timed apart.
+
+    >>> out = StringIO()
+    >>> sink = TimingSink( out )
+    >>> sink.Put( print, "1 2 3", file=out )
+    True
+    >>> print( repr( out.getvalue() ), sink.bytes, sorted( sink.seconds ) )
+    '1 2 3\\n' 6 ['serialize', 'write']
+    """
+    def __init__( self, file ):
+        self.file = file
+        self.bytes = 0
+        self.seconds = { "serialize": 0.0, "write": 0.0 }
+
+    def Put( self, function, *args, **kwargs ):
+        buffer = StringIO()
+        args = [buffer if arg is self.file else arg for arg in args]
+        if kwargs.get( "file" ) is self.file:
+            kwargs["file"] = buffer
+        start = time.perf_counter()
+        function( *args, **kwargs )
+        text = buffer.getvalue()
+        serialized = time.perf_counter()
+        self.file.write( text )
+        self.file.flush()
+        self.seconds["serialize"] += serialized-start
+        self.seconds["write"] += time.perf_counter()-serialized
+        self.bytes += len( text )
+        return True
+
+
+class _TimedFetches:
+    """ Replaces the fetch functions of a runner module by timed ones. """
+    def __init__( self, module ):
+        self.module = module
+        self.seconds = 0.0
+        self.bytes = 0
+        self.originals = { name: function for name, function in vars( module ).items()
+                           if name.startswith( "AgMD2_" ) and "Fetch" in name and callable( function ) }
+
+    def _Timed( self, function ):
+        def timed( *args, **kwargs ):
+            start = time.perf_counter()
+            fetch = function( *args, **kwargs )
+            self.seconds += time.perf_counter()-start
+            self.bytes += ObjectBytes( fetch )
+            return fetch
+        return timed
+
+    def __enter__( self ):
+        for name, function in self.originals.items():
+            setattr( self.module, name, self._Timed( function ) )
+        return self
+
+    def __exit__( self, *exc ):
+        for name, function in self.originals.items():
+            setattr( self.module, name, function )
+
+
+@contextmanager
+def _Quiet( module ):
+    """ Silences what module prints on stderr, like the information of Initialize. """
+    saved = module.stderr
+    module.stderr = StringIO()
+    try:
+        yield
+    finally:
+        module.stderr = saved
+
+
+def _Runner():
+    """ Returns the runnermd2 module, using the simulated digitizer. """
+    environ["WAVEFORMS_SIMULATE"] = "1"
+    from digitizer import runnermd2
+    return runnermd2
+
+
+def RunCase( mode, records, samples, channels, loops=20, warmup=2, model="M9703B", averages=8, readType=None, file=None ):
+    """ Runs loops acquisitions after warmup ones, and returns their statistics.
+
+    >>> case = RunCase( "DGT", 4, 256, 2, loops=3, warmup=1 )
+    >>> print( case["mode"], case["records"], case["samples"], case["channels"], case["loops"] )
+    DGT 4 256 2 3
+    >>> print( sorted( case["stages"] )==sorted( STAGES ), case["fetched_bytes"]>=3*2*4*256*2 )
+    True True
+    """
+    runner = _Runner()
+    argv = ["SIM::"+model, "-nc", "-m", mode, "-r", str( records ), "-s", str( samples ), "-l", str( loops ),
+            "-rc"] + [str( ch ) for ch in range( 1, channels+1 )]
+    if mode=='AVG':
+        argv += ["-a", str( averages )]
+    if readType:
+        argv += ["-rt", readType]
+    args = DigitizerArgs( argv=argv )
+
+    output = open( devnull, "w" ) if file is None else file
+    with _Quiet( runner ):
+        vis = runner.Initialize( args, "" )
+    try:
+        with _Quiet( runner ):
+            runner.ApplyArgs( vis, args )
+        runner._Continue = True
+        queue = Queue()
+        sink = TimingSink( output )
+        telemetry = Telemetry( "Benchmark", interval=None, file=None )
+        with _TimedFetches( runner ) as fetches:
+            for loop in range( warmup+loops ):
+                if loop==warmup:
+                    telemetry.Reset()
+                    fetches.bytes = 0
+                    sink.bytes = 0
+                fetched, serialize, write = fetches.seconds, sink.seconds["serialize"], sink.seconds["write"]
+                start = time.perf_counter()
+                if not runner.Acquire( vis, args, queue, loop ):
+                    raise RuntimeError( "ERROR: Acquisition failed in "+mode+" mode." )
+                acquired = time.perf_counter()
+                runner.FetchChannels( vis, args, sink )
+                done = time.perf_counter()
+                if loop<warmup:
+                    continue
+                seconds = { "acquire":   acquired-start,
+                            "fetch":     fetches.seconds-fetched,
+                            "serialize": sink.seconds["serialize"]-serialize,
+                            "write":     sink.seconds["write"]-write }
+                seconds["record"] = max( 0.0, done-acquired-seconds["fetch"]-seconds["serialize"]-seconds["write"] )
+                for stage in STAGES:
+                    telemetry.Add( stage, seconds[stage] )
+                telemetry.Count( "acquisitions" )
+                telemetry.Count( "records", args.read_records )
+        report = telemetry.Report()
+    finally:
+        runner.Close( vis )
+        if file is None:
+            output.close()
+
+    elapsed = report["interval"]
+    return { "mode": mode, "records": records, "samples": samples, "channels": channels, "loops": loops,
+             "stages": { stage: dict( stats, total_ms=stats["count"]*stats["mean_ms"] ) for stage, stats in report["stages"].items() },
+             "seconds": elapsed,
+             "acquisitions_per_s": loops/elapsed,
+             "records_per_s": report["totals"]["records"]/elapsed,
+             "fetched_bytes": fetches.bytes,
+             "output_bytes": sink.bytes,
+             "fetch_MBps": fetches.bytes/elapsed/1e6,
+             "output_MBps": sink.bytes/elapsed/1e6 }
+
+
+def Revision():
+    """ Returns the git revision of the tree, or None. """
+    try:
+        result = run( ["git", "describe", "--always", "--dirty"], cwd=path.dirname( path.abspath( __file__ ) ),
+                      capture_output=True, text=True, timeout=10 )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def CaseKey( case ):
+    return ( case["mode"], case["records"], case["samples"], case["channels"] )
+
+
+def FormatCase( case ):
+    stages = " ".join( "%s %.2f" % ( stage, case["stages"][stage]["mean_ms"] ) for stage in STAGES if stage in case["stages"] )
+    return "%-3s r=%-6d s=%-8d c=%d | %s ms | %.1f rec/s %.1f MB/s" % ( CaseKey( case )+( stages, case["records_per_s"], case["fetch_MBps"] ) )
+
+
+def Compare( base, results ):
+    """ Returns the lines comparing the fetch MB/s of the cases of results with
+        the ones of base.
+
+    >>> base = { "revision": "a", "cases": [{ "mode": "DGT", "records": 1, "samples": 1024, "channels": 1, "fetch_MBps": 100.0 }] }
+    >>> new  = { "revision": "b", "cases": [{ "mode": "DGT", "records": 1, "samples": 1024, "channels": 1, "fetch_MBps": 125.0 },
+    ...                                     { "mode": "AVG", "records": 1, "samples": 1024, "channels": 1, "fetch_MBps": 50.0 }] }
+    >>> for line in Compare( base, new ):
+    ...     print( line )
+    DGT r=1      s=1024     c=1 | 100.0 -> 125.0 MB/s +25.0%
+    """
+    baseCases = { CaseKey( case ): case for case in base.get( "cases", [] ) }
+    lines = []
+    for case in results.get( "cases", [] ):
+        old = baseCases.get( CaseKey( case ) )
+        if old is None:
+            continue
+        change = ( case["fetch_MBps"]/old["fetch_MBps"]-1.0 )*100 if old["fetch_MBps"] else 0.0
+        lines.append( "%-3s r=%-6d s=%-8d c=%d | %.1f -> %.1f MB/s %+.1f%%" % ( CaseKey( case )+( old["fetch_MBps"], case["fetch_MBps"], change ) ) )
+    return lines
+
+
+def _Results( settings ):
+    return { "revision": Revision(),
+             "time": time.time(),
+             "python": platform.python_version(),
+             "numpy": numpy.__version__,
+             "platform": platform.platform(),
+             "settings": settings }
+
+
+def Benchmark( modes, records, samples, channels, loops=20, warmup=2, model="M9703B", averages=8, readType=None, latency=0.0, file=None, log=stderr ):
+    """ Runs the cases of the sweep, and returns the results. """
+    environ["WAVEFORMS_SIMULATE_LATENCY"] = str( latency )
+    results = _Results( { "model": model, "loops": loops, "warmup": warmup, "averages": averages, "read_type": readType, "latency": latency } )
+    results["cases"] = []
+    for mode, nbrChannels, nbrRecords, nbrSamples in product( modes, channels, records, samples ):
+        case = RunCase( mode, nbrRecords, nbrSamples, nbrChannels, loops, warmup, model, averages, readType, file )
+        results["cases"].append( case )
+        if log:
+            print( FormatCase( case ), file=log, flush=True )
+    return results
+
+
+def UnpackRate( bits, samples=8*1024*1024, loops=5 ):
+    """ Returns the samples/s UnpackSamples converts from elements packed with
+        bits bits, to a preallocated array, as StreamWaveform does.
+
+    >>> UnpackRate( 12, samples=8192, loops=2 )>0
+    True
+    """
+    rng = numpy.random.default_rng( 0 )
+    elements = PackSamples( rng.integers( -2**15, 2**15, samples ).astype( numpy.int16 ), bits )
+    out = numpy.empty( samples, dtype=numpy.int16 )
+    UnpackSamples( elements, bits, out=out )
+    start = time.perf_counter()
+    for loop in range( loops ):
+        UnpackSamples( elements, bits, out=out )
+    return samples*loops/( time.perf_counter()-start )
+
+
+def UnpackBenchmark( bits, streamRate, loops=5, log=stderr ):
+    """ Measures the unpacking of packed stream elements against the sample rate of the stream. """
+    results = _Results( { "loops": loops, "stream_rate": streamRate } )
+    results["unpack"] = []
+    for nbrBits in bits:
+        rate = UnpackRate( nbrBits, loops=loops )
+        results["unpack"].append( { "bits": nbrBits, "samples_per_s": rate, "stream_ratio": rate/streamRate } )
+        if log:
+            print( "%d-bit unpack: %.1f MS/s, %.2f times a stream of %.1f MS/s" % ( nbrBits, rate/1e6, rate/streamRate, streamRate/1e6 ), file=log, flush=True )
+    return results
+
+
+def main():
+    parser = ArgumentParser( "Acquisition Benchmark" )
+    parser.add_argument( "--modes", "-m",    nargs='+', type=str,   default=['DGT'], choices=['DGT', 'AVG', 'DDC'] )
+    parser.add_argument( "--records", "-r",  nargs='+', type=int,   default=[1, 100] )
+    parser.add_argument( "--samples", "-s",  nargs='+', type=int,   default=[1024, 65536] )
+    parser.add_argument( "--channels", "-c", nargs='+', type=int,   default=[1, 2] )
+    parser.add_argument( "--loops", "-l",               type=int,   default=20 )
+    parser.add_argument( "--warmup", "-w",              type=int,   default=2 )
+    parser.add_argument( "--model",                     type=str,   default="M9703B" )
+    parser.add_argument( "--averages", "-a",            type=int,   default=8 )
+    parser.add_argument( "--read-type", "-rt",          type=str,   default=None, choices=['int8', 'int16', 'real64'] )
+    parser.add_argument( "--latency",                   type=float, default=0.0, help="Simulated acquisition duration, in seconds" )
+    parser.add_argument( "--unpack",            nargs='+', type=int,   default=None, help="Measures the unpacking of samples of these bits instead" )
+    parser.add_argument( "--stream-rate",               type=float, default=1e9, help="Samples/s of the stream the unpacking has to keep up with" )
+    parser.add_argument( "--write-to",                  type=str,   default=devnull, help="File the output is written to" )
+    parser.add_argument( "--output", "-o",              type=str,   default=None, help="JSON file of the results" )
+    parser.add_argument( "--compare",                   type=str,   default=None, help="JSON file of results to compare with" )
+    args = parser.parse_args()
+
+    if args.unpack:
+        results = UnpackBenchmark( args.unpack, args.stream_rate )
+    else:
+        with open( args.write_to, "w" ) as file:
+            results = Benchmark( args.modes, args.records, args.samples, args.channels, args.loops, args.warmup,
+                                 args.model, args.averages, args.read_type, args.latency, file )
+
+    if args.output:
+        with open( args.output, "w" ) as f:
+            json.dump( results, f, indent=1 )
+
+    if args.compare:
+        with open( args.compare ) as f:
+            base = json.load( f )
+        print( "Compared with", base.get( "revision" ), file=stdout )
+        for line in Compare( base, results ):
+            print( line, file=stdout )
+
+
+if __name__=="__main__":
+    main()
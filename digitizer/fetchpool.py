@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+from concurrent.futures import ThreadPoolExecutor
+from waveforms.sink import ObjectBytes
+import time
+
+
+""" The fetchpool module fetches the data of several instruments at once.
+
+    The runners fetch the channels of their instruments one after the other,
+    even though each instrument transfers its data on a link of its own. A
+    FetchPool issues the fetches of the instruments on threads, and returns
+    the fetched data in the order of the calls, whatever the order in which
+    they complete:
+
+    pool = FetchPool( threads=4 )
+    fetchs = pool.Fetch( [( vi, Fetch, ( vi, "Channel%d"%( ch ), ... ) ) for vi in vis for ch in channels] )
+    print( pool.Report(), file=stderr )
+    pool.Close()
+
+    The calls of an instrument are issued one after the other on the same
+    thread, as most drivers serialize the calls to a session anyway. With
+    perChannel, each call has a thread of its own. With a Telemetry, the
+    fetches are timed as the fetch stage, and their bytes counted as fetched.
+
+"""
+
+
+class FetchPool:
+    """ Calls the fetch functions on a pool of threads, and returns their
+        results in the order of the calls.
+
+        A call is a tuple ( key, function, args ). The calls of the same key,
+        the vi of the instrument, are issued in order on a single thread.
+        Without threads, or with a single one, the calls are issued by Fetch
+        itself. When calls fail, Fetch waits for the others to complete, and
+        raises the error of the first one.
+
+    >>> from time import sleep
+    >>> pool = FetchPool( threads=2 )
+    >>> pool.Fetch( [( vi, lambda vi, ch: sleep( 0.01*( 2-vi ) ) or ( vi, ch ), ( vi, ch ) ) for vi in ( 1, 2 ) for ch in ( 1, 2 )] )
+    [(1, 1), (1, 2), (2, 1), (2, 2)]
+    >>> pool.Fetch( [( 1, int, ( "x", ) ), ( 2, int, ( "2", ) )] )
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid literal for int() with base 10: 'x'
+    >>> print( pool.loops, pool.tasks )
+    2 2
+    >>> pool.Close()
+    """
+    def __init__( self, threads=0, perChannel=False, telemetry=None ):
+        self.threads = threads
+        self.perChannel = perChannel
+        self.telemetry = telemetry
+        self.executor = ThreadPoolExecutor( max_workers=threads, thread_name_prefix="Fetch" ) if threads>1 else None
+        self.seconds = 0.0
+        self.total = 0.0
+        self.loops = 0
+        self.tasks = 0
+
+    def _Task( self, calls, results ):
+        """ Issues calls, a list of ( index, function, args ), and stores
+            their results at their index. Returns the first error, if any.
+        """
+        for index, function, args in calls:
+            try:
+                results[index] = function( *args )
+            except Exception as e:
+                return e
+        return None
+
+    def Fetch( self, calls ):
+        """ Issues the calls, and returns the list of their results. """
+        start = time.perf_counter()
+        results = [None]*len( calls )
+        tasks = {}
+        for index, ( key, function, args ) in enumerate( calls ):
+            tasks.setdefault( index if self.perChannel else key, [] ).append( ( index, function, args ) )
+        try:
+            if self.executor is None or len( tasks )<=1:
+                errors = [self._Task( task, results ) for task in tasks.values()]
+            else:
+                futures = [self.executor.submit( self._Task, task, results ) for task in tasks.values()]
+                errors = [future.result() for future in futures]
+        finally:
+            self.seconds = time.perf_counter()-start
+            self.total += self.seconds
+            self.loops += 1
+            self.tasks = len( tasks )
+        for error in errors:
+            if error is not None:
+                raise error
+        if self.telemetry is not None:
+            self.telemetry.Add( "fetch", self.seconds )
+            self.telemetry.Count( "fetched", ObjectBytes( results ) )
+        return results
+
+    def Report( self ):
+        """ Returns the line reporting the time of the last fetch. """
+        return "Fetch: %.3f ms in %d tasks on %d threads, %.3f ms per loop" % ( self.seconds*1e3, self.tasks, max( self.threads, 1 ), self.total*1e3/max( self.loops, 1 ) )
+
+    def Close( self ):
+        """ Stops the threads. """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def FetchPoolArgs( args, telemetry=None ):
+    """ FetchPool using the options of DigitizerParser. A --fetch-threads of
+        0 or 1 fetches without threads.
+    """
+    return FetchPool( getattr( args, 'fetch_threads', 0 ), perChannel=getattr( args, 'fetch_per_channel', False ), telemetry=telemetry )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
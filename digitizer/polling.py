@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+import time
+
+
+""" The polling module waits for the completion of the acquisitions.
+
+    Polling the digitizer at a fixed interval either wastes CPU, when the
+    interval is short, or delays the detection of the completion, when it is
+    long. An AdaptivePoller sleeps most of the expected duration of the
+    acquisition, then polls with intervals growing exponentially:
+
+    poller = AdaptivePoller( ExpectedDuration( records, samples, sampleRate, triggerRate ) )
+    if not poller.Poll( lambda: AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_IS_IDLE )==AGMD2_VAL_ACQUISITION_STATUS_RESULT_TRUE, timeout ):
+        AgMD2_Abort( vi )
+
+    The poller records the number of polls, and the latency of the detection,
+    of each acquisition, and adds them to a Telemetry when given.
+
+"""
+
+
+def ExpectedDuration( records, samples, sampleRate, triggerRate=None, averages=1 ):
+    """ Returns the expected duration in seconds of an acquisition of records
+        of samples at sampleRate, with triggerRate triggers per second when
+        known. Each record of the averager takes averages triggers.
+
+    >>> print( ExpectedDuration( 100, 1000, 1e9 ), ExpectedDuration( 100, 1000, 1e9, triggerRate=10e3 ) )
+    0.0001 0.01
+    """
+    triggers = records*max( averages or 1, 1 )
+    duration = triggers*samples/sampleRate if sampleRate else 0.0
+    if triggerRate:
+        duration = max( duration, triggers/triggerRate )
+    return duration
+
+
+class AdaptivePoller:
+    """ Polls for the completion of an acquisition of the expected duration.
+
+        The poller first sleeps fraction of expected, then polls after first
+        seconds, and after intervals growing by factor up to maximum. The
+        latency is the time between the last poll that did not find the
+        acquisition complete, or the start, and the poll that did: the
+        completion happened in between.
+
+    >>> polls = iter( [False, False, True] )
+    >>> poller = AdaptivePoller( expected=0.0, first=0.001 )
+    >>> print( poller.Poll( lambda: next( polls ), 1.0 ), poller.polls, poller.latency<0.01 )
+    True 3 True
+    >>> print( poller.Poll( lambda: False, 0.005 ), poller.timeouts )
+    False 1
+    >>> poller = AdaptivePoller( expected=10.0 )
+    >>> print( poller.Poll( lambda: False, 10.0, keepGoing=lambda: False ), poller.duration<0.1 )
+    False True
+    """
+    def __init__( self, expected=0.0, fraction=0.9, first=50e-6, factor=2.0, maximum=0.01, telemetry=None ):
+        self.expected = expected
+        self.fraction = fraction
+        self.first = first
+        self.factor = factor
+        self.maximum = maximum
+        self.telemetry = telemetry
+        self.polls = 0
+        self.latency = 0.0
+        self.duration = 0.0
+        self.loops = 0
+        self.timeouts = 0
+
+    def Poll( self, isComplete, timeout, keepGoing=None ):
+        """ Calls isComplete until it returns True, for at most timeout
+            seconds, or until keepGoing returns False. Returns whether the
+            acquisition is complete. The first sleep is cut in intervals of
+            maximum, keepGoing being checked between them.
+        """
+        start = time.perf_counter()
+        end = start+max( 0.0, min( self.expected*self.fraction, timeout ) )
+        while keepGoing is None or keepGoing():
+            now = time.perf_counter()
+            if now>=end:
+                break
+            time.sleep( min( end-now, self.maximum ) )
+        previous = start
+        interval = self.first
+        polls = 0
+        while True:
+            polls += 1
+            complete = isComplete()
+            now = time.perf_counter()
+            if complete or now-start>=timeout or ( keepGoing is not None and not keepGoing() ):
+                break
+            previous = now
+            time.sleep( min( interval, self.maximum, max( 0.0, start+timeout-now ) ) )
+            interval *= self.factor
+
+        self.polls = polls
+        self.duration = now-start
+        self.latency = now-previous if complete else 0.0
+        self.loops += 1
+        if not complete:
+            self.timeouts += 1
+        if self.telemetry is not None:
+            self.telemetry.Count( "polls", polls )
+            if complete:
+                self.telemetry.Add( "poll-latency", self.latency )
+        return complete
+
+    def Report( self ):
+        """ Returns the line reporting the last poll. """
+        return "Poll: %d polls in %.3f ms, latency %.3f ms, expected %.3f ms, %d timeouts" % ( self.polls, self.duration*1e3, self.latency*1e3, self.expected*1e3, self.timeouts )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
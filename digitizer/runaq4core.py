@@ -12,17 +12,26 @@
 """
 
 
-from Aq4Core import *
+from digitizer.simulated import UseSimulation
+if UseSimulation( "Aq4Core" ):
+    from digitizer.simulated import *
+else:
+    from Aq4Core import *
 from waveforms.trace import OutputTrace, OutputTraces
 from waveforms import Record, MultiRecord
-from digitizer.argparser import DigitizerArgs, RefreshArgs
+from digitizer.argparser import DigitizerArgs, RefreshArgs, FetchRange
 from digitizer.outputwaveform import OutputWaveforms, OutputMultiWaveforms
 from sys import stdin, stdout, stderr
 from time import sleep
 from signal import signal, SIGTERM, SIGINT
 from threading import Thread
 from queue import Queue
-from numpy import empty, int8, int16, float64
+from waveforms.sink import OutputSinkArgs, ObjectBytes
+from waveforms.telemetry import Telemetry, TelemetryArgs, TimedOutput
+from digitizer.attrcache import AttributeCache
+from digitizer.polling import AdaptivePoller, ExpectedDuration
+from numpy import empty, zeros, int8, int16, float64
+from waveforms.packed import UnpackSamples
 from datetime import datetime
 import json
 
@@ -104,6 +113,7 @@ def Close( vis ):
         for vi in vis:
             try: vi.Close()
             except: pass
+            _Cache.Invalidate( vi )
 
 
 def ShowInfo( vis ):
@@ -122,6 +132,7 @@ def Reset( vis ):
     for vi in vis:
         for vi in vis:
             vi.Utility.ResetWithDefaults()
+            _Cache.Invalidate( vi )
 
 
 lastFirmwareRevision = None
@@ -134,29 +145,29 @@ def ApplyArgs( vis, args ):
         #    vi.Acquisition.Abort()
         # Manages the clocking scheme
         if args.clock_external:
-            vi.SampleClock.Source = SampleClockSource.External
-            vi.SampleClock.ExternalFrequency = args.clock_external
-            vi.SampleClock.ExternalDivider =       args.clock_ext_divider      
+            _Cache.Assign( vi, "SampleClock.Source", SampleClockSource.External )
+            _Cache.Assign( vi, "SampleClock.ExternalFrequency", args.clock_external )
+            _Cache.Assign( vi, "SampleClock.ExternalDivider", args.clock_ext_divider )
         else:
-            vi.SampleClock.Source = SampleClockSource.Internal
+            _Cache.Assign( vi, "SampleClock.Source", SampleClockSource.Internal )
             if args.clock_ref_external:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.External
-                vi.ReferenceOscillator.ExternalFrequency = 10e6
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.External )
+                _Cache.Assign( vi, "ReferenceOscillator.ExternalFrequency", 10e6 )
             elif args.clock_ref_pxi:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.PxiExpressClk100
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.PxiExpressClk100 )
             elif args.clock_ref_axie:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.AXIeClk100
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.AXIeClk100 )
             else:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.Internal
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.Internal )
 
         # Manages sample rate
         if args.sampling_frequency:
-            vi.Acquisition.SampleRate = args.sampling_frequency
+            _Cache.Assign( vi, "Acquisition.SampleRate", args.sampling_frequency )
 
         if args.disable_channel1:
-            vi.Channels["Channel1"].Enabled = False
+            _Cache.Assign( vi, "Channels[].Enabled", False, "Channel1" )
         if args.disable_channel2:
-            vi.Channels["Channel2"].Enabled = False
+            _Cache.Assign( vi, "Channels[].Enabled", False, "Channel2" )
 
         # Manages TSR
         if args.tsr:
@@ -169,10 +180,10 @@ def ApplyArgs( vis, args ):
         # Manages conbination
         if args.interleave:
             ch, sub = args.interleave[:2]
-            vi.Channels["Channel%d"%( ch )].TimeInterleavedChannelList = "Channel%d"%( sub )
+            _Cache.Assign( vi, "Channels[].TimeInterleavedChannelList", "Channel%d"%( sub ), "Channel%d"%( ch ) )
         else:
             for ch in vi.Channels:
-                ch.TimeInterleavedChannelList = ""
+                _Cache.Assign( vi, "Channels[].TimeInterleavedChannelList", "", ch.Name )
         args.sampling_frequency = vi.Acquisition.SampleRate # Get SampleRate from instrument as it may have been changed by the interleaving
 
         # Manages streaming
@@ -180,15 +191,15 @@ def ApplyArgs( vis, args ):
             print( "Streaming Not supported", file=stderr )
 
         # Manages records
-        vi.Acquisition.RecordSize = args.samples
-        vi.Acquisition.NumberOfRecordsToAcquire = args.records
+        _Cache.Assign( vi, "Acquisition.RecordSize", args.samples )
+        _Cache.Assign( vi, "Acquisition.NumberOfRecordsToAcquire", args.records )
         assert args.records == vi.Acquisition.NumberOfRecordsToAcquire
 
         # Manages trigger
         if args.immediate_trigger:
             ActiveTrigger = "Immediate"
             if args.trigger_level!=None:
-                vi.Trigger.Sources["Internal1"].Level = args.trigger_level
+                _Cache.Assign( vi, "Trigger.Sources[].Level", args.trigger_level, "Internal1" )
         else:
             if args.trigger_name:
                 ActiveTrigger = args.trigger_name
@@ -200,104 +211,104 @@ def ApplyArgs( vis, args ):
                 ActiveTrigger = "Internal1"
 
             if args.trigger_level!=None:
-                vi.Trigger.Sources[ActiveTrigger].Level = args.trigger_level
+                _Cache.Assign( vi, "Trigger.Sources[].Level", args.trigger_level, ActiveTrigger )
             if args.trigger_delay!=None:
-                vi.Trigger.Delay = args.trigger_delay
+                _Cache.Assign( vi, "Trigger.Delay", args.trigger_delay )
             if args.trigger_slope!=None:
-                vi.Trigger.Sources[ActiveTrigger].Edge.Slope = TriggerSlope.Negative if args.trigger_slope in ["negative", "n"] else TriggerSlope.Positive
+                _Cache.Assign( vi, "Trigger.Sources[].Edge.Slope", TriggerSlope.Negative if args.trigger_slope in ["negative", "n"] else TriggerSlope.Positive, ActiveTrigger )
 
-        vi.Trigger.ActiveSource = ActiveTrigger
+        _Cache.Assign( vi, "Trigger.ActiveSource", ActiveTrigger )
 
         if args.trigger_output_enabled!=None:
-            vi.Trigger.OutputEnabled = args.trigger_output_enabled
+            _Cache.Assign( vi, "Trigger.OutputEnabled", args.trigger_output_enabled )
         if args.trigger_output_source!=None:
-            vi.Trigger.Output.Source = args.trigger_output_source
+            _Cache.Assign( vi, "Trigger.Output.Source", args.trigger_output_source )
         if args.trigger_output_offset!=None:
-            vi.Trigger.Output.Offset = args.trigger_output_offset
+            _Cache.Assign( vi, "Trigger.Output.Offset", args.trigger_output_offset )
 
         # Manages ZeroSuppress
         if args.zero_suppress:
-            vi.Acquisition.DataReductionMode = DataReductionMode.ZeroSuppress
+            _Cache.Assign( vi, "Acquisition.DataReductionMode", DataReductionMode.ZeroSuppress )
             for ch in vi.Channels:
-                ch.ZeroSuppress.Threshold =       0   if args.zs_threshold      is None else args.zs_threshold
-                ch.ZeroSuppress.Hysteresis =      248 if args.zs_hysteresis     is None else args.zs_hysteresis
-                ch.ZeroSuppress.ZeroValue =       0   if args.zs_zero_value     is None else args.zs_zero_value
-                ch.ZeroSuppress.PreGateSamples =  0   if args.pre_gate_samples  is None else args.pre_gate_samples
-                ch.ZeroSuppress.PostGateSamples = 0   if args.post_gate_samples is None else args.post_gate_samples
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.Threshold",       0   if args.zs_threshold      is None else args.zs_threshold,      ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.Hysteresis",      248 if args.zs_hysteresis     is None else args.zs_hysteresis,     ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.ZeroValue",       0   if args.zs_zero_value     is None else args.zs_zero_value,     ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.PreGateSamples",  0   if args.pre_gate_samples  is None else args.pre_gate_samples,  ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.PostGateSamples", 0   if args.post_gate_samples is None else args.post_gate_samples, ch.Name )
                 #if args.zero_value:
                 #    ch.ZeroSuppress.ZeroValue = args.zero_value
 
         # Manages channels
         for ch in vi.Channels:
             if args.vertical_range!=None:
-                ch.Range = args.vertical_range
+                _Cache.Assign( vi, "Channels[].Range", args.vertical_range, ch.Name )
             if args.vertical_offset!=None:
-                ch.Offset = args.vertical_offset
+                _Cache.Assign( vi, "Channels[].Offset", args.vertical_offset, ch.Name )
             if args.input_max_frequency:
-                ch.Filter.Bypass = False
-                ch.Filter.MaxFrequency = args.input_max_frequency
+                _Cache.Assign( vi, "Channels[].Filter.Bypass", False, ch.Name )
+                _Cache.Assign( vi, "Channels[].Filter.MaxFrequency", args.input_max_frequency, ch.Name )
             if args.bypass_anti_aliasing is not None:
-                ch.Filter.BypassAntiAliasing = args.bypass_anti_aliasing
+                _Cache.Assign( vi, "Channels[].Filter.BypassAntiAliasing", args.bypass_anti_aliasing, ch.Name )
             if args.no_bypass_moving_average is not None:
-                ch.Filter.BypassMovingAverage = not args.no_bypass_moving_average
+                _Cache.Assign( vi, "Channels[].Filter.BypassMovingAverage", not args.no_bypass_moving_average, ch.Name )
             #ch.BaselineCorrection.Mode = 1
             if args.data_inversion:
-                ch.DataInversionEnabled = True
+                _Cache.Assign( vi, "Channels[].DataInversionEnabled", True, ch.Name )
         #vi.Channels["Channel1"].Filter.BypassAntiAliasing = True
         #vi.Channels["Channel2"].Filter.BypassAntiAliasing = True
 
         if args.channel_sampling_delay_1:
-            vi.Channels['Channel1'].SamplingDelay = args.channel_sampling_delay_1
+            _Cache.Assign( vi, "Channels[].SamplingDelay", args.channel_sampling_delay_1, 'Channel1' )
         if args.channel_sampling_delay_2:
-            vi.Channels['Channel2'].SamplingDelay = args.channel_sampling_delay_2
+            _Cache.Assign( vi, "Channels[].SamplingDelay", args.channel_sampling_delay_2, 'Channel2' )
 
         if args.calibration_signal!=None:
-            vi.Calibration.UserSignal = args.calibration_signal
+            _Cache.Assign( vi, "Calibration.UserSignal", args.calibration_signal )
 
         if args.equalization:
-            vi.Calibration.Equalization = CalibrationEqualization.SharpRollOff if args.equalization=="Sharp" else \
-                                          CalibrationEqualization.SmoothRollOff if args.equalization=="Smooth" else \
-                                          CalibrationEqualization.Custom if args.equalization=="Custom" else 0
+            equalization = CalibrationEqualization.SharpRollOff if args.equalization=="Sharp" else \
+                           CalibrationEqualization.SmoothRollOff if args.equalization=="Smooth" else \
+                           CalibrationEqualization.Custom if args.equalization=="Custom" else 0
+            _Cache.Assign( vi, "Calibration.Equalization", equalization )
 
         # Manages ControlIO
         if args.control_io1 or args.control_io2 or args.control_io3:
-            for ctrlio, iosignal in zip( [vi.ControlIOs[0], vi.ControlIOs[1], vi.ControlIOs[2]], [args.control_io1, args.control_io2, args.control_io3] ):
+            for ctrlio, iosignal in enumerate( [args.control_io1, args.control_io2, args.control_io3] ):
                 if iosignal:
-                    ctrlio.Signal = iosignal
+                    _Cache.Assign( vi, "ControlIOs[].Signal", iosignal, ctrlio )
                     #ctrlio.OutSoftwareState = 0
 
         # Manages SelfTrigger
         if args.self_trigger_square_wave:
-            st = vi.Trigger.Sources["SelfTrigger"]
-            st.SelfTrigger.Mode = SelfTriggerMode.SquareWave
-            st.SelfTrigger.SquareWave.Frequency = args.self_trigger_wave_frequency
-            st.SelfTrigger.SquareWave.DutyCycle = args.self_trigger_wave_duty_cycle
+            _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", SelfTriggerMode.SquareWave, "SelfTrigger" )
+            _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.Frequency", args.self_trigger_wave_frequency, "SelfTrigger" )
+            _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.DutyCycle", args.self_trigger_wave_duty_cycle, "SelfTrigger" )
         elif args.self_trigger_armed_pulse:
-            st = vi.Trigger.Sources["SelfTrigger"]
             try: # Either we have the armed pulse mode and pulse duration attribute, or we revert to AgMD2-2.4 hack
-                st.SelfTrigger.Mode = SelfTriggerMode.ArmedPulse
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", SelfTriggerMode.ArmedPulse, "SelfTrigger" )
                 if args.self_trigger_pulse_duration!=None:
-                    st.SelfTrigger.PulseDuration = args.self_trigger_pulse_duration
+                    _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.PulseDuration", args.self_trigger_pulse_duration, "SelfTrigger" )
             except AttributeError as e:
                 print( "ERROR for Armed Pulse", e, file=stderr )
-                st.SelfTrigger.Mode = SelfTriggerMode.SquareWave
-                st.SelfTrigger.SquareWave.Frequency = args.self_trigger_wave_frequency
-                st.SelfTrigger.SquareWave.DutyCycle = args.self_trigger_wave_duty_cycle
-                st.SelfTrigger.Mode = 2 # SelfTriggerMode.ArmedPulse
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", SelfTriggerMode.SquareWave, "SelfTrigger" )
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.Frequency", args.self_trigger_wave_frequency, "SelfTrigger" )
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.DutyCycle", args.self_trigger_wave_duty_cycle, "SelfTrigger" )
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", 2, "SelfTrigger" ) # SelfTriggerMode.ArmedPulse
 
         if args.timestamp_reset and args.timestamp_reset != 'OnInitiate':
             #vi.TimeReference.ResetMode =    TimeResetMode.OnTriggerEnable if args.timestamp_reset == "OnTriggerEnable" \
             #                           else TimeResetMode.OnFirstTrigger  if args.timestamp_reset == "OnFirstTrigger"  \
             #                           else TimeResetMode.Immediate
-            vi.TimeReference.ResetMode =    TimeResetMode.OnTriggerEnable if args.timestamp_reset == "OnTriggerEnable" \
-                                       else TimeResetMode.OnFirstTrigger  if args.timestamp_reset == "OnFirstTrigger"  \
-                                       else TimeResetMode.Immediate
+            resetMode =    TimeResetMode.OnTriggerEnable if args.timestamp_reset == "OnTriggerEnable" \
+                      else TimeResetMode.OnFirstTrigger  if args.timestamp_reset == "OnFirstTrigger"  \
+                      else TimeResetMode.Immediate
+            _Cache.Assign( vi, "TimeReference.ResetMode", resetMode )
 
         # Manages the calibration offset target
         if args.cal_offset_target!=None:
-            vi.Calibration.TargetVoltageEnabled = True
+            _Cache.Assign( vi, "Calibration.TargetVoltageEnabled", True )
             for ch in vi.Channels:
-                ch.CalibrationTargetVoltage = args.cal_offset_target
+                _Cache.Assign( vi, "Channels[].CalibrationTargetVoltage", args.cal_offset_target, ch.Name )
 
         if args.no_digital_gain:
             vi.Private.PrivateCalibration.SetCalibrationValueBoolean( "DigitalGain:Disable", True )
@@ -313,21 +324,22 @@ def ApplyArgs( vis, args ):
 
         if args.dump_cal_waveforms:
             for step in args.dump_cal_waveforms:
-                vi.Calibration.Steps[step].DumpWaveforms = True
+                _Cache.Assign( vi, "Calibration.Steps[].DumpWaveforms", True, step )
         if args.disable_cal_steps:
             for step in args.disable_cal_steps:
-                vi.Calibration.Steps[step].Enabled = False
+                _Cache.Assign( vi, "Calibration.Steps[].Enabled", False, step )
 
         if args.analog_output_range_1:
-            vi.ControlIOs['AnalogOut1'].Analog.Range = args.analog_output_range_1
+            _Cache.Assign( vi, "ControlIOs[].Analog.Range", args.analog_output_range_1, 'AnalogOut1' )
         if args.analog_output_level_1:
-            vi.ControlIOs['AnalogOut1'].Analog.Level = args.analog_output_level_1
+            _Cache.Assign( vi, "ControlIOs[].Analog.Level", args.analog_output_level_1, 'AnalogOut1' )
         if args.analog_output_range_2:
-            vi.ControlIOs['AnalogOut2'].Analog.Range = args.analog_output_range_2
+            _Cache.Assign( vi, "ControlIOs[].Analog.Range", args.analog_output_range_2, 'AnalogOut2' )
         if args.analog_output_level_2:
-            vi.ControlIOs['AnalogOut2'].Analog.Level = args.analog_output_level_2
+            _Cache.Assign( vi, "ControlIOs[].Analog.Level", args.analog_output_level_2, 'AnalogOut2' )
 
         vi.Acquisition.ApplySetup()
+        _Poller.expected = ExpectedDuration( args.records, args.samples, vi.Acquisition.SampleRate, args.expected_trigger_rate, args.averages if args.mode=='AVG' else 1 )
 
         if args.analog_output_output_1:
             vi.ControlIOs['AnalogOut1'].Analog.WriteOutput( args.analog_output_output_1 )
@@ -369,6 +381,8 @@ def Calibrate( vis, args, loop, force ):
             print( e, file=stderr )
             if args.calibrate_fails:
                 raise
+        # The calibration may change attributes behind the cache.
+        _Cache.Invalidate( vi )
 
         if args.calibration_signal:
             vi.Private.PrivateCalibration.UserSignal = "Signal"+args.calibration_signal
@@ -391,21 +405,17 @@ def Acquire( vis, args, queue, loop ):
     while True:
         # Manages wait/poll
         if args.poll_timeout:
-            for vi in vis:
-                acqDone = False
-                fullwait = float( args.poll_timeout )
-                while fullwait>=0.0 and _Continue and queue.empty() and not acqDone:
-                    oncewait = min( 0.2, fullwait )
-                    sleep( oncewait/1000.0 )
-                    fullwait = fullwait-oncewait
-                    isIdle = vi.Acquisition.Status.IsIdle
-                    acqDone = isIdle==AcquisitionStatusResult.ResultTrue
-                    nn = vi.Acquisition.NumberOfAcquiredRecords
-                if acqDone:
-                    return True
-                else:
+            # The timeout is in ms.
+            isIdle = lambda: all( vi.Acquisition.Status.IsIdle==AcquisitionStatusResult.ResultTrue for vi in vis )
+            acqDone = _Poller.Poll( isIdle, args.poll_timeout/1000.0, lambda: _Continue and queue.empty() )
+            if args.output_info:
+                print( _Poller.Report(), file=stderr )
+            if acqDone:
+                return True
+            else:
+                for vi in vis:
                     vi.Acquisition.Abort()
-                    return False
+                return False
         else:
             try:
                 for vi in vis:
@@ -435,21 +445,9 @@ class StreamWaveform( object ):
         self.ScaleFactor = 1.0
         self.dataTruncation = dt#args.data_truncation
         if self.dataTruncation == 12:
-            self.Samples = empty(args.output_samples if args.output_samples else args.samples, dtype=int16)
-            for n in range( min( len(elmt)//3, len(self.Samples)//8 ) ):
-                e0 = elmt[3*n]
-                e1 = elmt[3*n+1]
-                e2 = elmt[3*n+2]
-                s0 = e0 & 0x00000fff
-                s1 = (e0 & 0x00fff000) >> 12
-                s2 = ((e1 & 0x0000000f) << 8) | ((e0 & 0xff000000) >> 24)
-                s3 = (e1 & 0x0000fff0) >> 4
-                s4 = (e1 & 0x0fff0000) >> 16
-                s5 = ((e2 & 0x000000ff) << 4) | ((e1 & 0xf0000000) >> 28)
-                s6 = (e2 & 0x000fff00) >> 8
-                s7 = (e2 & 0xfff00000) >> 20
-                for i, s in enumerate([s0, s1, s2, s3, s4, s5, s6, s7]):
-                    self.Samples[8*n+i] = s << 4 #(s if s <= 0x000007ff else s | 0xfffff000)
+            # Samples the elements do not hold are left to 0.
+            self.Samples = zeros(args.output_samples if args.output_samples else args.samples, dtype=int16)
+            UnpackSamples( elmt, 12, out=self.Samples )
         elif bits==8:
             s = args.output_samples if args.output_samples else args.samples
             self.Samples = elmt[:(s//4)+1].view(dtype=int8)[:s].astype(dtype=int16)*256
@@ -482,38 +480,46 @@ class StreamRecord( object ):
     def __iter__(self):
         return self.Waveforms.__iter__()
 
-def FetchChannels( vis, args ):
+def FetchChannels( vis, args, sink ):
     global _Continue
     if isinstance( vis, int ):
         vis = [vis]
         # Manages readout
     nbrAdcBits = vis[0].InstrumentInfo.NbrADCBits
+    # Only the records and samples that are output are fetched.
+    firstRecord, nbrRecords, offset, nbrSamples = FetchRange( args )
+
+    # Nothing is output when the first record or sample is past the ones read.
+    if nbrRecords==0 and args.records!=1:
+        return
 
     if args.records==1:
-        wfms = []
-        try:
-            for vi in vis:
-                for ch in args.read_channels:
-                    channel = vi.Channels["Channel%d"%ch]
-                    wfm = channel.Measurement.FetchWaveform( dtype=args.read_type )
-                    wfms.append( wfm )
-        except RuntimeError as e:
-            raise
-        try:
-            OutputWaveforms( wfms, stdout, NbrSamples=args.output_samples )
-        except BrokenPipeError:
+        with _Telemetry.Stage( "fetch" ):
+            wfms = []
+            try:
+                for vi in vis:
+                    for ch in args.read_channels:
+                        channel = vi.Channels["Channel%d"%ch]
+                        wfm = channel.Measurement.FetchWaveform( dtype=args.read_type )
+                        wfms.append( wfm )
+            except RuntimeError as e:
+                raise
+        _Telemetry.Count( "fetched", ObjectBytes( wfms ) )
+        _Telemetry.Count( "records" )
+        if not sink.Put( OutputWaveforms, wfms, sink.file, NbrSamples=args.output_samples ):
             _Continue = False
 
     else:
-        mwfms = []
-        for vi in vis:
-            for ch in args.read_channels:
-                channel = vi.Channels["Channel%d"%ch]
-                mwfm = channel.MultiRecordMeasurement.FetchMultiRecordWaveform( 0, args.read_records, 0, args.read_samples, dtype=args.read_type)
-                mwfms.append( mwfm )
-        try:
-            OutputMultiWaveforms( mwfms, stdout, FirstRecord=args.output_1st_record, NbrRecords=args.output_records, NbrSamples=args.output_samples )
-        except BrokenPipeError:
+        with _Telemetry.Stage( "fetch" ):
+            mwfms = []
+            for vi in vis:
+                for ch in args.read_channels:
+                    channel = vi.Channels["Channel%d"%ch]
+                    mwfm = channel.MultiRecordMeasurement.FetchMultiRecordWaveform( firstRecord, nbrRecords, offset, nbrSamples, dtype=args.read_type )
+                    mwfms.append( mwfm )
+        _Telemetry.Count( "fetched", ObjectBytes( mwfms ) )
+        _Telemetry.Count( "records", nbrRecords )
+        if not sink.Put( OutputMultiWaveforms, mwfms, sink.file ):
             _Continue = False
 
 
@@ -550,6 +556,15 @@ def UpdateArgs( args, queue ):
 
 _Continue = True
 
+# Values of the attributes set in the driver, by vi.
+_Cache = AttributeCache()
+
+# Waits for the completion of the acquisitions.
+_Poller = AdaptivePoller()
+
+# Timings of the stages of the loop, reported with --telemetry.
+_Telemetry = Telemetry( "runaq4core", interval=None, file=None )
+
 
 def _SignalEndLoop( sig, frame ):
     global _Continue
@@ -557,7 +572,7 @@ def _SignalEndLoop( sig, frame ):
 
 
 def Run( args, queue ):
-    global _Continue
+    global _Continue, _Telemetry
 
     args = DigitizerArgs()
 
@@ -568,6 +583,10 @@ def Run( args, queue ):
     oldSigTerm = signal( SIGTERM, _SignalEndLoop )
     oldSigInt  = signal( SIGINT,  _SignalEndLoop )
 
+    _Telemetry = _Poller.telemetry = TelemetryArgs( args, "runaq4core" )
+    output = TimedOutput( stdout )
+    sink = OutputSinkArgs( args, output, _Telemetry )
+
     loop = 0
     _Continue = False if args.loops == 0 else True
     while _Continue:
@@ -581,13 +600,23 @@ def Run( args, queue ):
                 #forceCal = True
 
         if UpdateArgs( args, queue ):
-            ApplyArgs( vis, args )
+            sink.Drain()
+            with _Telemetry.Stage( "apply" ):
+                ApplyArgs( vis, args )
             forceCal = args.calibrate_always
             
-        Calibrate( vis, args, loop, forceCal )
+        with _Telemetry.Stage( "calibrate" ):
+            Calibrate( vis, args, loop, forceCal )
+
+        with _Telemetry.Stage( "acquire" ):
+            acquired = Acquire( vis, args, queue, loop )
+        if acquired:
+            FetchChannels( vis, args, sink )
 
-        if Acquire( vis, args, queue, loop ):
-            FetchChannels( vis, args )
+        _Telemetry.Count( "loops" )
+        _Telemetry.Set( "written", output.bytes )
+        _Telemetry.Set( "write_s", output.seconds )
+        _Telemetry.Tick()
 
         # Manages looping
         loop = loop+1
@@ -598,6 +627,11 @@ def Run( args, queue ):
         if loop>=args.loops:
             break
 
+    sink.Close()
+    _Telemetry.Set( "written", output.bytes )
+    _Telemetry.Set( "write_s", output.seconds )
+    _Telemetry.Close()
+
     signal( SIGTERM, oldSigTerm )
     signal( SIGINT,  oldSigInt )
 
@@ -12,16 +12,27 @@
 """
 
 
-from AqMD3 import *
+from digitizer.simulated import UseSimulation
+if UseSimulation( "AqMD3" ):
+    from digitizer.simulated import *
+else:
+    from AqMD3 import *
 from waveforms.trace import OutputTrace, OutputTraces
 from waveforms import Record, MultiRecord, DDCMultiRecord, AccMultiRecord
-from digitizer.argparser import DigitizerArgs, RefreshArgs
+from digitizer.argparser import DigitizerArgs, RefreshArgs, FetchRange
 from sys import stdin, stdout, stderr
 from time import sleep
 from signal import signal, SIGTERM, SIGINT
 from threading import Thread
 from queue import Queue
-from numpy import empty, int8, int16, float64
+from waveforms.summary import OutputSummaryArgs
+from waveforms.shmring import ShmRingOutputArgs
+from waveforms.hostaverage import HostAverager
+from waveforms.sink import OutputSinkArgs, ObjectBytes
+from waveforms.telemetry import Telemetry, TelemetryArgs, TimedOutput
+from digitizer.attrcache import AttributeCache
+from digitizer.polling import AdaptivePoller, ExpectedDuration
+from waveforms.streaming import StreamAssembler
 from datetime import datetime
 import json
 
@@ -104,6 +115,7 @@ def Close( vis ):
         for vi in vis:
             try: vi.Close()
             except: pass
+            _Cache.Invalidate( vi )
 
 
 def ShowInfo( vis ):
@@ -122,6 +134,7 @@ def Reset( vis ):
     for vi in vis:
         for vi in vis:
             vi.Utility.ResetWithDefaults()
+            _Cache.Invalidate( vi )
 
 
 lastFirmwareRevision = None
@@ -134,82 +147,82 @@ def ApplyArgs( vis, args ):
             vi.Acquisition.Abort()
         # Manages the clocking scheme
         if args.clock_external:
-            vi.SampleClock.Source = SampleClockSource.External
-            vi.SampleClock.ExternalFrequency = args.clock_external
-            vi.SampleClock.ExternalDivider =       args.clock_ext_divider      
+            _Cache.Assign( vi, "SampleClock.Source", SampleClockSource.External )
+            _Cache.Assign( vi, "SampleClock.ExternalFrequency", args.clock_external )
+            _Cache.Assign( vi, "SampleClock.ExternalDivider", args.clock_ext_divider )
         else:
-            vi.SampleClock.Source = SampleClockSource.Internal
+            _Cache.Assign( vi, "SampleClock.Source", SampleClockSource.Internal )
             if args.clock_ref_external:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.External
-                vi.ReferenceOscillator.ExternalFrequency = 10e6
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.External )
+                _Cache.Assign( vi, "ReferenceOscillator.ExternalFrequency", 10e6 )
             elif args.clock_ref_pxi:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.PxiExpressClk100
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.PxiExpressClk100 )
             elif args.clock_ref_axie:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.AXIeClk100
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.AXIeClk100 )
             else:
-                vi.ReferenceOscillator.Source = ReferenceOscillatorSource.Internal
+                _Cache.Assign( vi, "ReferenceOscillator.Source", ReferenceOscillatorSource.Internal )
 
         # Manages sample rate
         if args.sampling_frequency:
-            vi.Acquisition.SampleRate = args.sampling_frequency
+            _Cache.Assign( vi, "Acquisition.SampleRate", args.sampling_frequency )
 
         if args.disable_channel1:
-            vi.Channels["Channel1"].Enabled = False
+            _Cache.Assign( vi, "Channels[].Enabled", False, "Channel1" )
         if args.disable_channel2:
-            vi.Channels["Channel2"].Enabled = False
+            _Cache.Assign( vi, "Channels[].Enabled", False, "Channel2" )
 
         # Manages TSR
         if args.tsr:
-            vi.Acquisition.NumberOfAverages = args.averages
-            vi.Acquisition.TSR.Enabled = args.tsr
+            _Cache.Assign( vi, "Acquisition.NumberOfAverages", args.averages )
+            _Cache.Assign( vi, "Acquisition.TSR.Enabled", args.tsr )
 
         # Manages acquisition mode DDC
         if args.mode=='DDC':
-            vi.Acquisition.Mode = AcquisitionMode.DownConversion
+            _Cache.Assign( vi, "Acquisition.Mode", AcquisitionMode.DownConversion )
             for ddcCore in vi.DDCCores:
-                ddcCore.CenterFrequency = args.ddc_local_oscillator_frequency
+                _Cache.Assign( vi, "DDCCores[].CenterFrequency", args.ddc_local_oscillator_frequency, ddcCore.Name )
                 if args.ddc_decimation_numerator:
-                    ddcCore.DecimationNumerator = args.ddc_decimation_numerator
+                    _Cache.Assign( vi, "DDCCores[].DecimationNumerator", args.ddc_decimation_numerator, ddcCore.Name )
                 if args.ddc_decimation_denominator:
-                    ddcCore.DecimationDenominator = args.ddc_decimation_denominator
+                    _Cache.Assign( vi, "DDCCores[].DecimationDenominator", args.ddc_decimation_denominator, ddcCore.Name )
 
         # Manages conbination
         if args.interleave:
             ch, sub = args.interleave[:2]
-            vi.Channels["Channel%d"%( ch )].TimeInterleavedChannelList = "Channel%d"%( sub )
+            _Cache.Assign( vi, "Channels[].TimeInterleavedChannelList", "Channel%d"%( sub ), "Channel%d"%( ch ) )
         else:
             for ch in vi.Channels:
-                ch.TimeInterleavedChannelList = ""
+                _Cache.Assign( vi, "Channels[].TimeInterleavedChannelList", "", ch.Name )
         args.sampling_frequency = vi.Acquisition.SampleRate # Get SampleRate from instrument as it may have been changed by the interleaving
 
         # Manages acquisition mode AVG
         if args.mode=='AVG':
-            vi.Acquisition.Mode = AcquisitionMode.Averager
-            vi.Acquisition.NumberOfAverages = args.averages
+            _Cache.Assign( vi, "Acquisition.Mode", AcquisitionMode.Averager )
+            _Cache.Assign( vi, "Acquisition.NumberOfAverages", args.averages )
         elif args.mode=='DGT':
-            vi.Acquisition.Mode = AcquisitionMode.Normal
+            _Cache.Assign( vi, "Acquisition.Mode", AcquisitionMode.Normal )
 
         # Manages streaming
         if args.streaming_continuous or args.streaming_triggered:
-            vi.Acquisition.Streaming.Mode = StreamingMode.Continuous if args.streaming_continuous else StreamingMode.Triggered
+            _Cache.Assign( vi, "Acquisition.Streaming.Mode", StreamingMode.Continuous if args.streaming_continuous else StreamingMode.Triggered )
             if args.data_truncation:
-                for st in [vi.Streams[0]]:
-                    if st.Type == StreamType.Samples:
-                        st.Samples.DataTruncationEnabled = True
-                        st.Samples.DataTruncationBitCount = args.data_truncation
+                for st in [0]:
+                    if vi.Streams[st].Type == StreamType.Samples:
+                        _Cache.Assign( vi, "Streams[].Samples.DataTruncationEnabled", True, st )
+                        _Cache.Assign( vi, "Streams[].Samples.DataTruncationBitCount", args.data_truncation, st )
         else:
-            vi.Acquisition.Streaming.Mode = StreamingMode.Disabled
+            _Cache.Assign( vi, "Acquisition.Streaming.Mode", StreamingMode.Disabled )
 
         # Manages records
-        vi.Acquisition.RecordSize = args.samples
-        vi.Acquisition.NumberOfRecordsToAcquire = args.records
+        _Cache.Assign( vi, "Acquisition.RecordSize", args.samples )
+        _Cache.Assign( vi, "Acquisition.NumberOfRecordsToAcquire", args.records )
         assert args.records == vi.Acquisition.NumberOfRecordsToAcquire
 
         # Manages trigger
         if args.immediate_trigger:
             ActiveTrigger = "Immediate"
             if args.trigger_level!=None:
-                vi.Trigger.Sources["Internal1"].Level = args.trigger_level
+                _Cache.Assign( vi, "Trigger.Sources[].Level", args.trigger_level, "Internal1" )
         else:
             if args.trigger_name:
                 ActiveTrigger = args.trigger_name
@@ -221,116 +234,116 @@ def ApplyArgs( vis, args ):
                 ActiveTrigger = "Internal1"
 
             if args.trigger_level!=None:
-                vi.Trigger.Sources[ActiveTrigger].Level = args.trigger_level
+                _Cache.Assign( vi, "Trigger.Sources[].Level", args.trigger_level, ActiveTrigger )
             if args.trigger_delay!=None:
-                vi.Trigger.Delay = args.trigger_delay
+                _Cache.Assign( vi, "Trigger.Delay", args.trigger_delay )
             if args.trigger_slope!=None:
-                vi.Trigger.Sources[ActiveTrigger].Edge.Slope = TriggerSlope.Negative if args.trigger_slope in ["negative", "n"] else TriggerSlope.Positive
+                _Cache.Assign( vi, "Trigger.Sources[].Edge.Slope", TriggerSlope.Negative if args.trigger_slope in ["negative", "n"] else TriggerSlope.Positive, ActiveTrigger )
 
-        vi.Trigger.ActiveSource = ActiveTrigger
+        _Cache.Assign( vi, "Trigger.ActiveSource", ActiveTrigger )
 
         if args.trigger_output_enabled!=None:
-            vi.Trigger.OutputEnabled = args.trigger_output_enabled
+            _Cache.Assign( vi, "Trigger.OutputEnabled", args.trigger_output_enabled )
         if args.trigger_output_source!=None:
-            vi.Trigger.Output.Source = args.trigger_output_source
+            _Cache.Assign( vi, "Trigger.Output.Source", args.trigger_output_source )
         if args.trigger_output_offset!=None:
-            vi.Trigger.Output.Offset = args.trigger_output_offset
+            _Cache.Assign( vi, "Trigger.Output.Offset", args.trigger_output_offset )
 
         # Manages ZeroSuppress
         if args.zero_suppress:
-            vi.Acquisition.DataReductionMode = DataReductionMode.ZeroSuppress
+            _Cache.Assign( vi, "Acquisition.DataReductionMode", DataReductionMode.ZeroSuppress )
             for ch in vi.Channels:
-                ch.ZeroSuppress.Threshold =       0   if args.zs_threshold      is None else args.zs_threshold
-                ch.ZeroSuppress.Hysteresis =      248 if args.zs_hysteresis     is None else args.zs_hysteresis
-                ch.ZeroSuppress.ZeroValue =       0   if args.zs_zero_value     is None else args.zs_zero_value
-                ch.ZeroSuppress.PreGateSamples =  0   if args.pre_gate_samples  is None else args.pre_gate_samples
-                ch.ZeroSuppress.PostGateSamples = 0   if args.post_gate_samples is None else args.post_gate_samples
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.Threshold",       0   if args.zs_threshold      is None else args.zs_threshold,      ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.Hysteresis",      248 if args.zs_hysteresis     is None else args.zs_hysteresis,     ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.ZeroValue",       0   if args.zs_zero_value     is None else args.zs_zero_value,     ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.PreGateSamples",  0   if args.pre_gate_samples  is None else args.pre_gate_samples,  ch.Name )
+                _Cache.Assign( vi, "Channels[].ZeroSuppress.PostGateSamples", 0   if args.post_gate_samples is None else args.post_gate_samples, ch.Name )
                 #if args.zero_value:
                 #    ch.ZeroSuppress.ZeroValue = args.zero_value
 
         # Manages channels
         for ch in vi.Channels:
             if args.vertical_range!=None:
-                ch.Range = args.vertical_range
+                _Cache.Assign( vi, "Channels[].Range", args.vertical_range, ch.Name )
             if args.vertical_offset!=None:
-                ch.Offset = args.vertical_offset
+                _Cache.Assign( vi, "Channels[].Offset", args.vertical_offset, ch.Name )
             if args.input_max_frequency:
-                ch.Filter.Bypass = False
-                ch.Filter.MaxFrequency = args.input_max_frequency
+                _Cache.Assign( vi, "Channels[].Filter.Bypass", False, ch.Name )
+                _Cache.Assign( vi, "Channels[].Filter.MaxFrequency", args.input_max_frequency, ch.Name )
             if args.bypass_anti_aliasing is not None:
-                ch.Filter.BypassAntiAliasing = args.bypass_anti_aliasing
+                _Cache.Assign( vi, "Channels[].Filter.BypassAntiAliasing", args.bypass_anti_aliasing, ch.Name )
             if args.no_bypass_moving_average is not None:
-                ch.Filter.BypassMovingAverage = not args.no_bypass_moving_average
+                _Cache.Assign( vi, "Channels[].Filter.BypassMovingAverage", not args.no_bypass_moving_average, ch.Name )
             #ch.BaselineCorrection.Mode = 1
             if args.data_inversion is not None:
                 if args.data_inversion_channels is not None:
                     if int( ch.Name[7:] ) in args.data_inversion_channels:
-                        ch.DataInversionEnabled = args.data_inversion
+                        _Cache.Assign( vi, "Channels[].DataInversionEnabled", args.data_inversion, ch.Name )
                 else:
-                    ch.DataInversionEnabled = args.data_inversion
+                    _Cache.Assign( vi, "Channels[].DataInversionEnabled", args.data_inversion, ch.Name )
         #vi.Channels["Channel1"].Filter.BypassAntiAliasing = True
         #vi.Channels["Channel2"].Filter.BypassAntiAliasing = True
 
         if args.inter_channel_delay_enabled is not None:
-            vi.Calibration.InterChannelDelayEnabled = args.inter_channel_delay_enabled
+            _Cache.Assign( vi, "Calibration.InterChannelDelayEnabled", args.inter_channel_delay_enabled )
         if args.channel_sampling_delay_1 is not None:
-            vi.Channels['Channel1'].SamplingDelay = args.channel_sampling_delay_1
+            _Cache.Assign( vi, "Channels[].SamplingDelay", args.channel_sampling_delay_1, 'Channel1' )
         if args.channel_sampling_delay_2 is not None:
-            vi.Channels['Channel2'].SamplingDelay = args.channel_sampling_delay_2
+            _Cache.Assign( vi, "Channels[].SamplingDelay", args.channel_sampling_delay_2, 'Channel2' )
 
         if args.calibration_signal!=None:
-            vi.Private.PrivateCalibration.UserSignal = "Signal"+args.calibration_signal
+            _Cache.Assign( vi, "Private.PrivateCalibration.UserSignal", "Signal"+args.calibration_signal )
 
         if args.equalization:
-            vi.Calibration.Equalization = CalibrationEqualization.SharpRollOff if args.equalization=="Sharp" else \
-                                          CalibrationEqualization.SmoothRollOff if args.equalization=="Smooth" else \
-                                          CalibrationEqualization.Custom if args.equalization=="Custom" else 0
+            equalization = CalibrationEqualization.SharpRollOff if args.equalization=="Sharp" else \
+                           CalibrationEqualization.SmoothRollOff if args.equalization=="Smooth" else \
+                           CalibrationEqualization.Custom if args.equalization=="Custom" else 0
+            _Cache.Assign( vi, "Calibration.Equalization", equalization )
 
         # Manages ControlIO
         if args.control_io1 or args.control_io2 or args.control_io3:
-            for ctrlio, iosignal in zip( [vi.ControlIOs[0], vi.ControlIOs[1], vi.ControlIOs[2]], [args.control_io1, args.control_io2, args.control_io3] ):
+            for ctrlio, iosignal in enumerate( [args.control_io1, args.control_io2, args.control_io3] ):
                 if iosignal:
-                    ctrlio.Signal = iosignal
+                    _Cache.Assign( vi, "ControlIOs[].Signal", iosignal, ctrlio )
                     #ctrlio.OutSoftwareState = 0
 
         # Manages SelfTrigger
         if args.self_trigger_square_wave:
-            st = vi.Trigger.Sources["SelfTrigger"]
-            st.SelfTrigger.Mode = SelfTriggerMode.SquareWave
-            st.SelfTrigger.SquareWave.Frequency = args.self_trigger_wave_frequency
-            st.SelfTrigger.SquareWave.DutyCycle = args.self_trigger_wave_duty_cycle
+            _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", SelfTriggerMode.SquareWave, "SelfTrigger" )
+            _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.Frequency", args.self_trigger_wave_frequency, "SelfTrigger" )
+            _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.DutyCycle", args.self_trigger_wave_duty_cycle, "SelfTrigger" )
         elif args.self_trigger_armed_pulse:
-            st = vi.Trigger.Sources["SelfTrigger"]
             try: # Either we have the armed pulse mode and pulse duration attribute, or we revert to AgMD2-2.4 hack
-                st.SelfTrigger.Mode = SelfTriggerMode.ArmedPulse
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", SelfTriggerMode.ArmedPulse, "SelfTrigger" )
                 if args.self_trigger_pulse_duration!=None:
-                    st.SelfTrigger.PulseDuration = args.self_trigger_pulse_duration
+                    _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.PulseDuration", args.self_trigger_pulse_duration, "SelfTrigger" )
             except AttributeError as e:
                 print( "ERROR for Armed Pulse", e, file=stderr )
-                st.SelfTrigger.Mode = SelfTriggerMode.SquareWave
-                st.SelfTrigger.SquareWave.Frequency = args.self_trigger_wave_frequency
-                st.SelfTrigger.SquareWave.DutyCycle = args.self_trigger_wave_duty_cycle
-                st.SelfTrigger.Mode = 2 # SelfTriggerMode.ArmedPulse
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", SelfTriggerMode.SquareWave, "SelfTrigger" )
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.Frequency", args.self_trigger_wave_frequency, "SelfTrigger" )
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.SquareWave.DutyCycle", args.self_trigger_wave_duty_cycle, "SelfTrigger" )
+                _Cache.Assign( vi, "Trigger.Sources[].SelfTrigger.Mode", 2, "SelfTrigger" ) # SelfTriggerMode.ArmedPulse
 
         if args.timestamp_reset and args.timestamp_reset != 'OnInitiate':
             #vi.TimeReference.ResetMode =    TimeResetMode.OnTriggerEnable if args.timestamp_reset == "OnTriggerEnable" \
             #                           else TimeResetMode.OnFirstTrigger  if args.timestamp_reset == "OnFirstTrigger"  \
             #                           else TimeResetMode.Immediate
-            vi.TimeReference.ResetMode =    TimeResetMode.OnTriggerEnable if args.timestamp_reset == "OnTriggerEnable" \
-                                       else TimeResetMode.OnFirstTrigger  if args.timestamp_reset == "OnFirstTrigger"  \
-                                       else TimeResetMode.Immediate
+            resetMode =    TimeResetMode.OnTriggerEnable if args.timestamp_reset == "OnTriggerEnable" \
+                      else TimeResetMode.OnFirstTrigger  if args.timestamp_reset == "OnFirstTrigger"  \
+                      else TimeResetMode.Immediate
+            _Cache.Assign( vi, "TimeReference.ResetMode", resetMode )
 
 #        for ch in [0, 1, 2, 3, 4, 5, 23, 24, 25, 26, 30, 31]:
 #            vi.Channels[ch].Enabled = False 
 
         # Manages the calibration offset target
         if args.cal_offset_target!=None:
-            vi.Calibration.TargetVoltageEnabled = True
+            _Cache.Assign( vi, "Calibration.TargetVoltageEnabled", True )
             for ch in vi.Channels:
-                ch.CalibrationTargetVoltage = args.cal_offset_target
+                _Cache.Assign( vi, "Channels[].CalibrationTargetVoltage", args.cal_offset_target, ch.Name )
 
         if args.mode=='CFW':
-            vi.Acquisition.Mode = AcquisitionMode.UserFDK
+            _Cache.Assign( vi, "Acquisition.Mode", AcquisitionMode.UserFDK )
 
         if args.no_digital_gain:
             vi.Private.PrivateCalibration.SetCalibrationValueBoolean( "DigitalGain:Disable", True )
@@ -359,6 +372,7 @@ def ApplyArgs( vis, args ):
         #vi.Private.PrivateCalibration.PrivateCalibrationSteps["DC"].DumpWaveforms = True
 
         vi.Acquisition.ApplySetup()
+        _Poller.expected = ExpectedDuration( args.records, args.samples, vi.Acquisition.SampleRate, args.expected_trigger_rate, args.averages if args.mode=='AVG' else 1 )
 
         global lastFirmwareRevision
         newFirmwareRevision = vi.Identity.InstrumentFirmwareRevision
@@ -395,9 +409,11 @@ def Calibrate( vis, args, loop, force ):
             print( e, file=stderr )
             if args.calibrate_fails:
                 raise
+        # The calibration may change attributes behind the cache.
+        _Cache.Invalidate( vi )
 
         if args.calibration_signal:
-            vi.Private.PrivateCalibration.UserSignal = "Signal"+args.calibration_signal
+            _Cache.Assign( vi, "Private.PrivateCalibration.UserSignal", "Signal"+args.calibration_signal )
 
 
 def Acquire( vis, args, queue, loop ):
@@ -423,21 +439,19 @@ def Acquire( vis, args, queue, loop ):
                 #print( "Initiate Acquistion", file=stderr )
                 vi.Acquisition.Initiate()
 
-            polls = 0
-            #while _Continue:
-            for a in range(10000):
-                complete = vi.Acquisition.TSR.IsAcquisitionComplete
-                if a==9999 or complete:
-                    print( "GetAttribute TSR_IS_ACQUISITION_COMPLETE", polls, " :", "0 -> ", complete, file=stderr )
-                if complete:
-                    return True
-                polls = polls + 1
-                sleep( 0.001 )
+            complete = _Poller.Poll( lambda: vi.Acquisition.TSR.IsAcquisitionComplete, args.wait_timeout )
+            print( "GetAttribute TSR_IS_ACQUISITION_COMPLETE", _Poller.polls, " :", "0 -> ", complete, file=stderr )
+            if args.output_info:
+                print( _Poller.Report(), file=stderr )
+            if complete:
+                return True
 
     elif args.streaming_continuous or args.streaming_triggered:
         for vi in vis:
             if vi.Acquisition.Status.IsIdle == AcquisitionStatusResult.ResultTrue:
                 vi.Acquisition.Initiate()
+                # The streams start over.
+                _Assemblers.pop( vi, None )
         return True
 
     else:
@@ -457,21 +471,17 @@ def Acquire( vis, args, queue, loop ):
         while True:
             # Manages wait/poll
             if args.poll_timeout:
-                for vi in vis:
-                    acqDone = False
-                    fullwait = float( args.poll_timeout )
-                    while fullwait>=0.0 and _Continue and queue.empty() and not acqDone:
-                        oncewait = min( 0.2, fullwait )
-                        sleep( oncewait/1000.0 )
-                        fullwait = fullwait-oncewait
-                        isIdle = vi.Acquisition.Status.IsIdle
-                        acqDone = isIdle==AcquisitionStatusResult.ResultTrue
-                        nn = vi.Acquisition.NumberOfAcquiredRecords
-                    if acqDone:
-                        return True
-                    else:
+                # The timeout is in ms.
+                isIdle = lambda: all( vi.Acquisition.Status.IsIdle==AcquisitionStatusResult.ResultTrue for vi in vis )
+                acqDone = _Poller.Poll( isIdle, args.poll_timeout/1000.0, lambda: _Continue and queue.empty() )
+                if args.output_info:
+                    print( _Poller.Report(), file=stderr )
+                if acqDone:
+                    return True
+                else:
+                    for vi in vis:
                         vi.Acquisition.Abort()
-                        return False
+                    return False
             else:
                 try:
                     for vi in vis:
@@ -487,119 +497,77 @@ def Acquire( vis, args, queue, loop ):
                             return False
 
 
-class StreamWaveform( object ):
-    def __init__( self, elmt, bits, dt, args ):
-        self.SampleType = "Int16"
-        self.NbrAdcBits = 16
-        self.ActualRecords = 1
-        self.RecordSize = args.output_samples
-        self.XIncrement = 5e-10
-        self.InitialXOffset = 0.0
-        self.InitialXTimeSeconds = 0.0
-        self.InitialXTimeFraction = 0.0
-        self.ScaleOffset = 0.0
-        self.ScaleFactor = 1.0
-        self.dataTruncation = dt#args.data_truncation
-        if self.dataTruncation == 12:
-            self.Samples = empty(args.output_samples if args.output_samples else args.samples, dtype=int16)
-            for n in range( min( len(elmt)//3, len(self.Samples)//8 ) ):
-                e0 = elmt[3*n]
-                e1 = elmt[3*n+1]
-                e2 = elmt[3*n+2]
-                s0 = e0 & 0x00000fff
-                s1 = (e0 & 0x00fff000) >> 12
-                s2 = ((e1 & 0x0000000f) << 8) | ((e0 & 0xff000000) >> 24)
-                s3 = (e1 & 0x0000fff0) >> 4
-                s4 = (e1 & 0x0fff0000) >> 16
-                s5 = ((e2 & 0x000000ff) << 4) | ((e1 & 0xf0000000) >> 28)
-                s6 = (e2 & 0x000fff00) >> 8
-                s7 = (e2 & 0xfff00000) >> 20
-                for i, s in enumerate([s0, s1, s2, s3, s4, s5, s6, s7]):
-                    self.Samples[8*n+i] = s << 4 #(s if s <= 0x000007ff else s | 0xfffff000)
-        elif bits==8:
-            s = args.output_samples if args.output_samples else args.samples
-            self.Samples = elmt[:(s//4)+1].view(dtype=int8)[:s].astype(dtype=int16)*256
-        else:
-            self.Samples = elmt.view(dtype=int16)[:args.output_samples]
-    def __len__( self ):
-        return len(self.Samples)
-    def __getitem__( self, arg ):
-        return self.Samples[arg]
-    def __iter__( self ):
-        return self.Samples.__iter__()
-
-class StreamRecord( object ):
-    def __init__( self, args ):
-        self.SampleType = "Int16"
-        self.NbrAdcBits = 16
-        self.ActualRecords = 1
-        self.RecordSize = args.output_samples
-        self.XIncrement = 5e-10
-        self.InitialXOffset = 0.0
-        self.InitialXTimeSeconds = 0.0
-        self.InitialXTimeFraction = 0.0
-        self.ScaleOffset = 0.0
-        self.ScaleFactor = 1.0
-        self.Waveforms = []
-    def __len__( self ):
-        return len(self.Waveforms)
-    def __getitem__( self, arg ):
-        return self.Waveforms[arg]
-    def __iter__(self):
-        return self.Waveforms.__iter__()
-
-def FetchChannels( vis, args ):
+def _FetchStream( stream, count, maximum=16*1024*1024 ):
+    """ Returns the arrays of elements fetched from stream: count elements,
+        then the ones still available, a multiple of count up to maximum.
+        Also returns the available elements, negative on overflow.
+    """
+    elements = []
+    available = 0
+    while count:
+        data = stream.FetchDataInt32( count )
+        available = data.AvailableElements
+        if data.ActualElements<count:
+            break
+        elements.append( data.Elements[:data.ActualElements] )
+        count = min( available-data.ActualElements, maximum )//count*count if len( elements )==1 else 0
+    return elements, available
+
+
+def FetchChannels( vis, args, sink ):
     global _Continue
     if isinstance( vis, int ):
         vis = [vis]
         # Manages readout
     nbrAdcBits = vis[0].InstrumentInfo.NbrADCBits
+    # Only the records and samples that are output are fetched.
+    firstRecord, nbrRecords, offset, nbrSamples = FetchRange( args )
+    # The records are output as text traces, unless --output-summary or --output-shm.
+    output = _SummaryOutput or _ShmOutput
 
     if args.streaming_continuous or args.streaming_triggered:
+        sleep( 0.01 )
         for vi in vis:
-            #tsCount = 32*1024
-            #data = vi.Streams["StreamTriggers"].FetchDataInt32( tsCount )
-            #if data.ActualElements > 0:
-            #    print( "FetchTriggers: ", data.ActualElements, data.AvailableElements, data.Elements.view( 'uint64' ), file=stderr )
-            #    #with open( "ts.txt", "at" ) as f:
-            #    #  for ts in fetch[0][fetch[4]:fetch[4]+fetch[3]].view( 'uint64' ):
-            #    #      print( ts//256, file=f )
-            #else:
-            #    print( "Available Triggers: ", data.AvailableElements, file=stderr )
-            numberOfWaveforms = args.read_records
-            elmts = [None] * len(args.read_channels)
-            for i, ch in enumerate(args.read_channels):
-                elementsPerWaveform = args.read_samples//2
-                if i==0 and args.data_truncation:
-                    elementsPerWaveform = elementsPerWaveform * args.data_truncation // 16
-                readElmts = numberOfWaveforms*elementsPerWaveform
-                streamName = "StreamCh%d"%(ch)
-                stream = vi.Streams[streamName]
-                elmt = stream.FetchDataInt32( readElmts )
-                if elmt.ActualElements > 0:
-                    if args.output_info: print( streamName, ":", elmt.AvailableElements, elmt.ActualElements, len(elmt.Elements), file=stderr )
-                    elmts[i] = elmt
-                else:
-                    if args.output_info: print( streamName, ":", elmt.AvailableElements, file=stderr )
-                    sleep( 0.2 )
-                    if elmt.AvailableElements < 0:
+            assembler = _Assemblers.get( vi )
+            if assembler is None:
+                streams = ["StreamCh%d"%( ch ) for ch in args.read_channels]
+                # Samples of 8-bit digitizers are int8, and the first channel is packed with data truncation.
+                bits = { stream: 8 for stream in streams } if nbrAdcBits<=8 else {}
+                if args.data_truncation:
+                    bits[streams[0]] = args.data_truncation
+                assembler = _Assemblers[vi] = StreamAssembler( streams, args.read_samples, 1.0/vi.Acquisition.SampleRate, bits=bits, nbrAdcBits=nbrAdcBits )
+            streams = ( ["StreamTriggers"] if args.streaming_triggered else [] )+assembler.streams
+            with _Telemetry.Stage( "fetch" ):
+                for stream in streams:
+                    count = 2 if stream=="StreamTriggers" else max( args.read_samples*( assembler.rings[stream].bits or 16 )//32, 1 )
+                    elements, available = _FetchStream( vi.Streams[stream], count )
+                    if args.output_info: print( stream, ":", available, sum( len( e ) for e in elements ), file=stderr )
+                    if available<0:
+                        print( "ERROR: Stream", stream, "overflow", file=stderr )
                         _Continue = False
-            if all(elmts):
-                first_record  = args.output_1st_record if args.output_1st_record else 0
-                count_records = args.output_records if args.output_records else args.read_records
-                for w in range( first_record, min(numberOfWaveforms, first_record + count_records) ):
-                    rec = StreamRecord( args )
-                    for i, elmt in enumerate( elmts ):
-                        elementsPerWaveform = args.read_samples//2
-                        if i==0 and args.data_truncation:
-                            elementsPerWaveform = elementsPerWaveform * args.data_truncation // 16
-                        rec.Waveforms.append( StreamWaveform(elmt.Elements[w*elementsPerWaveform:(w+1)*elementsPerWaveform], nbrAdcBits, 12 if args.data_truncation and i==0 else None, args) )
-                    OutputTrace( rec, stdout, NbrSamples=args.output_samples )
-                    #elmt = vi.Streams["StreamCh2"].FetchDataInt32( readElmts )
-                    #if elmt.ActualElements > 0:
-                    #    print( "FetchCh2: ", elmt.ActualElements, elmt.AvailableElements, elmt.Elements, file=stderr )
+                    for e in elements:
+                        _Telemetry.Count( "fetched", e.nbytes )
+                        if stream=="StreamTriggers":
+                            assembler.AppendTriggers( e )
+                        else:
+                            assembler.Append( stream, e )
+            with _Telemetry.Stage( "build" ):
+                if args.streaming_continuous:
+                    assembler.Cut()
+                records = assembler.Records()
+            _Telemetry.Count( "records", len( records ) )
+            for rec in records:
+                if not sink.Put( output or OutputTrace, rec, sink.file, NbrSamples=args.output_samples ):
+                    _Continue = False
+                    break
+            if args.output_info:
+                print( "Streaming:", assembler.assembled, "records,", assembler.pending, "pending,", assembler.lost, "lost", file=stderr )
+        return
+
+    # Nothing is output when the first record or sample is past the ones read.
+    if nbrRecords==0 and ( args.mode!='DGT' or args.records!=0 ):
         return
-    
+
     if args.mode=='DDC':
         for vi in vis:
             if args.ddc_decimation_numerator==4:
@@ -608,16 +576,20 @@ def FetchChannels( vis, args ):
             else:
                 DataWidth = 32
                 Fetch = AgMD2_DDCCoreFetchWaveformInt32Py
-            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vi, DataWidth, 1, 0, args.read_samples )
+            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vi, DataWidth, 1, offset, nbrSamples )
 
-            mrec = DDCMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
-            mrec.view = args.ddc_sample_view
-            for ch in args.read_channels:
-                mrec.append( Fetch( vi, "DDCCore%d"%( ch ), 0, args.read_records, 0, args.read_samples, 2*nbrSamplesToRead, args.read_records ) )
+            with _Telemetry.Stage( "fetch" ):
+                fetchs = [Fetch( vi, "DDCCore%d"%( ch ), firstRecord, nbrRecords, offset, nbrSamples, 2*nbrSamplesToRead, nbrRecords ) for ch in args.read_channels]
+            _Telemetry.Count( "fetched", ObjectBytes( fetchs ) )
 
-            try:
-                OutputTraces( mrec, stdout )
-            except BrokenPipeError:
+            with _Telemetry.Stage( "build" ):
+                mrec = DDCMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
+                mrec.view = args.ddc_sample_view
+                for fetch in fetchs:
+                    mrec.append( fetch )
+            _Telemetry.Count( "records", nbrRecords )
+
+            if not sink.Put( output or OutputTraces, mrec, sink.file ):
                 _Continue = False
                 break
 
@@ -628,84 +600,101 @@ def FetchChannels( vis, args ):
             else:
                 readType = 'int32'
 
-            mrec = AccMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
-            for ch in args.read_channels:
-                channel = vi.Channels["Channel%d"%ch]
-                try:
-                    wfms = channel.Measurement.FetchAccumulatedWaveform( 0, args.read_records, 0, args.read_samples, dtype=readType)
-                    if args.output_info: print( channel.Name, "InitialXOffset:", wfms[0].InitialXOffset*1e12, "sample", *wfms[0].Samples[0:16], file=stderr )
-                except RuntimeError:
-                    vi.Acquisition.ErrorOnOverrangeEnabled = False
-                    wfms = channel.Measurement.FetchAccumulatedWaveform( 0, args.read_records, 0, args.read_samples, dtype=readType)
-                    vi.Acquisition.ErrorOnOverrangeEnabled = True
-                mrec.append( wfms )
+            with _Telemetry.Stage( "fetch" ):
+                fetchs = []
+                for ch in args.read_channels:
+                    channel = vi.Channels["Channel%d"%ch]
+                    try:
+                        wfms = channel.Measurement.FetchAccumulatedWaveform( firstRecord, nbrRecords, offset, nbrSamples, dtype=readType )
+                        if args.output_info: print( channel.Name, "InitialXOffset:", wfms[0].InitialXOffset*1e12, "sample", *wfms[0].Samples[0:16], file=stderr )
+                    except RuntimeError:
+                        vi.Acquisition.ErrorOnOverrangeEnabled = False
+                        wfms = channel.Measurement.FetchAccumulatedWaveform( firstRecord, nbrRecords, offset, nbrSamples, dtype=readType )
+                        vi.Acquisition.ErrorOnOverrangeEnabled = True
+                    fetchs.append( wfms )
+            _Telemetry.Count( "fetched", ObjectBytes( fetchs ) )
 
-            try:
-                OutputTraces( mrec, stdout, FirstRecord=args.output_1st_record, NbrRecords=args.output_records, NbrSamples=args.output_samples )
-                stdout.write( "\n" )
-                stdout.flush()
-                #print( "$InitialXTimeSeconds", fetch[6][0], file=stdout )
-                #print( "$InitialXTimeFraction", fetch[7][0], file=stdout )
-            except BrokenPipeError:
+            with _Telemetry.Stage( "build" ):
+                mrec = AccMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
+                for wfms in fetchs:
+                    mrec.append( wfms )
+
+            _Telemetry.Count( "records", nbrRecords )
+
+            if not sink.Put( output or _OutputAccumulated, mrec, sink.file ):
                 _Continue = False
                 break
 
     else:
         if args.records==0:
             rec = Record( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
-            try:
-                for vi in vis:
-                    for ch in args.read_channels:
-                        channel = vi.Channels["Channel%d"%ch]
-                        wfm = channel.Measurement.FetchWaveform( dtype=args.read_type )
-            except RuntimeError:
-                pass
-                #for vi in vis:
-                #    vi.Acquisition.ErrorOnOverrangeEnabled = False
-                #    try:
-                #        for ch in args.read_channels:
-                #            channel = vi.Channels["Channel%d"%ch]
-                #            wfm = channel.Measurement.FetchWaveform( dtype=args.read_type )
-                #    except:
-                #        continue
-                #    vi.Acquisition.ErrorOnOverrangeEnabled = True
-            try:
-                if args.output_info: print( "InitialXOffset:", wfm.InitialXOffset, file=stderr )
-                OutputTraces( [wfm], stdout, FirstRecord=args.output_1st_record, NbrRecords=args.output_records, NbrSamples=args.output_samples )
-            except BrokenPipeError:
+            with _Telemetry.Stage( "fetch" ):
+                try:
+                    for vi in vis:
+                        for ch in args.read_channels:
+                            channel = vi.Channels["Channel%d"%ch]
+                            wfm = channel.Measurement.FetchWaveform( dtype=args.read_type )
+                except RuntimeError:
+                    pass
+                    #for vi in vis:
+                    #    vi.Acquisition.ErrorOnOverrangeEnabled = False
+                    #    try:
+                    #        for ch in args.read_channels:
+                    #            channel = vi.Channels["Channel%d"%ch]
+                    #            wfm = channel.Measurement.FetchWaveform( dtype=args.read_type )
+                    #    except:
+                    #        continue
+                    #    vi.Acquisition.ErrorOnOverrangeEnabled = True
+            if args.output_info: print( "InitialXOffset:", wfm.InitialXOffset, file=stderr )
+            _Telemetry.Count( "fetched", ObjectBytes( wfm ) )
+            _Telemetry.Count( "records" )
+            if not sink.Put( output or OutputTraces, [wfm], sink.file, FirstRecord=args.output_1st_record, NbrRecords=args.output_records, NbrSamples=args.output_samples ):
                 _Continue = False
 
         else:
-            mrec = MultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits ) 
-            for vi in vis:
-                for ch in args.read_channels:
-                    channel = vi.Channels["Channel%d"%ch]
-                    try:
-                        wfms = channel.MultiRecordMeasurement.FetchMultiRecordWaveform( 0, args.read_records, 0, args.read_samples, dtype=args.read_type)
-                        #print( channel.Name, "InitialXOffset:", wfms[0].InitialXOffset*1e12, "ps, samples:", *wfms[0].Samples[0:8], file=stderr )
-                    except RuntimeError:
-                        canReadAgain = True
-                        try: vi.Acquisition.ErrorOnOverrangeEnabled = False
-                        except RuntimeError: canReadAgain = False
-
-                        if not canReadAgain:
-                            raise
-
-                        wfms = channel.MultiRecordMeasurement.FetchMultiRecordWaveform( 0, args.read_records, 0, args.read_samples, dtype=args.read_type)
-                        vi.Acquisition.ErrorOnOverrangeEnabled = True
+            with _Telemetry.Stage( "fetch" ):
+                fetchs = []
+                for vi in vis:
+                    for ch in args.read_channels:
+                        channel = vi.Channels["Channel%d"%ch]
+                        try:
+                            wfms = channel.MultiRecordMeasurement.FetchMultiRecordWaveform( firstRecord, nbrRecords, offset, nbrSamples, dtype=args.read_type )
+                            #print( channel.Name, "InitialXOffset:", wfms[0].InitialXOffset*1e12, "ps, samples:", *wfms[0].Samples[0:8], file=stderr )
+                        except RuntimeError:
+                            canReadAgain = True
+                            try: vi.Acquisition.ErrorOnOverrangeEnabled = False
+                            except RuntimeError: canReadAgain = False
+
+                            if not canReadAgain:
+                                raise
+
+                            wfms = channel.MultiRecordMeasurement.FetchMultiRecordWaveform( firstRecord, nbrRecords, offset, nbrSamples, dtype=args.read_type )
+                            vi.Acquisition.ErrorOnOverrangeEnabled = True
+                        fetchs.append( wfms )
+            _Telemetry.Count( "fetched", ObjectBytes( fetchs ) )
+            with _Telemetry.Stage( "build" ):
+                mrec = MultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits ) 
+                for wfms in fetchs:
                     mrec.append( wfms )
                     prevts = 0.0
                     for rec in wfms:
                         ts = rec.InitialXTimeSeconds+rec.InitialXTimeFraction
                         #print( ts if prevts==0.0 else 1e6*(ts-prevts), file=stderr )
                         prevts = ts
-            try:
-                if args.output_info: print( "InitialXOffset:", mrec[0].InitialXOffset*1e12, file=stderr )
-                OutputTraces( mrec, stdout, FirstRecord=args.output_1st_record, NbrRecords=args.output_records, NbrSamples=args.output_samples )
-            except BrokenPipeError:
+            if args.output_info: print( "InitialXOffset:", mrec[0].InitialXOffset*1e12, file=stderr )
+            _Telemetry.Count( "records", nbrRecords )
+            if not _Averager.PutTo( sink, mrec, output or OutputTraces ):
                 _Continue = False
 
 
+def _OutputAccumulated( mrec, file ):
+    OutputTraces( mrec, file )
+    file.write( "\n" )
+    file.flush()
+    #print( "$InitialXTimeSeconds", fetch[6][0], file=stdout )
+    #print( "$InitialXTimeFraction", fetch[7][0], file=stdout )
+
+
 class Runner():
     """
     >>> args = {}
@@ -739,6 +728,27 @@ def UpdateArgs( args, queue ):
 
 _Continue = True
 
+# Values of the attributes set in the driver, by vi.
+_Cache = AttributeCache()
+
+# Waits for the completion of the acquisitions.
+_Poller = AdaptivePoller()
+
+# Sums the records of the acquisitions with --host-average.
+_Averager = HostAverager()
+
+# Timings of the stages of the loop, reported with --telemetry.
+_Telemetry = Telemetry( "runmd3", interval=None, file=None )
+
+# Ring of shared memory the records are written to with --output-shm.
+_ShmOutput = None
+
+# Statistics of the records output with --output-summary.
+_SummaryOutput = None
+
+# Stream assemblers of the streaming acquisitions, by vi.
+_Assemblers = {}
+
 
 def _SignalEndLoop( sig, frame ):
     global _Continue
@@ -746,7 +756,7 @@ def _SignalEndLoop( sig, frame ):
 
 
 def Run( args, queue ):
-    global _Continue
+    global _Continue, _Telemetry, _ShmOutput, _SummaryOutput
 
     args = DigitizerArgs()
 
@@ -757,6 +767,13 @@ def Run( args, queue ):
     oldSigTerm = signal( SIGTERM, _SignalEndLoop )
     oldSigInt  = signal( SIGINT,  _SignalEndLoop )
 
+    _Telemetry = _Poller.telemetry = TelemetryArgs( args, "runmd3" )
+    output = TimedOutput( stdout )
+    sink = OutputSinkArgs( args, output, _Telemetry )
+    _ShmOutput = ShmRingOutputArgs( args )
+    _SummaryOutput = OutputSummaryArgs( args )
+    _Averager.averages = args.host_average
+
     loop = 0
     _Continue = False if args.loops == 0 else True
     while _Continue:
@@ -770,13 +787,26 @@ def Run( args, queue ):
                 #forceCal = True
 
         if UpdateArgs( args, queue ):
-            ApplyArgs( vis, args )
+            sink.Drain()
+            _Averager.Reset()
+            _Averager.averages = args.host_average
+            _SummaryOutput = OutputSummaryArgs( args, _SummaryOutput )
+            with _Telemetry.Stage( "apply" ):
+                ApplyArgs( vis, args )
             forceCal = args.calibrate_always
             
-        Calibrate( vis, args, loop, forceCal )
+        with _Telemetry.Stage( "calibrate" ):
+            Calibrate( vis, args, loop, forceCal )
+
+        with _Telemetry.Stage( "acquire" ):
+            acquired = Acquire( vis, args, queue, loop )
+        if acquired:
+            FetchChannels( vis, args, sink )
 
-        if Acquire( vis, args, queue, loop ):
-            FetchChannels( vis, args )
+        _Telemetry.Count( "loops" )
+        _Telemetry.Set( "written", output.bytes )
+        _Telemetry.Set( "write_s", output.seconds )
+        _Telemetry.Tick()
 
         # Manages looping
         loop = loop+1
@@ -790,6 +820,13 @@ def Run( args, queue ):
                     vi.Acquisition.Abort()
             break
 
+    sink.Close()
+    if _ShmOutput:
+        _ShmOutput.Close()
+    _Telemetry.Set( "written", output.bytes )
+    _Telemetry.Set( "write_s", output.seconds )
+    _Telemetry.Close()
+
     signal( SIGTERM, oldSigTerm )
     signal( SIGINT,  oldSigInt )
 
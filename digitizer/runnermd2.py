@@ -12,15 +12,28 @@
 """
 
 
-from AgMD2 import *
+from digitizer.simulated import UseSimulation
+if UseSimulation( "AgMD2" ):
+    from digitizer.simulated import *
+else:
+    from AgMD2 import *
 from waveforms.trace import OutputTrace, OutputTraces
 from waveforms import Record, MultiRecord, DDCMultiRecord, AccMultiRecord
-from digitizer.argparser import DigitizerArgs, RefreshArgs
+from digitizer.argparser import DigitizerArgs, RefreshArgs, FetchRange
 from sys import stdin, stdout, stderr
 from time import sleep
 from signal import signal, SIGTERM, SIGINT
 from threading import Thread
 from queue import Queue
+from waveforms.summary import OutputSummaryArgs
+from waveforms.shmring import ShmRingOutputArgs
+from waveforms.hostaverage import HostAverager
+from waveforms.sink import OutputSinkArgs
+from waveforms.telemetry import Telemetry, TelemetryArgs, TimedOutput
+from waveforms.streaming import StreamAssembler
+from digitizer.attrcache import AttributeCache
+from digitizer.fetchpool import FetchPool, FetchPoolArgs
+from digitizer.polling import AdaptivePoller, ExpectedDuration
 import json
 
 
@@ -85,6 +98,7 @@ def Close( vis ):
         for vi in vis:
             try: AgMD2_close( vi )
             except: pass
+            _Cache.Invalidate( vi )
 
 
 def ShowInfo( vis ):
@@ -99,32 +113,25 @@ def ShowInfo( vis ):
 
 
 def AgMD2_UpdateAttributeViInt8( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViInt8(  vi, repCap, attr )!=value:
-        AgMD2_SetAttributeViInt8(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViInt8, AgMD2_GetAttributeViInt8 )
 
 def AgMD2_UpdateAttributeViInt16( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViInt16(  vi, repCap, attr )!=value:
-        AgMD2_SetAttributeViInt16(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViInt16, AgMD2_GetAttributeViInt16 )
 
 def AgMD2_UpdateAttributeViInt32( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViInt32(  vi, repCap, attr )!=value:
-        AgMD2_SetAttributeViInt32(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViInt32, AgMD2_GetAttributeViInt32 )
 
 def AgMD2_UpdateAttributeViInt64( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViInt64(  vi, repCap, attr )!=value:
-        AgMD2_SetAttributeViInt64(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViInt64, AgMD2_GetAttributeViInt64 )
 
 def AgMD2_UpdateAttributeViReal64( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViReal64(  vi, repCap, attr )!=value:
-        AgMD2_SetAttributeViReal64(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViReal64, AgMD2_GetAttributeViReal64 )
 
 def AgMD2_UpdateAttributeViBoolean( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViBoolean(  vi, repCap, attr )!=value:
-        AgMD2_SetAttributeViBoolean(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViBoolean, AgMD2_GetAttributeViBoolean )
 
 def AgMD2_UpdateAttributeViString( vi, repCap, attr, value ):
-    if AgMD2_GetAttributeViString(  vi, repCap, attr, 256 )!=value:
-        AgMD2_SetAttributeViString(  vi, repCap, attr , value )   
+    _Cache.Update( vi, repCap, attr, value, AgMD2_SetAttributeViString, lambda vi, repCap, attr: AgMD2_GetAttributeViString( vi, repCap, attr, 256 ) )
 
 
 def ApplyArgs( vis, args ):
@@ -152,7 +159,7 @@ def ApplyArgs( vis, args ):
         # Manages acquisition mode
         if args.mode=='DDC':
             AgMD2_UpdateAttributeViInt32( vi, "", AGMD2_ATTR_ACQUISITION_MODE, AGMD2_VAL_ACQUISITION_MODE_DIGITAL_DOWN_CONVERSION )
-            nbrDDCCores = AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_DDCCORE_COUNT )
+            nbrDDCCores = _Cache.Get( vi, "", AGMD2_ATTR_DDCCORE_COUNT, AgMD2_GetAttributeViInt32 )
             DDCCores = ["DDCCore%d"%( core+1 ) for core in range( nbrDDCCores )]
             for ddcCore in DDCCores:
                 AgMD2_UpdateAttributeViReal64( vi, ddcCore, AGMD2_ATTR_DDCCORE_CENTER_FREQUENCY, args.ddc_local_oscillator_frequency )
@@ -271,6 +278,10 @@ def ApplyArgs( vis, args ):
         AgMD2_ApplySetup( vi )
         print( "Firmware:", AgMD2_GetAttributeViString( vi, "", AGMD2_ATTR_INSTRUMENT_FIRMWARE_REVISION, 256 ), file=stderr )
 
+        # The sample rate may have been coerced by the driver.
+        sampleRate = AgMD2_GetAttributeViReal64( vi, "", AGMD2_ATTR_SAMPLE_RATE )
+        _Poller.expected = ExpectedDuration( args.records, args.samples, sampleRate, args.expected_trigger_rate, args.averages if args.mode=='AVG' else 1 )
+
 
 def Calibrate( vis, args, loop ):
     if isinstance( vis, int ):
@@ -290,9 +301,11 @@ def Calibrate( vis, args, loop ):
             AgMD2_SetAttributeViString( vi, "", AGMD2_ATTR_PRIVATE_CALIBRATION_USER_SIGNAL, "" )
 
         AgMD2_SelfCalibrate( vi )
+        # The calibration may change attributes behind the cache.
+        _Cache.Invalidate( vi )
 
         if args.calibration_signal:
-            AgMD2_SetAttributeViString( vi, "", AGMD2_ATTR_PRIVATE_CALIBRATION_USER_SIGNAL, "Signal"+args.calibration_signal )
+            _Cache.Set( vi, "", AGMD2_ATTR_PRIVATE_CALIBRATION_USER_SIGNAL, "Signal"+args.calibration_signal, AgMD2_SetAttributeViString )
 
         if args.trigger_name=="SelfTrigger":
             AgMD2_SelfTriggerInitiateGeneration( vi, "SelfTrigger" )
@@ -320,22 +333,19 @@ def Acquire( vis, args, queue, loop ):
                 #print( "Initiate Acquistion", file=stderr )
                 AgMD2_InitiateAcquisition( vi )
 
-            polls = 0
-            #while _Continue:
-            for a in range(10000):
-                complete = AgMD2_GetAttributeViBoolean( vi, "", AGMD2_ATTR_TSR_IS_ACQUISITION_COMPLETE )
-                #print( "GetAttribute TSR_IS_ACQUISITION_COMPLETE :", complete, file=stderr )
-                if a==9999 or complete:
-                    print( "GetAttribute TSR_IS_ACQUISITION_COMPLETE", polls, " :", "0 -> ", complete, file=stderr )
-                if complete:
-                    return True
-                polls = polls + 1
-                sleep( 0.0001 )
+            complete = _Poller.Poll( lambda: AgMD2_GetAttributeViBoolean( vi, "", AGMD2_ATTR_TSR_IS_ACQUISITION_COMPLETE ), args.wait_timeout )
+            print( "GetAttribute TSR_IS_ACQUISITION_COMPLETE", _Poller.polls, " :", "0 -> ", complete, file=stderr )
+            if args.output_info:
+                print( _Poller.Report(), file=stderr )
+            if complete:
+                return True
 
     elif args.streaming_continuous or args.streaming_triggered:
         for vi in vis:
             if AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_IS_IDLE ) == AGMD2_VAL_ACQUISITION_STATUS_RESULT_TRUE:
                 AgMD2_InitiateAcquisition( vi )
+                # The streams start over.
+                _Assemblers.pop( vi, None )
         return True
 
     else:
@@ -347,20 +357,17 @@ def Acquire( vis, args, queue, loop ):
         while True:
             # Manages wait/poll
             if args.poll_timeout:
-                for vi in vis:
-                    acqDone = False
-                    fullwait = float( args.poll_timeout )
-                    while fullwait>=0 and _Continue and queue.empty() and not acqDone:
-                        oncewait = min( 0.2, fullwait )
-                        sleep( oncewait/1000.0 )
-                        fullwait = fullwait-oncewait
-                        isIdle = AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_IS_IDLE )
-                        acqDone = isIdle==AGMD2_VAL_ACQUISITION_STATUS_RESULT_TRUE
-                    if acqDone:
-                        return True
-                    else:
+                # The timeout is in ms.
+                isIdle = lambda: all( AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_IS_IDLE )==AGMD2_VAL_ACQUISITION_STATUS_RESULT_TRUE for vi in vis )
+                acqDone = _Poller.Poll( isIdle, args.poll_timeout/1000.0, lambda: _Continue and queue.empty() )
+                if args.output_info:
+                    print( _Poller.Report(), file=stderr )
+                if acqDone:
+                    return True
+                else:
+                    for vi in vis:
                         AgMD2_Abort( vi )
-                        return False
+                    return False
             else:
                 try:
                     for vi in vis:
@@ -378,85 +385,114 @@ def Acquire( vis, args, queue, loop ):
 
 
 
-def FetchChannels( vis, args ):
+def FetchChannels( vis, args, sink, pool=None ):
+    """ Fetches the data of the last acquisition, and puts its output to sink.
+        The fetches are issued by pool, a FetchPool, when given.
+    """
     global _Continue
     if isinstance( vis, int ):
         vis = [vis]
-        # Manages readout
+    if pool is None:
+        pool = FetchPool( telemetry=_Telemetry )
+    # Manages readout
     nbrAdcBits = AgMD2_GetAttributeViInt32( vis[0], "", AGMD2_ATTR_INSTRUMENT_INFO_NBR_ADC_BITS )
+    # Only the records and samples that are output are fetched.
+    firstRecord, nbrRecords, offset, nbrSamples = FetchRange( args )
+    # The records are output as text traces, unless --output-summary or --output-shm.
+    output = _SummaryOutput or _ShmOutput
 
     if args.streaming_continuous or args.streaming_triggered:
         sleep( 0.01 )
         for vi in vis:
-            tsCount = 32*1024
-            fetch = AgMD2_StreamFetchDataInt32( vi, "StreamTriggers", tsCount, tsCount )
-            if fetch[3] == tsCount:
-                print( "Fetch: ", 0, fetch[2], fetch[3], fetch[4], file=stderr )
-                with open( "ts.txt", "at" ) as f:
-                  for ts in fetch[0][fetch[4]:fetch[4]+fetch[3]].view( 'uint64' ):
-                      print( ts/256, file=f )
-            else:
-                print( "Available: ", 0, fetch[2], fetch[3], fetch[4], file=stderr )
-            chCount = 8*1024*1024
-            fetchCh1 = AgMD2_StreamFetchDataInt32( vi, "StreamCh1", chCount, chCount )
-            if fetchCh1[3] == chCount:
-                print( "FetchCh1: ", 0, fetchCh1[2], fetchCh1[3], fetchCh1[4], file=stderr )
-            fetchCh2 = AgMD2_StreamFetchDataInt32( vi, "StreamCh2", chCount, chCount )
-            if fetchCh2[3] == chCount:
-                print( "FetchCh2: ", 0, fetchCh2[2], fetchCh2[3], fetchCh2[4], file=stderr )
+            assembler = _Assemblers.get( vi )
+            if assembler is None:
+                xIncrement = 1.0/AgMD2_GetAttributeViReal64( vi, "", AGMD2_ATTR_SAMPLE_RATE )
+                streams = ["StreamCh%d"%( ch ) for ch in args.read_channels]
+                # Samples of 8-bit digitizers are int8.
+                bits = { stream: 8 for stream in streams } if nbrAdcBits<=8 else None
+                assembler = _Assemblers[vi] = StreamAssembler( streams, args.read_samples, xIncrement, bits=bits, nbrAdcBits=nbrAdcBits )
+            with _Telemetry.Stage( "fetch" ):
+                if args.streaming_triggered:
+                    for elements in _FetchStream( vi, "StreamTriggers", 2 ):
+                        assembler.AppendTriggers( elements )
+                        _Telemetry.Count( "fetched", elements.nbytes )
+                for stream in assembler.streams:
+                    for elements in _FetchStream( vi, stream, max( args.read_samples*( assembler.rings[stream].bits or 16 )//32, 1 ) ):
+                        assembler.Append( stream, elements )
+                        _Telemetry.Count( "fetched", elements.nbytes )
+            with _Telemetry.Stage( "build" ):
+                if args.streaming_continuous:
+                    assembler.Cut()
+                records = assembler.Records()
+            _Telemetry.Count( "records", len( records ) )
+            for rec in records:
+                if not sink.Put( output or OutputTrace, rec, sink.file ):
+                    _Continue = False
+                    break
+            if args.output_info:
+                print( "Streaming:", assembler.assembled, "records,", assembler.pending, "pending,", assembler.lost, "lost", file=stderr )
         return
-    
-    if args.mode=='DDC':
-        for vi in vis:
-            if args.ddc_decimation_numerator==4:
-                DataWidth = 16
-                Fetch = AgMD2_DDCCoreFetchWaveformInt16Py
-            else:
-                DataWidth = 32
-                Fetch = AgMD2_DDCCoreFetchWaveformInt32Py
-            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vi, DataWidth, 1, 0, args.read_samples )
 
-            mrec = DDCMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
-            mrec.view = args.ddc_sample_view
-            for ch in args.read_channels:
-                mrec.append( Fetch( vi, "DDCCore%d"%( ch ), 0, args.read_records, 0, args.read_samples, 2*nbrSamplesToRead, args.read_records ) )
+    # Nothing is output when the first record or sample is past the ones read.
+    if nbrRecords==0 and ( args.mode!='DGT' or args.records>1 ):
+        return
 
-            try:
-                OutputTraces( mrec, stdout )
-            except BrokenPipeError:
+    if args.mode=='DDC':
+        if args.ddc_decimation_numerator==4:
+            DataWidth = 16
+            Fetch = AgMD2_DDCCoreFetchWaveformInt16Py
+        else:
+            DataWidth = 32
+            Fetch = AgMD2_DDCCoreFetchWaveformInt32Py
+        calls = []
+        for vi in vis:
+            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vi, DataWidth, 1, offset, nbrSamples )
+            calls += [( vi, Fetch, ( vi, "DDCCore%d"%( ch ), firstRecord, nbrRecords, offset, nbrSamples, 2*nbrSamplesToRead, nbrRecords ) ) for ch in args.read_channels]
+        fetchs = pool.Fetch( calls )
+
+        for index, vi in enumerate( vis ):
+            with _Telemetry.Stage( "build" ):
+                mrec = DDCMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
+                mrec.view = args.ddc_sample_view
+                for fetch in fetchs[index*len( args.read_channels ):( index+1 )*len( args.read_channels )]:
+                    mrec.append( fetch )
+            _Telemetry.Count( "records", nbrRecords )
+
+            if not sink.Put( output or OutputTraces, mrec, sink.file ):
                 _Continue = False
                 break
 
     elif args.mode=='AVG':
-        for vi in vis:
-            if args.read_type == 'real64':
-                DataWidth = 64
-                Fetch = AgMD2_FetchAccumulatedWaveformReal64Py
-            else:
-                DataWidth = 32
-                Fetch = AgMD2_FetchAccumulatedWaveformInt32Py
-            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vi, DataWidth, args.read_records, 0, args.read_samples )
-
-            mrec = AccMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
-            #print( "Fetch", file=stderr )
-            for ch in args.read_channels:
-                try:
-                    #mrec.append( Fetch( vi, "Channel%d"%( ch ), 0, args.read_records, 0, args.read_samples, nbrSamplesToRead, args.read_records ) )
-                    fetch = Fetch( vi, "Channel%d"%( ch ), 0, args.read_records, 0, args.read_samples, nbrSamplesToRead, args.read_records )
-                    #fetch[1] = args.averages
-                except RuntimeError:
-                    AgMD2_SetAttributeViBoolean( vi, "", AGMD2_ATTR_ERROR_ON_OVERRANGE_ENABLED, False )
-                    fetch = Fetch( vi, "Channel%d"%( ch ), 0, args.read_records, 0, args.read_samples, nbrSamplesToRead, args.read_records )
-                    AgMD2_SetAttributeViBoolean( vi, "", AGMD2_ATTR_ERROR_ON_OVERRANGE_ENABLED, True )
-                mrec.append( fetch )
+        if args.read_type == 'real64':
+            DataWidth = 64
+            Fetch = AgMD2_FetchAccumulatedWaveformReal64Py
+        else:
+            DataWidth = 32
+            Fetch = AgMD2_FetchAccumulatedWaveformInt32Py
 
+        def FetchAccumulated( vi, channel, nbrSamplesToRead ):
             try:
-                OutputTraces( mrec, stdout, FirstRecord=args.output_1st_record, NbrRecords=args.output_records, NbrSamples=args.output_samples )
-                stdout.write( "\n" )
-                stdout.flush()
-                #print( "$InitialXTimeSeconds", fetch[6][0], file=stdout )
-                #print( "$InitialXTimeFraction", fetch[7][0], file=stdout )
-            except BrokenPipeError:
+                return Fetch( vi, channel, firstRecord, nbrRecords, offset, nbrSamples, nbrSamplesToRead, nbrRecords )
+            except RuntimeError:
+                AgMD2_SetAttributeViBoolean( vi, "", AGMD2_ATTR_ERROR_ON_OVERRANGE_ENABLED, False )
+                fetch = Fetch( vi, channel, firstRecord, nbrRecords, offset, nbrSamples, nbrSamplesToRead, nbrRecords )
+                AgMD2_SetAttributeViBoolean( vi, "", AGMD2_ATTR_ERROR_ON_OVERRANGE_ENABLED, True )
+                return fetch
+
+        calls = []
+        for vi in vis:
+            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vi, DataWidth, nbrRecords, offset, nbrSamples )
+            calls += [( vi, FetchAccumulated, ( vi, "Channel%d"%( ch ), nbrSamplesToRead ) ) for ch in args.read_channels]
+        fetchs = pool.Fetch( calls )
+
+        for index, vi in enumerate( vis ):
+            with _Telemetry.Stage( "build" ):
+                mrec = AccMultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
+                for fetch in fetchs[index*len( args.read_channels ):( index+1 )*len( args.read_channels )]:
+                    mrec.append( fetch )
+            _Telemetry.Count( "records", nbrRecords )
+
+            if not sink.Put( output or _OutputAccumulated, mrec, sink.file ):
                 _Continue = False
                 break
 
@@ -475,26 +511,26 @@ def FetchChannels( vis, args ):
                 Fetch = AgMD2_FetchWaveformInt8
             nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vis[0], DataWidth, 1, 0, args.read_samples )
 
-            rec = Record( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
+            calls = [( vi, Fetch, ( vi, "Channel%d"%( ch ), nbrSamplesToRead ) ) for vi in vis for ch in args.read_channels]
             try:
-                for vi in vis:
-                    for ch in args.read_channels:
-                        rec.append( Fetch( vi, "Channel%d"%( ch ), nbrSamplesToRead ) )
+                fetchs = pool.Fetch( calls )
             except RuntimeError:
                 for vi in vis:
                     try:
                         AgMD2_SetAttributeViBoolean( vi, "", AGMD2_ATTR_ERROR_ON_OVERRANGE_ENABLED, False )
                     except:
                         continue
-                for vi in vis:
-                    for ch in args.read_channels:
-                        rec.append( Fetch( vi, "Channel%d"%( ch ), nbrSamplesToRead ) )
+                fetchs = pool.Fetch( calls )
                 for vi in vis:
                     AgMD2_SetAttributeViBoolean( vi, "", AGMD2_ATTR_ERROR_ON_OVERRANGE_ENABLED, True )
 
-            try:
-                OutputTrace( rec, stdout )
-            except BrokenPipeError:
+            with _Telemetry.Stage( "build" ):
+                rec = Record( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits )
+                for fetch in fetchs:
+                    rec.append( fetch )
+            _Telemetry.Count( "records" )
+
+            if not _Averager.PutTo( sink, rec, output or OutputTrace ):
                 _Continue = False
 
         else:
@@ -507,18 +543,44 @@ def FetchChannels( vis, args ):
             else:
                 DataWidth = 8
                 Fetch = AgMD2_FetchMultiRecordWaveformInt8
-            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vis[0], DataWidth, args.read_records, 0, args.read_samples )
+            nbrSamplesToRead = AgMD2_QueryMinWaveformMemory( vis[0], DataWidth, nbrRecords, offset, nbrSamples )
 
-            mrec = MultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits ) 
-            for vi in vis:
-                for ch in args.read_channels:
-                    mrec.append( Fetch( vi, "Channel%d"%( ch ), 0, args.read_records, 0, args.read_samples, nbrSamplesToRead, args.read_records ) )
+            calls = [( vi, Fetch, ( vi, "Channel%d"%( ch ), firstRecord, nbrRecords, offset, nbrSamples, nbrSamplesToRead, nbrRecords ) ) for vi in vis for ch in args.read_channels]
+            fetchs = pool.Fetch( calls )
+            with _Telemetry.Stage( "build" ):
+                mrec = MultiRecord( checkXOffset=not args.no_check_x_offset, nbrAdcBits=nbrAdcBits ) 
+                for fetch in fetchs:
+                    mrec.append( fetch )
+            _Telemetry.Count( "records", nbrRecords )
 
-            try:
-                OutputTraces( mrec, stdout )
-            except BrokenPipeError:
+            if not _Averager.PutTo( sink, mrec, output or OutputTraces ):
                 _Continue = False
 
+    if args.output_info:
+        print( pool.Report(), file=stderr )
+
+
+def _FetchStream( vi, stream, count, maximum=16*1024*1024 ):
+    """ Returns the arrays of elements fetched from stream: count elements,
+        then the ones still available, a multiple of count up to maximum.
+    """
+    elements = []
+    while count:
+        fetch = AgMD2_StreamFetchDataInt32( vi, stream, count, count )
+        if fetch[3]<count:
+            break
+        elements.append( fetch[0][fetch[4]:fetch[4]+fetch[3]] )
+        count = min( fetch[2]-fetch[3], maximum )//count*count if len( elements )==1 else 0
+    return elements
+
+
+def _OutputAccumulated( mrec, file ):
+    OutputTraces( mrec, file )
+    file.write( "\n" )
+    file.flush()
+    #print( "$InitialXTimeSeconds", fetch[6][0], file=stdout )
+    #print( "$InitialXTimeFraction", fetch[7][0], file=stdout )
+
 
 class Runner():
     """
@@ -553,6 +615,27 @@ def UpdateArgs( args, queue ):
 
 _Continue = True
 
+# Stream assemblers of the streaming acquisitions, by vi.
+_Assemblers = {}
+
+# Values of the attributes set in the driver, by vi.
+_Cache = AttributeCache()
+
+# Waits for the completion of the acquisitions.
+_Poller = AdaptivePoller()
+
+# Sums the records of the acquisitions with --host-average.
+_Averager = HostAverager()
+
+# Timings of the stages of the loop, reported with --telemetry.
+_Telemetry = Telemetry( "runnermd2", interval=None, file=None )
+
+# Ring of shared memory the records are written to with --output-shm.
+_ShmOutput = None
+
+# Statistics of the records output with --output-summary.
+_SummaryOutput = None
+
 
 def _SignalEndLoop( sig, frame ):
     global _Continue
@@ -560,7 +643,7 @@ def _SignalEndLoop( sig, frame ):
 
 
 def Run( args, queue ):
-    global _Continue
+    global _Continue, _Telemetry, _ShmOutput, _SummaryOutput
 
     args = DigitizerArgs()
 
@@ -571,16 +654,37 @@ def Run( args, queue ):
     oldSigTerm = signal( SIGTERM, _SignalEndLoop )
     oldSigInt  = signal( SIGINT,  _SignalEndLoop )
 
+    _Telemetry = _Poller.telemetry = TelemetryArgs( args, "runnermd2" )
+    output = TimedOutput( stdout )
+    sink = OutputSinkArgs( args, output, _Telemetry )
+    _ShmOutput = ShmRingOutputArgs( args )
+    _SummaryOutput = OutputSummaryArgs( args )
+    _Averager.averages = args.host_average
+    pool = FetchPoolArgs( args, _Telemetry )
+
     loop = 0
     while _Continue:
 
         if UpdateArgs( args, queue ):
-            ApplyArgs( vis, args )
+            sink.Drain()
+            _Averager.Reset()
+            _Averager.averages = args.host_average
+            _SummaryOutput = OutputSummaryArgs( args, _SummaryOutput )
+            with _Telemetry.Stage( "apply" ):
+                ApplyArgs( vis, args )
             
-        Calibrate( vis, args, loop )
+        with _Telemetry.Stage( "calibrate" ):
+            Calibrate( vis, args, loop )
+
+        with _Telemetry.Stage( "acquire" ):
+            acquired = Acquire( vis, args, queue, loop )
+        if acquired:
+            FetchChannels( vis, args, sink, pool )
 
-        if Acquire( vis, args, queue, loop ):
-            FetchChannels( vis, args )
+        _Telemetry.Count( "loops" )
+        _Telemetry.Set( "written", output.bytes )
+        _Telemetry.Set( "write_s", output.seconds )
+        _Telemetry.Tick()
 
         # Manages looping
         loop = loop+1
@@ -594,6 +698,14 @@ def Run( args, queue ):
                     AgMD2_Abort( vi )
             break
 
+    sink.Close()
+    if _ShmOutput:
+        _ShmOutput.Close()
+    pool.Close()
+    _Telemetry.Set( "written", output.bytes )
+    _Telemetry.Set( "write_s", output.seconds )
+    _Telemetry.Close()
+
     signal( SIGTERM, oldSigTerm )
     signal( SIGINT,  oldSigInt )
 
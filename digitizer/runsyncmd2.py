@@ -11,10 +11,17 @@
 
 """
 
-from AgMD2 import *
+from digitizer.simulated import UseSimulation
+if UseSimulation( "AgMD2" ):
+    from digitizer.simulated import *
+else:
+    from AgMD2 import *
 from waveforms.trace import OutputTraces
 from waveforms import MultiRecord, DDCMultiRecord
 from digitizer.argparser import DigitizerParser, DigitizerArgs
+from waveforms.sink import OutputSinkArgs
+from waveforms.telemetry import TelemetryArgs, TimedOutput
+from digitizer.fetchpool import FetchPoolArgs
 import sys
 import os
 from time import sleep
@@ -183,6 +190,11 @@ def RunSyncAcq():
     oldSigTerm = signal( SIGTERM, SignalEndLoop )
     oldSigInt  = signal( SIGINT,  SignalEndLoop )
 
+    telemetry = TelemetryArgs( args, "runsyncmd2" )
+    output = TimedOutput( sys.stdout )
+    sink = OutputSinkArgs( args, output, telemetry )
+    pool = FetchPoolArgs( args, telemetry )
+
     Channels = []
     for Vi in InstrsToRead:
         for Ch in ChannelsToRead:
@@ -216,7 +228,8 @@ def RunSyncAcq():
         for Vi in Instrs:
             AgMD2_WaitForAcquisitionComplete( Vi, 20 )
 
-        for Vi in Instrs: AgMD2_SelfCalibrate( Vi )
+        with telemetry.Stage( "calibrate" ):
+            for Vi in Instrs: AgMD2_SelfCalibrate( Vi )
 
         for Vi in Instrs:
             AgMD2_InitiateAcquisition( Vi )
@@ -235,27 +248,33 @@ def RunSyncAcq():
 
         for measure in Loops( args.loops, breaker=DontContinue ):
 
-            AgMD2_InitiateAcquisition( Instrs[0] )
+            with telemetry.Stage( "acquire" ):
+                AgMD2_InitiateAcquisition( Instrs[0] )
 
-            if sendAXIeTriggers:
-                SendAXIeTriggers( Instrs[0], nbrRecords )
+                if sendAXIeTriggers:
+                    SendAXIeTriggers( Instrs[0], nbrRecords )
 
-            AgMD2_WaitForAcquisitionComplete( Instrs[0], 20000 )
-            for Vi in Instrs[1:]: AgMD2_IsIdle( Vi ) # Required temporarily
+                AgMD2_WaitForAcquisitionComplete( Instrs[0], 20000 )
+                for Vi in Instrs[1:]: AgMD2_IsIdle( Vi ) # Required temporarily
                 
             # Read data on master and slaves.
             if args.mode=='DDC':
                 if args.ddc_decimation_numerator and args.ddc_decimation_numerator>4:
                     wfmSize = 2*AgMD2_QueryMinWaveformMemory( Vi, 32, nbrRecords, 0, nbrSamples )
-                    Fetchs = [AgMD2_DDCCoreFetchWaveformInt32Py( Vi, Ch, 0, nbrRecords, 0, nbrSamples, wfmSize, nbrRecords ) for Vi, Ch in Channels ]
+                    Fetchs = pool.Fetch( [( Vi, AgMD2_DDCCoreFetchWaveformInt32Py, ( Vi, Ch, 0, nbrRecords, 0, nbrSamples, wfmSize, nbrRecords ) ) for Vi, Ch in Channels] )
                 else:
                     wfmSize = 2*AgMD2_QueryMinWaveformMemory( Vi, 16, nbrRecords, 0, nbrSamples )
-                    Fetchs = [AgMD2_DDCCoreFetchWaveformInt16Py( Vi, Ch, 0, nbrRecords, 0, nbrSamples, wfmSize, nbrRecords ) for Vi, Ch in Channels ]
-                mrec = DDCMultiRecord( Fetchs )
+                    Fetchs = pool.Fetch( [( Vi, AgMD2_DDCCoreFetchWaveformInt16Py, ( Vi, Ch, 0, nbrRecords, 0, nbrSamples, wfmSize, nbrRecords ) ) for Vi, Ch in Channels] )
+                with telemetry.Stage( "build" ):
+                    mrec = DDCMultiRecord( Fetchs )
             else:
                 wfmSize = AgMD2_QueryMinWaveformMemory( Vi, 16, nbrRecords, 0, nbrSamples )
-                Fetchs = [AgMD2_FetchMultiRecordWaveformInt16Py( Vi, Ch, 0, nbrRecords, 0, nbrSamples, wfmSize, nbrRecords ) for Vi, Ch in Channels ]
-                mrec = MultiRecord( Fetchs, checkXOffset=not args.no_check_x_offset, nbrAdcBits=16 )
+                Fetchs = pool.Fetch( [( Vi, AgMD2_FetchMultiRecordWaveformInt16Py, ( Vi, Ch, 0, nbrRecords, 0, nbrSamples, wfmSize, nbrRecords ) ) for Vi, Ch in Channels] )
+                with telemetry.Stage( "build" ):
+                    mrec = MultiRecord( Fetchs, checkXOffset=not args.no_check_x_offset, nbrAdcBits=16 )
+            telemetry.Count( "records", nbrRecords )
+            if args.output_info:
+                print( pool.Report(), file=sys.stderr )
 
             tdcString = ""
             if args.read_tdc:
@@ -385,12 +404,15 @@ def RunSyncAcq():
 #                    break
 
             else:
-                try:
-                    OutputTraces( mrec, sys.stdout )
-                except BrokenPipeError:
+                if not sink.Put( OutputTraces, mrec, sink.file ):
                     _Continue = False
                     break
 
+            telemetry.Count( "loops" )
+            telemetry.Set( "written", output.bytes )
+            telemetry.Set( "write_s", output.seconds )
+            telemetry.Tick()
+
             measure = measure+1
             Fetchs = None
             mrec = None
@@ -406,6 +428,12 @@ def RunSyncAcq():
             Instrs   = Instrs[1:]   + [Instrs[0]]
             Handles  = Handles[1:]  + [Handles[0]]
 
+    sink.Close()
+    pool.Close()
+    telemetry.Set( "written", output.bytes )
+    telemetry.Set( "write_s", output.seconds )
+    telemetry.Close()
+
     signal( SIGTERM, oldSigTerm )
     signal( SIGINT,  oldSigInt )
 
@@ -0,0 +1,895 @@
+#!/usr/bin/python3
+
+from numpy import arange, empty, zeros, exp, sin, pi, rint, clip, floor, int8, int16, int32, int64, float64, random
+from importlib.util import find_spec
+from os import environ
+from waveforms.packed import PackSamples
+from sys import argv
+import time
+
+
+""" The simulated module replaces the digitizer drivers, so that the runners
+    can be run, and profiled, on a machine without any module.
+
+    It provides the subset of the AgMD2 functions used by the runners, and an
+    AqMD3 class giving the objects of the object-model driver. Attributes are
+    stored, and the fetch functions return data with the same layout as the
+    driver: a sine wave with gaussian noise in digitizer mode, its sum in
+    averager mode, and IQ pairs in DDC mode. Data is deterministic: the same
+    acquisition of the same channel always returns the same samples.
+
+    A runner uses it instead of the driver when the environment variable
+    WAVEFORMS_SIMULATE is set, or when the driver is not installed and a
+    resource starts with SIM:
+
+    if UseSimulation( "AgMD2" ):
+        from digitizer.simulated import *
+    else:
+        from AgMD2 import *
+
+    The signal and the timing are configured with environment variables:
+    WAVEFORMS_SIMULATE_FREQUENCY    Frequency of the sine wave, in Hz (10e6)
+    WAVEFORMS_SIMULATE_AMPLITUDE    Amplitude, as a fraction of the full scale (0.8)
+    WAVEFORMS_SIMULATE_NOISE        RMS noise, as a fraction of the full scale (0.005)
+    WAVEFORMS_SIMULATE_LATENCY      Duration of an acquisition, in seconds (0.001)
+    WAVEFORMS_SIMULATE_TRIGGER_RATE Rate of the triggers of the records, in Hz (10e3)
+    WAVEFORMS_SIMULATE_SEED         Seed of the noise (0)
+
+"""
+
+
+def UseSimulation( driver, args=None ):
+    """ Returns True when the simulated backend has to be used instead of driver.
+
+    >>> environ.pop( "WAVEFORMS_SIMULATE", None ) and None
+    >>> UseSimulation( "NoSuchDriver", ["-m", "DGT", "PXI0::1::INSTR"] )
+    False
+    >>> UseSimulation( "NoSuchDriver", ["SIM::U5303A"] )
+    True
+    """
+    if environ.get( "WAVEFORMS_SIMULATE", "0" ).lower() not in ( "", "0", "no", "false" ):
+        return True
+    args = argv[1:] if args is None else args
+    if any( arg.startswith( "SIM" ) for arg in args ):
+        return find_spec( driver ) is None
+    return False
+
+
+def _Setting( name, default ):
+    return float( environ.get( "WAVEFORMS_SIMULATE_"+name, default ) )
+
+
+# Models, with their number of bits, of channels, of DDC cores, and their maximum sample rate.
+MODELS = { "U5303A": ( 12, 2, 0, 1.6e9 ),
+           "U5309A": ( 8,  8, 0, 1.0e9 ),
+           "U5310A": ( 10, 2, 0, 4.0e9 ),
+           "U5304A": ( 14, 2, 0, 1.6e9 ),
+           "SA230P": ( 12, 2, 2, 2.0e9 ),
+           "SA220P": ( 12, 2, 0, 2.0e9 ),
+           "M9703B": ( 12, 8, 8, 1.6e9 ),
+           "SA248P": ( 12, 4, 0, 4.0e9 ),
+           "SA217E": ( 12, 2, 0, 1.0e9 ),
+           "SA240P": ( 12, 2, 0, 2.0e9 ), }
+
+
+class _Instrument:
+    """ State of a simulated module, shared by the AgMD2 functions and the AqMD3 objects.
+
+    >>> instr = _Instrument( "", "Simulate=1, DriverSetup= Model=U5303A" )
+    >>> instr.recordSize, instr.records = 8, 2
+    >>> instr.Initiate(); instr.Wait( 1000 )
+    >>> samples, xoffsets, seconds, fractions = instr.Acquired( "Channel1", 0, 2, 0, 8, int16 )
+    >>> print( samples.shape, samples.dtype, len( xoffsets ), instr.XIncrement() )
+    (2, 8) int16 2 6.25e-10
+    >>> bool( ( samples==instr.Acquired( "Channel1", 0, 2, 0, 8, int16 )[0] ).all() )
+    True
+    """
+    def __init__( self, resource, options ):
+        self.options = _ParseOptions( options )
+        self.model = self.options.get( "Model", resource[5:11] if resource[:3]=="SIM" else "" ) or "U5303A"
+        if self.model not in MODELS:
+            raise RuntimeError( "ERROR: Unknown simulated model "+self.model+"." )
+        self.nbrAdcBits, self.nbrChannels, self.nbrDDCCores, self.maxSampleRate = MODELS[self.model]
+        self.frequency   = _Setting( "FREQUENCY", 10e6 )
+        self.amplitude   = _Setting( "AMPLITUDE", 0.8 )
+        self.noise       = _Setting( "NOISE", 0.005 )
+        self.latency     = _Setting( "LATENCY", 0.001 )
+        self.triggerRate = _Setting( "TRIGGER_RATE", 10e3 )
+        self.seed        = int( _Setting( "SEED", 0 ) )
+        self.sampleRate = self.maxSampleRate
+        self.recordSize = 1024
+        self.records = 1
+        self.averages = 1
+        self.mode = 'DGT'
+        self.ranges = {}
+        self.offsets = {}
+        self.centerFrequency = 0.0
+        self.decimation = ( 16, 1 )
+        self.attributes = {}
+        self.acquisition = 0
+        self.started = None
+        self.streamed = {}
+        self.streaming = None
+        self.slaves = []
+
+    def Range( self, channel ):
+        return self.ranges.get( channel, 1.0 )
+
+    def XIncrement( self ):
+        if self.mode=='DDC':
+            return self.decimation[0]/self.decimation[1]/self.sampleRate
+        return 1.0/self.sampleRate
+
+    def Initiate( self ):
+        self.acquisition += 1
+        self.started = time.perf_counter()
+        self.streamed = {}
+        # The slaves acquire on the triggers of their master.
+        for slave in self.slaves:
+            slave.acquisition, slave.started, slave.streamed = self.acquisition, self.started, {}
+
+    def Abort( self ):
+        self.started = None
+        for slave in self.slaves:
+            slave.started = None
+
+    def IsIdle( self ):
+        if self.streaming is not None:
+            # A streaming acquisition runs until it is aborted.
+            return self.started is None
+        return self.started is None or time.perf_counter()-self.started>=self.latency
+
+    def Wait( self, timeoutMs ):
+        if self.started is None:
+            return
+        remaining = self.latency-( time.perf_counter()-self.started )
+        if remaining*1000>timeoutMs:
+            time.sleep( timeoutMs/1000 )
+            raise RuntimeError( "ERROR: WaitForAcquisitionComplete MAX_TIME_EXCEEDED." )
+        if remaining>0:
+            time.sleep( remaining )
+
+    def _Volts( self, channel, records, points, xinc, offset ):
+        """ Returns the signal in volts, and the trigger times, of records. """
+        index = int( "".join( c for c in channel if c.isdigit() ) or 0 )
+        # The channels of an acquisition share its triggers.
+        xoffsets = -xinc*random.default_rng( ( self.seed, self.acquisition ) ).random( records )
+        rng = random.default_rng( ( self.seed, self.acquisition, index ) )
+        times = self.acquisition*self.latency + arange( records )/self.triggerRate
+        t = ( times+xoffsets )[:, None] + ( arange( points )+offset )*xinc
+        fullScale = self.Range( channel )
+        volts = self.amplitude*fullScale/2*sin( 2*pi*self.frequency*t + index*pi/8 )
+        volts += self.noise*fullScale*rng.standard_normal( volts.shape )
+        return volts, xoffsets, times
+
+    def Acquired( self, channel, firstRecord, records, offset, points, dtype ):
+        """ Returns the samples of records of channel in a 2D array of dtype,
+            with the InitialXOffset, InitialXTimeSeconds and InitialXTimeFraction
+            of each record.
+        """
+        records = max( 0, min( records, self.records-firstRecord ) )
+        points = max( 0, min( points, self.recordSize-offset ) )
+        volts, xoffsets, times = self._Volts( channel, firstRecord+records, points, 1.0/self.sampleRate, offset )
+        volts, xoffsets, times = volts[firstRecord:], xoffsets[firstRecord:], times[firstRecord:]
+        seconds = floor( times )
+        if dtype==float64:
+            samples = volts+self.offsets.get( channel, 0.0 )
+        else:
+            samples = self._Codes( volts, channel, dtype )
+        return samples, xoffsets.tolist(), seconds.tolist(), ( times-seconds ).tolist()
+
+    def ScaleFactor( self, channel, dtype ):
+        return self.Range( channel )/( 2.0**( 8*dtype( 0 ).itemsize ) )
+
+    def _Codes( self, volts, channel, dtype ):
+        """ Quantizes volts with the resolution of the ADC, aligned on the MSB of dtype. """
+        bits = 8*dtype( 0 ).itemsize
+        shift = max( 0, bits-self.nbrAdcBits )
+        codes = rint( volts/self.ScaleFactor( channel, dtype )/2**shift )
+        return ( clip( codes, -2**( bits-1-shift ), 2**( bits-1-shift )-1 )*2**shift ).astype( dtype )
+
+    def Accumulated( self, channel, firstRecord, records, offset, points, dtype ):
+        """ Same as Acquired, for the sum of averages acquisitions. The noise of the sum is reduced accordingly. """
+        noise = self.noise
+        self.noise = noise/max( 1, self.averages )**0.5
+        try:
+            volts, xoffsets, seconds, fractions = self.Acquired( channel, firstRecord, records, offset, points, float64 )
+        finally:
+            self.noise = noise
+        volts -= self.offsets.get( channel, 0.0 )
+        codes = rint( volts/self.ScaleFactor( channel, int16 )/2**( 16-self.nbrAdcBits ) )*self.averages
+        if dtype==float64:
+            return codes*self.ScaleFactor( channel, int16 )*2**( 16-self.nbrAdcBits ), xoffsets, seconds, fractions
+        return codes.astype( int32 ), xoffsets, seconds, fractions
+
+    def DownConverted( self, core, firstRecord, records, offset, points, dtype ):
+        """ Returns the IQ pairs of records of a DDC core, interleaved in a 2D array of dtype. """
+        records = max( 0, min( records, self.records-firstRecord ) )
+        index = int( "".join( c for c in core if c.isdigit() ) or 0 )
+        xinc = self.XIncrement()
+        xoffsets = -xinc*random.default_rng( ( self.seed, self.acquisition ) ).random( firstRecord+records )[firstRecord:]
+        rng = random.default_rng( ( self.seed, self.acquisition, 100+index ) )
+        times = self.acquisition*self.latency + arange( firstRecord, firstRecord+records )/self.triggerRate
+        t = ( times+xoffsets )[:, None] + ( arange( points )+offset )*xinc
+        fullScale = 2.0**( 8*dtype( 0 ).itemsize-1 )
+        iq = self.amplitude*fullScale*exp( 2j*pi*( self.frequency-self.centerFrequency )*t )
+        samples = empty( ( records, 2*points ), dtype=dtype )
+        samples[:, 0::2] = clip( rint( iq.real + self.noise*fullScale*rng.standard_normal( iq.shape ) ), -fullScale, fullScale-1 )
+        samples[:, 1::2] = clip( rint( iq.imag + self.noise*fullScale*rng.standard_normal( iq.shape ) ), -fullScale, fullScale-1 )
+        seconds = floor( times )
+        return samples, xoffsets.tolist(), seconds.tolist(), ( times-seconds ).tolist()
+
+    def Streamed( self, stream, count, bits=16 ):
+        """ Returns count elements of a stream, if they have been acquired
+            since Initiate, and the number of available elements. The samples
+            of a truncated stream are packed in bits bits.
+        """
+        if self.started is None:
+            return zeros( 0, dtype=int32 ), -1
+        elapsed = time.perf_counter()-self.started
+        if stream=="StreamTriggers":
+            produced = 2*int( elapsed*self.triggerRate )
+        else:
+            produced = int( elapsed*self.sampleRate*bits/32 )
+        done = self.streamed.get( stream, 0 )
+        available = produced-done
+        if available<count:
+            return zeros( 0, dtype=int32 ), available
+        if stream=="StreamTriggers":
+            first = done//2
+            timestamps = ( arange( first, first+count//2 )/self.triggerRate*self.sampleRate*256 ).astype( int64 )
+            elements = timestamps.view( int32 )
+        else:
+            channel = "Channel"+"".join( c for c in stream if c.isdigit() )
+            first, samples = done*32//bits, count*32//bits
+            volts = self.amplitude*self.Range( channel )/2*sin( 2*pi*self.frequency*( first+arange( samples ) )/self.sampleRate )
+            elements = self._Codes( volts, channel, int16 ).view( int32 ) if bits==16 else PackSamples( self._Codes( volts, channel, int16 ), bits )[:count]
+        self.streamed[stream] = done+count
+        return elements, available
+
+
+def _ParseOptions( options ):
+    """ Returns the Key=Value pairs of an option string, including the ones of DriverSetup.
+
+    >>> _ParseOptions( "Simulate=1, DriverSetup= Model=U5303A, Trace=false" )
+    {'Simulate': '1', 'Model': 'U5303A', 'Trace': 'false'}
+    """
+    pairs = {}
+    for item in str( options or "" ).replace( "DriverSetup=", "," ).split( "," ):
+        if "=" in item:
+            key, value = item.split( "=", 1 )
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+#
+# AgMD2 functions
+#
+
+VI_TRUE  = True
+VI_FALSE = False
+
+AGMD2_VAL_ACQUISITION_STATUS_RESULT_TRUE          = 1
+AGMD2_VAL_ACQUISITION_STATUS_RESULT_FALSE         = 2
+AGMD2_VAL_ACQUISITION_STATUS_RESULT_DONT_KNOW     = 3
+AGMD2_VAL_ACQUISITION_MODE_NORMAL                 = 0
+AGMD2_VAL_ACQUISITION_MODE_AVERAGER               = 1
+AGMD2_VAL_ACQUISITION_MODE_DIGITAL_DOWN_CONVERSION = 2
+AGMD2_VAL_POSITIVE                                = 1
+AGMD2_VAL_NEGATIVE                                = 0
+
+_VALUES = """ LOGIC_DEVICE_CORE_PCIE LOGIC_DEVICE_CORE_DDR3A LOGIC_DEVICE_CORE_DDR3B LOGIC_DEVICE_CORE_CALIBRATION_DIGITIZER
+              LOGIC_DEVICE_CORE_IFDL_UP LOGIC_DEVICE_CORE_IFDL_DOWN LOGIC_DEVICE_CORE_IFDL_CONTROL LOGIC_DEVICE_CORE_QDR2
+              LOGIC_DEVICE_CORE_ADC_INTERFACE LOGIC_DEVICE_CORE_STREAM_PREPARE LOGIC_DEVICE_CORE_TRIGGER_MANAGER
+              REFERENCE_OSCILLATOR_SOURCE_INTERNAL REFERENCE_OSCILLATOR_SOURCE_EXTERNAL REFERENCE_OSCILLATOR_SOURCE_PXIE_CLK100
+              REFERENCE_OSCILLATOR_SOURCE_AXIE_CLK100 SAMPLE_CLOCK_SOURCE_INTERNAL SAMPLE_CLOCK_SOURCE_EXTERNAL
+              SELF_TRIGGER_MODE_SQUARE_WAVE SELF_TRIGGER_MODE_ARMED_PULSE STREAMING_MODE_CONTINUOUS STREAMING_MODE_TRIGGERED """
+
+_ATTRIBUTES = """ ACQUISITION_MODE ACQUISITION_NUMBER_OF_AVERAGES ACTIVE_TRIGGER_SOURCE CALIBRATION_IS_REQUIRED
+                  CALIBRATION_TARGET_VOLTAGE_ENABLED CHANNEL_CALIBRATION_TARGET_VOLTAGE CHANNEL_ENABLED CONTROL_IO_SIGNAL
+                  DDCCORE_CENTER_FREQUENCY DDCCORE_COUNT DDCCORE_DECIMATION_DENOMINATOR DDCCORE_DECIMATION_NUMERATOR
+                  ERROR_ON_OVERRANGE_ENABLED INPUT_FILTER_MAX_FREQUENCY INSTRUMENT_FIRMWARE_REVISION INSTRUMENT_INFO_IO_VERSION
+                  INSTRUMENT_INFO_NBR_ADC_BITS INSTRUMENT_INFO_OPTIONS INSTRUMENT_INFO_SERIAL_NUMBER_STRING INSTRUMENT_MODEL
+                  IS_IDLE MODULE_SYNCHRONIZATION_HANDLE NUM_RECORDS_TO_ACQUIRE PRIVATE_ACCESS_PASSWORD
+                  PRIVATE_CALIBRATION_USER_SIGNAL RECORD_SIZE REFERENCE_OSCILLATOR_SOURCE SAMPLE_CLOCK_EXTERNAL_DIVIDER
+                  SAMPLE_CLOCK_EXTERNAL_FREQUENCY SAMPLE_CLOCK_SOURCE SAMPLE_RATE SELF_TRIGGER_MODE SELF_TRIGGER_PULSE_DURATION
+                  SELF_TRIGGER_SQUARE_WAVE_DUTY_CYCLE SELF_TRIGGER_SQUARE_WAVE_FREQUENCY SPECIFIC_DRIVER_REVISION STREAMING_MODE
+                  TIME_INTERLEAVED_CHANNEL_LIST TRIGGER_DELAY TRIGGER_LEVEL TRIGGER_OUTPUT_ENABLED TRIGGER_OUTPUT_OFFSET
+                  TRIGGER_OUTPUT_SOURCE TRIGGER_SLOPE TSR_ENABLED TSR_IS_ACQUISITION_COMPLETE TSR_MEMORY_OVERFLOW_OCCURRED
+                  VERTICAL_OFFSET VERTICAL_RANGE """
+
+for _number, _name in enumerate( _VALUES.split() ):
+    globals()["AGMD2_VAL_"+_name] = 100+_number
+for _number, _name in enumerate( _ATTRIBUTES.split() ):
+    globals()["AGMD2_ATTR_"+_name] = 1250001+_number
+del _number, _name
+
+# Attributes that are fields of the instrument, with the conversion of their values.
+_FIELDS = { AGMD2_ATTR_SAMPLE_RATE:                    ( 'sampleRate', float ),
+            AGMD2_ATTR_RECORD_SIZE:                    ( 'recordSize', int ),
+            AGMD2_ATTR_NUM_RECORDS_TO_ACQUIRE:         ( 'records', int ),
+            AGMD2_ATTR_ACQUISITION_NUMBER_OF_AVERAGES: ( 'averages', int ),
+            AGMD2_ATTR_INSTRUMENT_INFO_NBR_ADC_BITS:   ( 'nbrAdcBits', int ),
+            AGMD2_ATTR_DDCCORE_COUNT:                  ( 'nbrDDCCores', int ),
+            AGMD2_ATTR_INSTRUMENT_MODEL:               ( 'model', str ),
+            AGMD2_ATTR_DDCCORE_CENTER_FREQUENCY:       ( 'centerFrequency', float ),
+            AGMD2_ATTR_STREAMING_MODE:                 ( 'streaming', int ), }
+
+_MODES = { AGMD2_VAL_ACQUISITION_MODE_NORMAL: 'DGT',
+           AGMD2_VAL_ACQUISITION_MODE_AVERAGER: 'AVG',
+           AGMD2_VAL_ACQUISITION_MODE_DIGITAL_DOWN_CONVERSION: 'DDC' }
+
+_Instruments = {}
+
+
+def _Instance( vi ):
+    """ Returns the instrument of a session, or of an AqMD3 object. """
+    try:
+        return vi._instrument if isinstance( vi, AqMD3 ) else _Instruments[vi]
+    except KeyError:
+        raise RuntimeError( "ERROR: Invalid simulated session "+str( vi )+"." )
+
+
+def AgMD2_InitWithOptions( resource, idQuery, reset, options ):
+    """ Opens a simulated session.
+
+    >>> vi = AgMD2_InitWithOptions( "", 0, 0, "Simulate=1, DriverSetup= Model=U5303A" )
+    >>> AgMD2_SetAttributeViInt64( vi, "", AGMD2_ATTR_RECORD_SIZE, 16 )
+    >>> AgMD2_InitiateAcquisition( vi ); AgMD2_WaitForAcquisitionComplete( vi, 1000 )
+    >>> fetch = AgMD2_FetchWaveformInt16( vi, "Channel1", AgMD2_QueryMinWaveformMemory( vi, 16, 1, 0, 16 ) )
+    >>> print( len( fetch ), fetch[1], AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_INSTRUMENT_INFO_NBR_ADC_BITS ) )
+    9 16 12
+    >>> AgMD2_close( vi )
+    """
+    if resource and not resource.startswith( "SIM" ) and "Simulate=1" not in str( options ).replace( " ", "" ) and not UseSimulation( "AgMD2", [] ):
+        raise RuntimeError( "ERROR: Cannot simulate resource "+resource+", use a SIM resource or set WAVEFORMS_SIMULATE." )
+    vi = max( _Instruments, default=0 )+1
+    _Instruments[vi] = _Instrument( resource, options )
+    return vi
+
+
+def AgMD2_close( vi ):
+    _Instruments.pop( vi, None )
+
+
+def _GetAttribute( vi, repCap, attr, default ):
+    instr = _Instance( vi )
+    if attr in _FIELDS:
+        return getattr( instr, _FIELDS[attr][0] )
+    if attr==AGMD2_ATTR_IS_IDLE:
+        return AGMD2_VAL_ACQUISITION_STATUS_RESULT_TRUE if instr.IsIdle() else AGMD2_VAL_ACQUISITION_STATUS_RESULT_FALSE
+    if attr==AGMD2_ATTR_TSR_IS_ACQUISITION_COMPLETE:
+        return instr.IsIdle()
+    if attr==AGMD2_ATTR_ACQUISITION_MODE:
+        return { mode: value for value, mode in _MODES.items() }[instr.mode]
+    if attr==AGMD2_ATTR_VERTICAL_RANGE:
+        return instr.Range( repCap )
+    if attr==AGMD2_ATTR_VERTICAL_OFFSET:
+        return instr.offsets.get( repCap, 0.0 )
+    if attr in ( AGMD2_ATTR_SPECIFIC_DRIVER_REVISION, AGMD2_ATTR_INSTRUMENT_FIRMWARE_REVISION, AGMD2_ATTR_INSTRUMENT_INFO_IO_VERSION ):
+        return "Simulated"
+    if attr==AGMD2_ATTR_INSTRUMENT_INFO_SERIAL_NUMBER_STRING:
+        return "SIM%05d" % ( id( instr )%100000 )
+    if attr==AGMD2_ATTR_MODULE_SYNCHRONIZATION_HANDLE:
+        return vi
+    return instr.attributes.get( ( repCap, attr ), default )
+
+
+def _SetAttribute( vi, repCap, attr, value ):
+    instr = _Instance( vi )
+    if attr in _FIELDS:
+        field, convert = _FIELDS[attr]
+        setattr( instr, field, convert( value ) )
+    elif attr==AGMD2_ATTR_ACQUISITION_MODE:
+        instr.mode = _MODES.get( value, 'DGT' )
+    elif attr==AGMD2_ATTR_VERTICAL_RANGE:
+        instr.ranges[repCap] = float( value )
+    elif attr==AGMD2_ATTR_VERTICAL_OFFSET:
+        instr.offsets[repCap] = float( value )
+    elif attr==AGMD2_ATTR_DDCCORE_DECIMATION_NUMERATOR:
+        instr.decimation = ( int( value ), instr.decimation[1] )
+    elif attr==AGMD2_ATTR_DDCCORE_DECIMATION_DENOMINATOR:
+        instr.decimation = ( instr.decimation[0], int( value ) )
+    instr.attributes[( repCap, attr )] = value
+
+
+def AgMD2_GetAttributeViInt8( vi, repCap, attr ):      return _GetAttribute( vi, repCap, attr, 0 )
+def AgMD2_GetAttributeViInt16( vi, repCap, attr ):     return _GetAttribute( vi, repCap, attr, 0 )
+def AgMD2_GetAttributeViInt32( vi, repCap, attr ):     return _GetAttribute( vi, repCap, attr, 0 )
+def AgMD2_GetAttributeViInt64( vi, repCap, attr ):     return _GetAttribute( vi, repCap, attr, 0 )
+def AgMD2_GetAttributeViReal64( vi, repCap, attr ):    return _GetAttribute( vi, repCap, attr, 0.0 )
+def AgMD2_GetAttributeViBoolean( vi, repCap, attr ):   return _GetAttribute( vi, repCap, attr, False )
+def AgMD2_GetAttributeViString( vi, repCap, attr, size=256 ): return str( _GetAttribute( vi, repCap, attr, "" ) )
+
+AgMD2_SetAttributeViInt8    = _SetAttribute
+AgMD2_SetAttributeViInt16   = _SetAttribute
+AgMD2_SetAttributeViInt32   = _SetAttribute
+AgMD2_SetAttributeViInt64   = _SetAttribute
+AgMD2_SetAttributeViReal64  = _SetAttribute
+AgMD2_SetAttributeViBoolean = _SetAttribute
+AgMD2_SetAttributeViString  = _SetAttribute
+
+
+def AgMD2_ApplySetup( vi ):                    _Instance( vi )
+def AgMD2_SelfCalibrate( vi ):                 _Instance( vi )
+def AgMD2_SelfTriggerInitiateGeneration( vi, source ): _Instance( vi )
+def AgMD2_ModuleSynchronizationConfigureSlaves( vi, handles ):
+    """ Makes the modules of handles slaves of vi, or none without handles.
+
+    >>> master = AgMD2_InitWithOptions( "", 0, 0, "Simulate=1, DriverSetup= Model=U5303A" )
+    >>> slave = AgMD2_InitWithOptions( "", 0, 0, "Simulate=1, DriverSetup= Model=U5303A" )
+    >>> AgMD2_ModuleSynchronizationConfigureSlaves( master, [AgMD2_GetAttributeViInt32( slave, "", AGMD2_ATTR_MODULE_SYNCHRONIZATION_HANDLE )] )
+    >>> AgMD2_InitiateAcquisition( master ); AgMD2_InitiateAcquisition( master )
+    >>> print( _Instance( slave ).acquisition, _Instance( slave ).started==_Instance( master ).started )
+    2 True
+    >>> AgMD2_ModuleSynchronizationConfigureSlaves( master, None ); AgMD2_close( master ); AgMD2_close( slave )
+    """
+    _Instance( vi ).slaves = [_Instance( handle ) for handle in handles or []]
+def AgMD2_InitiateAcquisition( vi ):           _Instance( vi ).Initiate()
+def AgMD2_Abort( vi ):                         _Instance( vi ).Abort()
+def AgMD2_WaitForAcquisitionComplete( vi, timeoutMs ): _Instance( vi ).Wait( timeoutMs )
+
+
+def AgMD2_IsIdle( vi ):
+    return AgMD2_GetAttributeViInt32( vi, "", AGMD2_ATTR_IS_IDLE )
+
+
+def AgMD2_TSRContinue( vi ):
+    instr = _Instance( vi )
+    if instr.started is None:
+        raise RuntimeError( "ERROR: TSR acquisition is not started." )
+    instr.Initiate()
+
+
+def AgMD2_LogicDeviceGetCoreVersion( vi, logicDevice, core, size ):
+    _Instance( vi )
+    return 0x01000000, "1.0.0.0 simulated"
+
+
+def AgMD2_UserControlWriteControlRegisterInt32( vi, offset, value ):
+    _Instance( vi ).attributes[( "UserControl", offset )] = value
+
+
+def AgMD2_UserControlReadControlRegisterInt32( vi, offset ):
+    return _Instance( vi ).attributes.get( ( "UserControl", offset ), 0 )
+
+
+_PADDING = 32
+
+def AgMD2_QueryMinWaveformMemory( vi, dataWidth, records, offset, points ):
+    return records*( offset+points+2*_PADDING )
+
+
+def _FetchSingle( vi, channel, size, dtype ):
+    instr = _Instance( vi )
+    samples, xoffsets, seconds, fractions = instr.Acquired( channel, 0, 1, 0, instr.recordSize, dtype )
+    points = samples.shape[1]
+    array = zeros( max( size, points+_PADDING ), dtype=dtype )
+    array[_PADDING//2:_PADDING//2+points] = samples[0]
+    fetch = ( array, points, _PADDING//2, xoffsets[0], seconds[0], fractions[0], instr.XIncrement() )
+    if dtype==float64:
+        return fetch
+    return fetch+( instr.ScaleFactor( channel, dtype ), instr.offsets.get( channel, 0.0 ) )
+
+def AgMD2_FetchWaveformInt8( vi, channel, size ):   return _FetchSingle( vi, channel, size, int8 )
+def AgMD2_FetchWaveformInt16( vi, channel, size ):  return _FetchSingle( vi, channel, size, int16 )
+def AgMD2_FetchWaveformReal64( vi, channel, size ): return _FetchSingle( vi, channel, size, float64 )
+
+
+def _Layout( samples, size, width=1 ):
+    """ Copies the rows of samples into a flat array, as the driver does, and
+        returns it with the first valid point of each row.
+    """
+    records, points = samples.shape
+    stride = points//width+2*_PADDING
+    array = zeros( max( size, records*stride )*width, dtype=samples.dtype )
+    firsts = [r*stride+_PADDING for r in range( records )]
+    for r, first in enumerate( firsts ):
+        array[first*width:first*width+points] = samples[r]
+    return array, firsts
+
+def _FetchMulti( vi, channel, firstRecord, numRecords, offset, points, size, dtype ):
+    instr = _Instance( vi )
+    samples, xoffsets, seconds, fractions = instr.Acquired( channel, firstRecord, numRecords, offset, points, dtype )
+    array, firsts = _Layout( samples, size )
+    records, actual = samples.shape
+    fetch = ( array, len( array ), records, [actual]*records, firsts, xoffsets, seconds, fractions, instr.XIncrement() )
+    if dtype==float64:
+        return fetch
+    return fetch+( instr.ScaleFactor( channel, dtype ), instr.offsets.get( channel, 0.0 ) )
+
+# The Py functions return lists, the others tuples.
+def AgMD2_FetchMultiRecordWaveformInt8( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return _FetchMulti( vi, channel, firstRecord, numRecords, offset, points, size, int8 )
+def AgMD2_FetchMultiRecordWaveformInt16( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return _FetchMulti( vi, channel, firstRecord, numRecords, offset, points, size, int16 )
+def AgMD2_FetchMultiRecordWaveformInt8Py( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchMulti( vi, channel, firstRecord, numRecords, offset, points, size, int8 ) )
+def AgMD2_FetchMultiRecordWaveformInt16Py( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchMulti( vi, channel, firstRecord, numRecords, offset, points, size, int16 ) )
+def AgMD2_FetchMultiRecordWaveformReal64Py( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchMulti( vi, channel, firstRecord, numRecords, offset, points, size, float64 ) )
+
+
+def _FetchAccumulated( vi, channel, firstRecord, numRecords, offset, points, size, dtype ):
+    instr = _Instance( vi )
+    samples, xoffsets, seconds, fractions = instr.Accumulated( channel, firstRecord, numRecords, offset, points, dtype )
+    array, firsts = _Layout( samples, size )
+    records, actual = samples.shape
+    fetch = ( array, instr.averages, records, [actual]*records, firsts, xoffsets[0] if xoffsets else 0.0, seconds, fractions, instr.XIncrement() )
+    if dtype!=float64:
+        fetch += ( instr.ScaleFactor( channel, int16 )*2**( 16-instr.nbrAdcBits ), instr.offsets.get( channel, 0.0 ) )
+    return fetch+( [0]*records, )
+
+def AgMD2_FetchAccumulatedWaveformInt32Py( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchAccumulated( vi, channel, firstRecord, numRecords, offset, points, size, int32 ) )
+def AgMD2_FetchAccumulatedWaveformReal64Py( vi, channel, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchAccumulated( vi, channel, firstRecord, numRecords, offset, points, size, float64 ) )
+
+
+def _FetchDDC( vi, core, firstRecord, numRecords, offset, points, size, dtype ):
+    instr = _Instance( vi )
+    samples, xoffsets, seconds, fractions = instr.DownConverted( core, firstRecord, numRecords, offset, points, dtype )
+    array, firsts = _Layout( samples, size//2, width=2 )
+    records = samples.shape[0]
+    return ( array, records, [samples.shape[1]//2]*records, firsts, xoffsets, seconds, fractions, instr.XIncrement(),
+             instr.Range( core )/2.0**( 8*dtype( 0 ).itemsize ), 0.0, [0]*records )
+
+def AgMD2_DDCCoreFetchWaveformInt16Py( vi, core, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchDDC( vi, core, firstRecord, numRecords, offset, points, size, int16 ) )
+def AgMD2_DDCCoreFetchWaveformInt32Py( vi, core, firstRecord, numRecords, offset, points, size, arraySize ):
+    return list( _FetchDDC( vi, core, firstRecord, numRecords, offset, points, size, int32 ) )
+
+
+def AgMD2_StreamFetchDataInt32( vi, stream, count, size ):
+    """ Returns the elements, their number, the available elements, the actual elements and the first one. """
+    elements, available = _Instance( vi ).Streamed( stream, count )
+    array = zeros( max( size, len( elements ) ), dtype=int32 )
+    array[:len( elements )] = elements
+    return ( array, len( array ), available, len( elements ), 0 )
+
+
+#
+# AqMD3 objects
+#
+
+class _Enumeration:
+    """ Values of an enumeration of the object-model driver, as strings.
+
+    >>> print( _Enumeration( "TriggerSlope" ).Positive )
+    TriggerSlope.Positive
+    """
+    def __init__( self, name ):
+        self._name = name
+
+    def __getattr__( self, value ):
+        if value.startswith( '__' ):
+            raise AttributeError( value )
+        return self._name+"."+value
+
+
+AcquisitionMode           = _Enumeration( "AcquisitionMode" )
+AcquisitionStatusResult   = _Enumeration( "AcquisitionStatusResult" )
+CalibrationEqualization   = _Enumeration( "CalibrationEqualization" )
+DataReductionMode         = _Enumeration( "DataReductionMode" )
+ReferenceOscillatorSource = _Enumeration( "ReferenceOscillatorSource" )
+SampleClockSource         = _Enumeration( "SampleClockSource" )
+SelfTriggerMode           = _Enumeration( "SelfTriggerMode" )
+StreamingMode             = _Enumeration( "StreamingMode" )
+StreamType                = _Enumeration( "StreamType" )
+TimeResetMode             = _Enumeration( "TimeResetMode" )
+TriggerSlope              = _Enumeration( "TriggerSlope" )
+
+
+class _Node:
+    """ Object of the driver hierarchy. Attributes never set read as nodes,
+        calling a node does nothing, and indexing it returns a child node.
+
+    >>> node = _Node( Name="Node" )
+    >>> node.Sub.Value = 3
+    >>> node.Sub.Method( 1, 2 )
+    >>> print( node.Name, node.Sub.Value, node.Sources["Internal1"] is node.Sources["Internal1"] )
+    Node 3 True
+    """
+    def __init__( self, **values ):
+        self.__dict__.update( values )
+
+    def __getattr__( self, name ):
+        if name.startswith( '__' ):
+            raise AttributeError( name )
+        node = _Node()
+        setattr( self, name, node )
+        return node
+
+    def __call__( self, *args, **kwargs ):
+        return None
+
+    def __getitem__( self, key ):
+        items = self.__dict__.setdefault( '_items', {} )
+        return items.setdefault( key, _Node( Name=key ) )
+
+    def __iter__( self ):
+        return iter( self.__dict__.get( '_items', {} ).values() )
+
+
+class _Collection( _Node ):
+    """ Repeated capabilities, indexed by name or by position. """
+    def __init__( self, items ):
+        self._list = items
+
+    def __getitem__( self, key ):
+        if isinstance( key, int ):
+            return self._list[key]
+        for item in self._list:
+            if item.Name==key:
+                return item
+        raise KeyError( key )
+
+    def __iter__( self ):
+        return iter( self._list )
+
+    def __len__( self ):
+        return len( self._list )
+
+    @property
+    def Count( self ):
+        return len( self._list )
+
+
+class AqMD3Waveform:
+    def __init__( self, samples, xoffset, seconds, fraction, xinc, scaleFactor, scaleOffset ):
+        self.Samples = samples
+        self.ActualPoints = self.ActualSamples = len( samples )
+        self.FirstValidPoint = self.FirstValidSample = 0
+        self.InitialXOffset = xoffset
+        self.InitialXTimeSeconds = seconds
+        self.InitialXTimeFraction = fraction
+        self.XIncrement = xinc
+        self.ScaleFactor = scaleFactor
+        self.ScaleOffset = scaleOffset
+
+    def __len__( self ):
+        return len( self.Samples )
+
+    def __getitem__( self, index ):
+        return self.Samples[index]
+
+    def __iter__( self ):
+        return iter( self.Samples )
+
+
+class AqMD3WaveformCollection:
+    def __init__( self, waveforms ):
+        self._waveforms = waveforms
+        self.ActualRecords = len( waveforms )
+
+    def __len__( self ):
+        return self.ActualRecords
+
+    def __getitem__( self, index ):
+        return self._waveforms[index]
+
+    def __iter__( self ):
+        return iter( self._waveforms )
+
+
+class AqMD3AccumulatedWaveformCollection( AqMD3WaveformCollection ):
+    def __init__( self, waveforms, averages ):
+        AqMD3WaveformCollection.__init__( self, waveforms )
+        self.ActualAverages = averages
+        self.ActualPoints = [wfm.ActualPoints for wfm in waveforms]
+        self.InitialXOffset = waveforms[0].InitialXOffset if waveforms else 0.0
+        self.InitialXTimeSeconds = [wfm.InitialXTimeSeconds for wfm in waveforms]
+        self.InitialXTimeFraction = [wfm.InitialXTimeFraction for wfm in waveforms]
+        self.XIncrement = waveforms[0].XIncrement if waveforms else 0.0
+
+
+_DTYPES = { 'int8': int8, 'int16': int16, 'int32': int32, 'real64': float64, 'float64': float64, None: int16 }
+
+
+class _Measurement( _Node ):
+    def __init__( self, instr, channel ):
+        self._instr = instr
+        self._channel = channel
+
+    def _Waveforms( self, acquired, dtype ):
+        samples, xoffsets, seconds, fractions = acquired
+        instr, channel = self._instr, self._channel
+        scale = 1.0 if dtype==float64 else instr.ScaleFactor( channel, dtype )
+        return [AqMD3Waveform( samples[r], xoffsets[r], seconds[r], fractions[r], instr.XIncrement(), scale, instr.offsets.get( channel, 0.0 ) )
+                for r in range( len( samples ) )]
+
+    def FetchWaveform( self, dtype=None ):
+        dtype = _DTYPES.get( dtype, dtype )
+        return self._Waveforms( self._instr.Acquired( self._channel, 0, 1, 0, self._instr.recordSize, dtype ), dtype )[0]
+
+    def FetchMultiRecordWaveform( self, firstRecord, numRecords, offset, points, dtype=None ):
+        dtype = _DTYPES.get( dtype, dtype )
+        return AqMD3WaveformCollection( self._Waveforms( self._instr.Acquired( self._channel, firstRecord, numRecords, offset, points, dtype ), dtype ) )
+
+    def FetchAccumulatedWaveform( self, firstRecord, numRecords, offset, points, dtype=None ):
+        dtype = _DTYPES.get( dtype or 'int32', dtype )
+        waveforms = self._Waveforms( self._instr.Accumulated( self._channel, firstRecord, numRecords, offset, points, dtype ), float64 )
+        if dtype!=float64:
+            for wfm in waveforms:
+                wfm.ScaleFactor = self._instr.ScaleFactor( self._channel, int16 )*2**( 16-self._instr.nbrAdcBits )
+        return AqMD3AccumulatedWaveformCollection( waveforms, self._instr.averages )
+
+
+class _Channel( _Node ):
+    def __init__( self, instr, name ):
+        self._instr = instr
+        self.Name = name
+        self.Enabled = True
+        self.Measurement = self.MultiRecordMeasurement = _Measurement( instr, name )
+
+    @property
+    def Range( self ):
+        return self._instr.Range( self.Name )
+
+    @Range.setter
+    def Range( self, value ):
+        self._instr.ranges[self.Name] = float( value )
+
+    @property
+    def Offset( self ):
+        return self._instr.offsets.get( self.Name, 0.0 )
+
+    @Offset.setter
+    def Offset( self, value ):
+        self._instr.offsets[self.Name] = float( value )
+
+
+class _DDCCore( _Node ):
+    def __init__( self, instr, name ):
+        self._instr = instr
+        self.Name = name
+
+    @property
+    def CenterFrequency( self ):
+        return self._instr.centerFrequency
+
+    @CenterFrequency.setter
+    def CenterFrequency( self, value ):
+        self._instr.centerFrequency = float( value )
+
+    @property
+    def DecimationNumerator( self ):
+        return self._instr.decimation[0]
+
+    @DecimationNumerator.setter
+    def DecimationNumerator( self, value ):
+        self._instr.decimation = ( int( value ), self._instr.decimation[1] )
+
+    @property
+    def DecimationDenominator( self ):
+        return self._instr.decimation[1]
+
+    @DecimationDenominator.setter
+    def DecimationDenominator( self, value ):
+        self._instr.decimation = ( self._instr.decimation[0], int( value ) )
+
+
+class _Stream( _Node ):
+    def __init__( self, instr, name ):
+        self._instr = instr
+        self.Name = name
+        self.Type = StreamType.Markers if name=="StreamTriggers" else StreamType.Samples
+
+    def FetchDataInt32( self, count ):
+        samples = self.__dict__.get( 'Samples' )
+        bits = samples.DataTruncationBitCount if samples and samples.__dict__.get( 'DataTruncationEnabled' ) else 16
+        elements, available = self._instr.Streamed( self.Name, count, bits )
+        return _Node( Elements=elements, ActualElements=len( elements ), AvailableElements=available )
+
+
+class _Status( _Node ):
+    def __init__( self, instr ):
+        self._instr = instr
+
+    @property
+    def IsIdle( self ):
+        return AcquisitionStatusResult.ResultTrue if self._instr.IsIdle() else AcquisitionStatusResult.ResultFalse
+
+
+class _TSR( _Node ):
+    def __init__( self, instr ):
+        self._instr = instr
+        self.Enabled = False
+        self.MemoryOverflowOccurred = False
+
+    @property
+    def IsAcquisitionComplete( self ):
+        return self._instr.IsIdle()
+
+    def Continue( self ):
+        if self._instr.started is None:
+            raise RuntimeError( "ERROR: TSR acquisition is not started." )
+        self._instr.Initiate()
+
+
+class _Streaming( _Node ):
+    def __init__( self, instr ):
+        self._instr = instr
+
+    @property
+    def Mode( self ):
+        return self._instr.streaming
+
+    @Mode.setter
+    def Mode( self, value ):
+        self._instr.streaming = None if value==StreamingMode.Disabled else value
+
+
+class _Acquisition( _Node ):
+    _FIELDS = { 'SampleRate': 'sampleRate', 'RecordSize': 'recordSize', 'NumberOfRecordsToAcquire': 'records', 'NumberOfAverages': 'averages' }
+    _MODES = { AcquisitionMode.Normal: 'DGT', AcquisitionMode.Averager: 'AVG', AcquisitionMode.DownConversion: 'DDC' }
+
+    def __init__( self, instr ):
+        self.__dict__['_instr'] = instr
+        self.Status = _Status( instr )
+        self.TSR = _TSR( instr )
+        self.Streaming = _Streaming( instr )
+
+    def __getattr__( self, name ):
+        if name in _Acquisition._FIELDS:
+            return getattr( self._instr, _Acquisition._FIELDS[name] )
+        if name=='Mode':
+            return { mode: value for value, mode in _Acquisition._MODES.items() }[self._instr.mode]
+        if name=='NumberOfAcquiredRecords':
+            return self._instr.records if self._instr.IsIdle() else 0
+        return _Node.__getattr__( self, name )
+
+    def __setattr__( self, name, value ):
+        if name in _Acquisition._FIELDS:
+            field = _Acquisition._FIELDS[name]
+            setattr( self._instr, field, type( getattr( self._instr, field ) )( value ) )
+        elif name=='Mode':
+            self._instr.mode = _Acquisition._MODES.get( value, 'DGT' )
+        else:
+            self.__dict__[name] = value
+
+    def Initiate( self ):
+        self._instr.Initiate()
+
+    def Abort( self ):
+        self._instr.Abort()
+
+    def WaitForAcquisitionComplete( self, timeoutMs ):
+        self._instr.Wait( timeoutMs )
+
+
+class AqMD3( _Node ):
+    """ Session of the object-model driver.
+
+    >>> vi = AqMD3( "SIM::U5303A", 0, 0, "Simulate=1" )
+    >>> vi.Acquisition.RecordSize = 64
+    >>> vi.Acquisition.NumberOfRecordsToAcquire = 4
+    >>> vi.Acquisition.Initiate(); vi.Acquisition.WaitForAcquisitionComplete( 1000 )
+    >>> wfms = vi.Channels["Channel2"].MultiRecordMeasurement.FetchMultiRecordWaveform( 0, 4, 0, 64, dtype='int16' )
+    >>> print( wfms.ActualRecords, len( wfms[3].Samples ), vi.Acquisition.Status.IsIdle==AcquisitionStatusResult.ResultTrue )
+    4 64 True
+    >>> vi.Close()
+    """
+    def __init__( self, resource, idQuery, reset, options ):
+        instr = _Instrument( resource, options )
+        self._instrument = instr
+        self.Identity = _Node( InstrumentModel=instr.model, InstrumentFirmwareRevision="Simulated", Description="Simulated digitizer" )
+        self.InstrumentInfo = _Node( NbrADCBits=instr.nbrAdcBits, SerialNumberString="SIM%05d" % ( id( instr )%100000 ), Options="", IOVersion="Simulated" )
+        self.Acquisition = _Acquisition( instr )
+        self.Calibration = _Node( IsRequired=False )
+        self.Channels = _Collection( [_Channel( instr, "Channel%d" % ( ch+1 ) ) for ch in range( instr.nbrChannels )] )
+        self.DDCCores = _Collection( [_DDCCore( instr, "DDCCore%d" % ( core+1 ) ) for core in range( instr.nbrDDCCores )] )
+        self.Streams = _Collection( [_Stream( instr, name ) for name in ["StreamCh%d" % ( ch+1 ) for ch in range( instr.nbrChannels )]+["StreamTriggers"]] )
+
+    def Close( self ):
+        self._instrument.Abort()
+
+
+# The Aq4Core driver gives the same objects.
+Aq4Core = AqMD3
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
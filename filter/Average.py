@@ -2,6 +2,8 @@
 
 from sys import stderr, stdin, stdout
 from waveforms.trace import ReadTrace
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
+from functools import partial
 from argparse import ArgumentParser
 import numpy as np
 import math
@@ -9,11 +11,25 @@ import math
 # Takes as input a .trc file, and output a .skew file.
 
 
+def Averages( rec, windows=None, step=None ):
+    result = []
+    if windows:
+        step =  step if step else min( windows )
+        width = max( windows )
+        wfm = rec[0]
+        for s in range( 0, len(wfm.Samples)-width+1, step ):
+            result.append( [np.mean(wfm.Samples[s:s+w]) for w in windows] )
+    else:
+        result.append( [np.mean(wfm.Samples) for wfm in rec] )
+    return result
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument( "--windows", "-w",  type=int, nargs='+' )
     parser.add_argument( "--step", "-s",     type=int )
     parser.add_argument( "--output", "-o",   type=str )
+    AddJobsArguments( parser )
     parser.add_argument( "files", nargs='*', type=str )
 
     args = parser.parse_args()
@@ -25,22 +41,13 @@ def main():
 
     out = open( args.output, 'wt' ) if args.output else stdout
 
-    for trc in trcfiles:
-        for rec in ReadTrace( trc ):
-            try:
-                if len( args.windows )!=0:
-                    windows = args.windows
-                    step =  args.step if args.step else min( windows )
-                    width = max( windows )
-                    for s in range( 0, len(rec[0].Samples)-width+1, step ):
-                        wfm = rec[0]
-                        averages = [np.mean(wfm.Samples[s:s+w]) for w in windows]
-                        print( *averages, file=out )
-                else:
-                    averages = [np.mean(wfm.Samples) for wfm in rec]
-                    print( *averages, file=out )
-            except (BrokenPipeError):
-                return
+    records = ( rec for trc in trcfiles for rec in ReadTrace( trc ) )
+    for result in ProcessRecordsArgs( partial( Averages, windows=args.windows, step=args.step ), records, args ):
+        try:
+            for averages in result:
+                print( *averages, file=out )
+        except (BrokenPipeError):
+            return
 
 
 if __name__=="__main__":
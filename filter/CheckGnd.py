@@ -2,6 +2,7 @@
 
 from sys import stderr, stdin, stdout
 from waveforms.trace import ReadTrace
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
 from argparse import ArgumentParser
 import numpy as np
 import math
@@ -9,9 +10,18 @@ import math
 # Takes as input a .trc file, and output a .skew file.
 
 
+def CheckGnd( rec ):
+    wavs = [wav.Samples for wav in rec]
+    cnts = list( map( len, wavs ) )
+    avgs = list( map( np.mean,  wavs ) )
+    stds = list( map( np.std,   wavs ) )
+    return [f"{avg:.2f} ({std:.2f} - {cnt})" for avg, std, cnt in zip( avgs, stds, cnts )]
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument( "--output", "-o",   type=str )
+    AddJobsArguments( parser )
     parser.add_argument( "files", nargs='*', type=str )
 
     args = parser.parse_args()
@@ -23,16 +33,12 @@ def main():
 
     out = open( args.output, 'wt' ) if args.output else stdout
 
-    for trc in trcfiles:
-        for rec in ReadTrace( trc ):
-            try:
-                wavs = [wav.Samples for wav in rec]
-                cnts = list( map( len, wavs ) )
-                avgs = list( map( np.mean,  wavs ) )
-                stds = list( map( np.std,   wavs ) )
-                print( *[f"{avg:.2f} ({std:.2f} - {cnt})" for avg, std, cnt in zip( avgs, stds, cnts )] )
-            except (BrokenPipeError):
-                return
+    records = ( rec for trc in trcfiles for rec in ReadTrace( trc ) )
+    for result in ProcessRecordsArgs( CheckGnd, records, args ):
+        try:
+            print( *result )
+        except (BrokenPipeError):
+            return
 
 
 if __name__=="__main__":
@@ -2,6 +2,8 @@
 
 from sys import stderr, stdin, stdout
 from waveforms.trace import ReadTrace, OutputTrace
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
+from functools import partial
 from argparse import ArgumentParser
 import numpy as np
 import math
@@ -59,6 +61,16 @@ def AverageEdges( records, level=None ):
 
 
 
+def RecordEdges( rec, falling=False, level=None, xtime=False ):
+    if falling:
+        for wfm in rec:
+            wfm.Samples *= -1
+    edges = AverageEdges( [rec], level=level )
+    if edges and xtime:
+        edges.insert( 0, rec.InitialXTimeSeconds+rec.InitialXTimeFraction )
+    return edges
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument( "--falling",    "-f",   default=False, action='store_true' )
@@ -67,6 +79,7 @@ def main():
     parser.add_argument( "--step",       "-s",   type=int )
     parser.add_argument( "--output",     "-o",   type=str )
     parser.add_argument( "--x-time",     "-xt",  default=False, action='store_true')
+    AddJobsArguments( parser )
     parser.add_argument( "files", nargs='*', type=str       )
 
     args = parser.parse_args()
@@ -78,19 +91,13 @@ def main():
 
     out = open( args.output, 'wt' ) if args.output else stdout
 
-    for trcfile in trcfiles:
-        for rec in ReadTrace( trcfile ):
-            if args.falling:
-                for wfm in rec:
-                    wfm.Samples *= -1
-            edges = AverageEdges( [rec], level=args.level )
-            if edges:
-                if args.x_time:
-                    edges.insert( 0, rec.InitialXTimeSeconds+rec.InitialXTimeFraction )
-                try:
-                    print( *edges, file=out, flush=True )
-                except BrokenPipeError:
-                    break
+    records = ( rec for trcfile in trcfiles for rec in ReadTrace( trcfile ) )
+    for edges in ProcessRecordsArgs( partial( RecordEdges, falling=args.falling, level=args.level, xtime=args.x_time ), records, args ):
+        if edges:
+            try:
+                print( *edges, file=out, flush=True )
+            except BrokenPipeError:
+                break
 
 
 
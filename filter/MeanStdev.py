@@ -2,6 +2,8 @@
 
 from sys import stderr, stdin, stdout
 from waveforms.trace import ReadTrace
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
+from functools import partial
 from argparse import ArgumentParser
 import numpy as np
 import math
@@ -30,6 +32,7 @@ def main():
     parser.add_argument( "--width",      "-w",   type=int )
     parser.add_argument( "--step",       "-s",   type=int )
     parser.add_argument( "--output",     "-o",   type=str   )
+    AddJobsArguments( parser )
     parser.add_argument( "files", nargs='*', type=str       )
 
     args = parser.parse_args()
@@ -41,11 +44,10 @@ def main():
 
     out = open( args.output, 'wt' ) if args.output else stdout
 
-    for trcfile in trcfiles:
-        for rec in ReadTrace( trcfile ):
-            mds = MeanStdev( rec, width=args.width, step=args.step )
-            for md in mds:
-                print( md[0], md[1], file=out )
+    records = ( rec for trcfile in trcfiles for rec in ReadTrace( trcfile ) )
+    for mds in ProcessRecordsArgs( partial( MeanStdev, width=args.width, step=args.step ), records, args ):
+        for md in mds:
+            print( md[0], md[1], file=out )
 
 
 if __name__=="__main__":
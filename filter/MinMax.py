@@ -2,6 +2,7 @@
 
 from sys import stderr, stdin, stdout
 from waveforms.trace import ReadTrace
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
 from argparse import ArgumentParser
 import numpy as np
 import math
@@ -9,9 +10,16 @@ import math
 # Takes as input a .trc file, and output a .skew file.
 
 
+def MinMax( rec ):
+    mins = [np.min(wfm.Samples) for wfm in rec]
+    maxs = [np.max(wfm.Samples) for wfm in rec]
+    return mins, maxs
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument( "--output", "-o",   type=str )
+    AddJobsArguments( parser )
     parser.add_argument( "files", nargs='*', type=str )
 
     args = parser.parse_args()
@@ -25,10 +33,8 @@ def main():
 
     for trcfile in trcfiles:
         try:
-            for rec in ReadTrace( trcfile ):
+            for mins, maxs in ProcessRecordsArgs( MinMax, ReadTrace( trcfile ), args ):
                 try:
-                    mins = [np.min(wfm.Samples) for wfm in rec]
-                    maxs = [np.max(wfm.Samples) for wfm in rec]
                     print( *mins, file=out )
                     print( *maxs, file=out )
                 except (BrokenPipeError):
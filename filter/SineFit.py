@@ -2,6 +2,9 @@
 
 from sys import stderr, stdin, stdout
 from waveforms.trace import ReadTrace, OutputTrace
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
+from waveforms.sinefit import FitSine4, RecordSamples
+from functools import partial
 from argparse import ArgumentParser
 import numpy as np
 import math
@@ -156,9 +159,9 @@ def SineFit3( record, omega, width=None, step=None ):
             xes   = wfm.Samples
             V = np.array( [np.add.reduce( coxes[f:l] ), np.add.reduce( sixes[f:l] ), np.add.reduce( xes[f:l] )], dtype=np.float64 ).transpose()
             R = np.matmul( Z, V ).T
-            R0 = float( R[0] )
-            R1 = float( R[1] )
-            R2 = float( R[2] )
+            R0 = R.item( 0 )
+            R1 = R.item( 1 )
+            R2 = R.item( 2 )
             amp = math.sqrt( R0*R0 + R1*R1 )
             phy = math.atan2( R0, R1 )
             off = R2
@@ -167,6 +170,29 @@ def SineFit3( record, omega, width=None, step=None ):
 
 
 
+def SineFit4( record, width=None, step=None ):
+    result = []
+    samples = RecordSamples( record )
+    size = samples.shape[-1]
+    width = width if width else size
+    step = step if step else width
+    for it in range( 0, size-width+1, step ):
+        fits = FitSine4( samples[:, it:it+width] )
+        # Phase relative to the first sample of the record, as SineFit3.
+        phases = np.angle( np.exp( 1j*( fits.phase - fits.omega*it ) ) )
+        for omega, off, amp, phy in zip( fits.omega, fits.offset, fits.amplitude, phases ):
+            result.append( (omega, off, amp, phy) )
+    return result
+
+
+def FitRecord( rec, sineFreq=None, width=None, step=None ):
+    if hasattr( rec, 'SineFreq' ) or sineFreq:
+        sineFreq = getattr( rec, 'SineFreq', sineFreq )
+        omega = 2*np.pi*sineFreq*rec.XIncrement
+        return rec, SineFit3( rec, omega, width=width, step=step )
+    return rec, SineFit4( rec, width=width, step=step )
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument( "--sine-freq",  "-sf",  type=float )
@@ -177,6 +203,7 @@ def main():
     parser.add_argument( "--output-diff", "-od",   default=False, action='store_true' )
     parser.add_argument( "--output-sine", "-os",   default=False, action='store_true' )
     parser.add_argument( "--minimum-amplitude", "-mina", type=float )
+    AddJobsArguments( parser )
     parser.add_argument( "files", nargs='*', type=str       )
 
     args = parser.parse_args()
@@ -192,34 +219,28 @@ def main():
 
 
     nbrErr = 0
-    for trcfile in trcfiles:
-        for rec in ReadTrace( trcfile ):
-            if hasattr( rec, 'SineFreq' ) or args.sine_freq:
-                sineFreq = getattr( rec, 'SineFreq', args.sine_freq )
-                omega = 2*np.pi*sineFreq*rec.XIncrement
-                fits = SineFit3( rec, omega, width=args.width, step=args.step )
-                omega, offset, amplitude, phase = fits[0]
+    records = ( rec for trcfile in trcfiles for rec in ReadTrace( trcfile ) )
+    for rec, fits in ProcessRecordsArgs( partial( FitRecord, sineFreq=args.sine_freq, width=args.width, step=args.step ), records, args ):
+        if not fits:
+            continue
+        omega, offset, amplitude, phase = fits[0]
+        try:
+            if args.output_sine:
+                print( offset, amplitude, omega/2/np.pi/rec.XIncrement, *[(fit[3]/fit[0]*rec.XIncrement-rec.InitialXOffset)*1e12 for fit in fits] )
+            elif args.output_comp:
+                OutputTrace(rec)
             else:
-                # SineFit4
-                print( "SineFit without signal frequency information is not supported", file=stderr )
-                continue
-            try:
-                if args.output_sine:
-                    print( offset, amplitude, omega/2/np.pi/rec.XIncrement, *[(fit[3]/2/np.pi/args.sine_freq-rec.InitialXOffset)*1e12 for fit in fits] )
-                elif args.output_comp:
-                    OutputTrace(rec)
-                else:
-                    for omega, offset, amplitude, phase in fits:
-                        print( offset, amplitude, omega/2/np.pi/rec.XIncrement, (phase/2/np.pi/args.sine_freq-rec.InitialXOffset)*1e12 )
-                        if args.minimum_amplitude and amplitude < args.minimum_amplitude:
-                            fname = "SineFit-Error-%02d.trc"%( nbrErr )
-                            print( "ERROR: amplitude is too low. Output trace in", fname )
-                            OutputTrace( rec, open( fname, 'wt' ) )
-                            nbrErr = nbrErr+1
-                            if nbrErr == 100:
-                                return
-            except (BrokenPipeError):
-                return
+                for omega, offset, amplitude, phase in fits:
+                    print( offset, amplitude, omega/2/np.pi/rec.XIncrement, (phase/omega*rec.XIncrement-rec.InitialXOffset)*1e12 )
+                    if args.minimum_amplitude and amplitude < args.minimum_amplitude:
+                        fname = "SineFit-Error-%02d.trc"%( nbrErr )
+                        print( "ERROR: amplitude is too low. Output trace in", fname )
+                        OutputTrace( rec, open( fname, 'wt' ) )
+                        nbrErr = nbrErr+1
+                        if nbrErr == 100:
+                            return
+        except (BrokenPipeError):
+            return
 
 
 
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+from sys import stderr, stdin, stdout
+from waveforms.trace import ReadTrace
+from waveforms.spectral import Metrics, FullScale, WINDOWS
+from waveforms.sinefit import RecordSamples
+from waveforms.executor import AddJobsArguments, ProcessRecordsArgs
+from argparse import ArgumentParser
+from functools import partial
+import numpy as np
+
+# Takes as input a .trc file, typically a sweep of a sine frequency, and outputs
+# for each record and channel: frequency snr thd sinad sfdr enob.
+
+
+def RecordMetrics( rec, nbrHarmonics=5, window='blackmanharris', fullScale=None, maxPoints=None ):
+    samples = RecordSamples( rec, maxPoints )
+    metrics = Metrics( samples, nbrHarmonics=nbrHarmonics, window=window, fullScale=fullScale if fullScale else FullScale( rec ) )
+    frequencies = metrics.frequency / samples.shape[-1] / rec.XIncrement
+    return np.stack( ( frequencies, metrics.Snr(), metrics.Thd(), metrics.Sinad(), metrics.Sfdr(), metrics.Enob() ), axis=-1 )
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument( "--harmonics", "-n",    type=int,   default=5 )
+    parser.add_argument( "--window", "-w",       type=str,   default='blackmanharris', choices=list( WINDOWS ) )
+    parser.add_argument( "--full-scale", "-fs",  type=float, default=None )
+    parser.add_argument( "--max-points", "-mp",  type=int,   default=None )
+    parser.add_argument( "--summary", "-sum",    default=False, action='store_true' )
+    parser.add_argument( "--output", "-o",       type=str )
+    AddJobsArguments( parser )
+    parser.add_argument( "files", nargs='*', type=str )
+
+    args = parser.parse_args()
+
+    if len( args.files )==0:
+        trcfiles = [stdin]
+    else:
+        trcfiles = [open( name, 'rt' ) for name in args.files]
+
+    out = open( args.output, 'wt' ) if args.output else stdout
+
+    function = partial( RecordMetrics, nbrHarmonics=args.harmonics, window=args.window, fullScale=args.full_scale, maxPoints=args.max_points )
+    records = ( rec for trcfile in trcfiles for rec in ReadTrace( trcfile ) )
+    sweep = []
+    for metrics in ProcessRecordsArgs( function, records, args ):
+        if args.summary:
+            sweep.append( metrics )
+            continue
+        try:
+            for channel in metrics:
+                print( *[f"{value:.6g}" for value in channel], file=out )
+        except (BrokenPipeError):
+            return
+
+    if args.summary and sweep:
+        # One line per channel and statistic: min, mean, max of each metric over the sweep.
+        sweep = np.array( sweep )
+        for ch in range( sweep.shape[1] ):
+            for name, stat in ( ( "min", np.min ), ( "mean", np.mean ), ( "max", np.max ) ):
+                print( ch+1, name, *[f"{value:.6g}" for value in stat( sweep[:, ch], axis=0 )], file=out )
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+from sys import stderr, stdin, stdout
+from waveforms.trace import ReadTrace
+from waveforms.spectral import SpectrumAverager, FullScale, WINDOWS
+from argparse import ArgumentParser
+import numpy as np
+
+# Takes as input a .trc file, and outputs the averaged spectrum of its records:
+# frequency, then the power of each channel, in dBFS, or in dB of the square
+# sample unit when the full scale is unknown.
+
+
+def OutputSpectrum( averager, xincrement, fullScale, maxHold, out ):
+    frequencies = np.arange( averager.average.shape[-1] ) / averager.segment / xincrement
+    reference = ( fullScale/2 )**2 / 2 if fullScale else 1.0
+    spectrums = averager.maximum if maxHold else averager.average
+    with np.errstate( divide='ignore' ):
+        levels = 10*np.log10( spectrums / reference )
+    for freq, values in zip( frequencies, levels.T ):
+        print( f"{freq:.6g}", *[f"{value:.3f}" for value in values], file=out )
+    print( file=out, flush=True )
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument( "--segment", "-s",      type=int,   default=None, help="Length of the Welch segments, default is the whole record." )
+    parser.add_argument( "--overlap", "-ol",     type=float, default=0.5 )
+    parser.add_argument( "--window", "-w",       type=str,   default='hann', choices=list( WINDOWS ) )
+    parser.add_argument( "--mode", "-m",         type=str,   default='exponential', choices=list( SpectrumAverager.MODES ) )
+    parser.add_argument( "--averages", "-a",     type=int,   default=0, help="Number of records averaged, 0 for all." )
+    parser.add_argument( "--max-hold", "-mh",    default=False, action='store_true' )
+    parser.add_argument( "--full-scale", "-fs",  type=float, default=None )
+    parser.add_argument( "--every", "-e",        type=int,   default=None, help="Output the spectrum every N records." )
+    parser.add_argument( "--output", "-o",       type=str )
+    parser.add_argument( "files", nargs='*', type=str )
+
+    args = parser.parse_args()
+
+    if len( args.files )==0:
+        trcfiles = [stdin]
+    else:
+        trcfiles = [open( name, 'rt' ) for name in args.files]
+
+    out = open( args.output, 'wt' ) if args.output else stdout
+
+    averages = args.averages if args.averages>0 else 2**62
+    if args.mode=='average' and args.averages<=0:
+        parser.error( "argument --averages/-a: the average mode requires a number of records" )
+    averager = SpectrumAverager( length=args.segment, overlap=args.overlap, window=args.window, mode=args.mode, averages=averages )
+
+    rec = None
+    for trcfile in trcfiles:
+        for rec in ReadTrace( trcfile ):
+            averager.AddRecord( rec )
+            try:
+                if args.every and averager.count%args.every==0:
+                    OutputSpectrum( averager, rec.XIncrement, args.full_scale or FullScale( rec ), args.max_hold, out )
+            except (BrokenPipeError):
+                return
+
+    if rec is not None and not ( args.every and averager.count%args.every==0 ):
+        try:
+            OutputSpectrum( averager, rec.XIncrement, args.full_scale or FullScale( rec ), args.max_hold, out )
+        except (BrokenPipeError):
+            return
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+from waveforms.sinefit import FitSine4, RecordSamples
+from waveforms.spectral import AmplitudeSpectrum, WelchSpectrum, Metrics
+from waveforms.executor import Submit, Result, Discard
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from collections import deque
+from threading import RLock
+from sys import stderr
+
+
+""" The analysis module holds the calculations of the live viewers that do not
+    depend on the display: sine fit, spectrum and ratios.
+
+    They run either in the GUI thread, or with AnalysisPool in worker
+    processes fed by the reader thread. Then, Analyze returns the results as
+    attributes set on the trace before it is displayed.
+
+"""
+
+
+def VerticalScale( trace ):
+    if hasattr( trace, "ActualAverages" ):
+        return 2**trace.NbrAdcBits * trace.ActualAverages
+    if trace.SampleType=="Int32":
+        return 2**32
+    elif trace.SampleType=="Int16":
+        return 2**16
+    elif trace.SampleType=="Int8":
+        return 2**8
+    elif trace.SampleType=="Real64":
+        return 1.0
+    else:
+        raise RuntimeError( "ERROR: Unknown sample type "+str( trace.SampleType )+"." )
+
+
+class Ratios:
+    def __init__(self):
+        pass
+
+def CalcRatios(trace, nbrHarmonics=6):
+    if len( trace )==0 or len( trace[0] )==0:
+        return None
+    nbrSamples = getattr( trace, "nbrFftSamples", trace.ActualPoints )
+    # Metrics of all the channels, the ratios of the first one are displayed
+    metrics = Metrics( RecordSamples( trace, nbrSamples ), nbrHarmonics=nbrHarmonics, fullScale=VerticalScale( trace ) )
+    ratios = Ratios()
+    ratios.metrics = metrics
+    ratios.powHarmLst = list( metrics.harmonics[0] )
+    ratios.powThd = metrics.distortion[0]
+    ratios.powNoise = metrics.noise[0]
+    ratios.binSignal = metrics.carrierBin[0]
+    ratios.powSignal = metrics.signal[0]
+    ratios.binSecond = metrics.spurBin[0]
+    ratios.powSecond = metrics.spur[0]
+    ratios.powFS = metrics.FullScalePower()
+    return ratios
+
+
+GAIN = 0
+OMEGA = 1
+PHASE = 2
+OFFSET = 3
+RMS = 4
+
+class FittedSine:
+
+    def __init__(self):
+        self.success = 0
+        self.all = [ 1., 1., 0., 0., 0. ]
+        self.adc = []
+        self.XIncrement = 0
+
+
+def CalcFittedSine(trace):
+    if trace.ActualPoints<50:
+        return None
+    fittedSine = FittedSine()
+    samples = RecordSamples(trace, 100000)
+    # Fit all the channels together, the first one is displayed
+    fits = FitSine4(samples)
+    fittedSine.success = 1
+    fittedSine.all = fits[0]
+    fittedSine.channels = [fits[ch] for ch in range(len(fits))]
+
+    nbrAdc = getattr(trace, "nbrAdc", 1)
+    if nbrAdc > 1:
+        nbrPoints = samples.shape[-1] - (samples.shape[-1] % nbrAdc)
+        adcSamples = samples[0, :nbrPoints].reshape(-1, nbrAdc).T
+        adcFits = FitSine4(adcSamples, omega=fits.omega[0] * nbrAdc)
+        fittedSine.adc = []
+        for adc in range(0, nbrAdc):
+            psine = adcFits[adc]
+            psine[OMEGA] = psine[OMEGA] / nbrAdc
+            fittedSine.adc.append(psine)
+    fittedSine.XIncrement = trace.XIncrement
+    fittedSine.SampleType = trace.SampleType
+    return fittedSine
+
+
+def Analyze( trace, fittedSine=False, spectrum=False, window='rect', welch=None, ratios=False ):
+    """ Returns the analysis results of trace, as a dict of the attributes to set
+        on it. The spectrums are the amplitude spectrums with window, or if welch
+        is ( length, overlap, window ), the Welch power spectrums, left to be
+        averaged by the viewer.
+    """
+    results = { 'nbrFftSamples': trace.ActualPoints if trace.ActualPoints<65536 else 65536 }
+    if fittedSine:
+        try: results['fittedSine'] = CalcFittedSine( trace )
+        except: results['fittedSine'] = None
+    if spectrum and len( trace )>0 and len( trace[0] )>0:
+        samples = RecordSamples( trace, results['nbrFftSamples'] )
+        if welch:
+            results['power'] = WelchSpectrum( samples, *welch )
+        else:
+            results['spectrums'] = list( AmplitudeSpectrum( samples, window=window ) )
+    results['ratios'] = None
+    if ratios:
+        trace.nbrFftSamples = results['nbrFftSamples']
+        try: results['ratios'] = CalcRatios( trace, 1 )
+        except: pass
+    return results
+
+
+class AnalysisPool:
+    """ Runs function on traces in worker processes, samples going through
+        shared memory. output( trace ) is called with the results of function
+        set as attributes of trace, and trace.analyzed set.
+
+        Without keepAll, there is no more work waiting than workers: the
+        oldest traces not started are dropped. And when a trace is done
+        before older ones, these are dropped too, so that the latest computed
+        trace is always output first. With keepAll, Submit waits for the
+        workers, and all the traces are output in order.
+    """
+    def __init__( self, function, workers, output, keepAll=False ):
+        self.function = function
+        self.workers = max( 1, workers )
+        self.output = output
+        self.keepAll = keepAll
+        self.pending = deque()
+        self.lock = RLock()
+        self.submitted = 0
+        self.dropped = 0
+        # Spawned processes do not inherit the threads and the GUI of the viewer.
+        self.pool = ProcessPoolExecutor( max_workers=self.workers, mp_context=get_context( 'spawn' ) )
+
+    def Submit( self, trace ):
+        future = Submit( self.pool, self.function, trace )
+        self.submitted += 1
+        with self.lock:
+            self.pending.append( ( trace, future ) )
+        future.add_done_callback( self._Done )
+        if self.keepAll:
+            while True:
+                with self.lock:
+                    if len( self.pending )<=2*self.workers:
+                        break
+                    oldest = self.pending[0][1]
+                try: oldest.exception()
+                except: pass
+            return
+        with self.lock:
+            for entry in list( self.pending ):
+                if len( self.pending )<=self.workers:
+                    break
+                if entry[1].cancel():
+                    self.pending.remove( entry )
+                    Discard( entry[1] )
+                    self.dropped += 1
+
+    def _Done( self, future ):
+        if future.cancelled():
+            return
+        ready = []
+        with self.lock:
+            if self.keepAll:
+                while self.pending and self.pending[0][1].done():
+                    ready.append( self.pending.popleft() )
+            else:
+                done = [entry for entry in self.pending if entry[1].done()]
+                if done:
+                    # Only the latest trace done is output, the older ones are dropped.
+                    while self.pending[0] is not done[-1]:
+                        trace, older = self.pending.popleft()
+                        Discard( older )
+                        self.dropped += 1
+                    ready.append( self.pending.popleft() )
+        for trace, f in ready:
+            try:
+                results = Result( f )
+            except Exception as e:
+                print( "ERROR: Analysis failed,", e, file=stderr )
+                continue
+            for name, value in results.items():
+                setattr( trace, name, value )
+            trace.analyzed = True
+            self.output( trace )
+
+    def Close( self ):
+        with self.lock:
+            for trace, future in self.pending:
+                Discard( future )
+            self.pending.clear()
+        self.pool.shutdown( wait=False, cancel_futures=True )
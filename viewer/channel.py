@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+from collections import deque
+from threading import Condition
+
+# Channels from the reader thread to the display of the live viewers.
+
+
+def TraceBytes( trace ):
+    """ Returns the size in bytes of the samples of trace.
+
+    >>> from waveforms.trace import Trace
+    >>> import numpy as np
+    >>> wave = Trace.Wave()
+    >>> wave._Samples = np.zeros( 100, dtype=np.int16 )
+    >>> trace = Trace()
+    >>> trace._Waves = [wave, wave]
+    >>> TraceBytes( trace )
+    400
+    """
+    try:
+        return sum( getattr( wfm.Samples, "nbytes", 0 ) for wfm in trace )
+    except TypeError:
+        return 0
+
+
+class LatestSlot:
+    """ Keeps only the latest trace put, for the live display. Put never waits,
+        and replaces the trace not taken yet, which is counted as dropped.
+        A deque of one element does it without a lock, its append and
+        popleft being atomic.
+
+    >>> slot = LatestSlot()
+    >>> for trace in ( 1, 2, 3 ):
+    ...     slot.Put( trace )
+    >>> print( slot.Get(), slot.Get(), slot.Empty() )
+    3 None True
+    >>> print( slot.received, slot.displayed, slot.dropped )
+    3 1 2
+    """
+    def __init__( self ):
+        self._slot = deque( maxlen=1 )
+        self.received = 0
+        self.displayed = 0
+
+    @property
+    def dropped( self ):
+        return self.received - self.displayed - len( self._slot )
+
+    def Put( self, trace ):
+        self.received += 1
+        self._slot.append( trace )
+
+    def Get( self ):
+        """ Returns the latest trace, or None. """
+        try:
+            trace = self._slot.popleft()
+        except IndexError:
+            return None
+        self.displayed += 1
+        return trace
+
+    def Empty( self ):
+        return len( self._slot )==0
+
+    def Clear( self ):
+        self._slot.clear()
+
+
+class BoundedFifo:
+    """ Keeps all the traces in order, for --nolive. Put waits while there are
+        already length traces, or memory bytes of samples, waiting. A trace is
+        always accepted when the FIFO is empty, whatever its size.
+
+    >>> fifo = BoundedFifo( length=2 )
+    >>> fifo.Put( 1 ); fifo.Put( 2 )
+    >>> print( fifo.Full(), fifo.Get(), fifo.Get(), fifo.Get() )
+    True 1 2 None
+    >>> print( fifo.received, fifo.displayed, fifo.dropped )
+    2 2 0
+    """
+    def __init__( self, length=64, memory=512*1024*1024 ):
+        self.length = max( 1, length )
+        self.memory = memory
+        self._fifo = deque()
+        self._bytes = 0
+        self._cond = Condition()
+        self.received = 0
+        self.displayed = 0
+        self.dropped = 0
+
+    def Full( self ):
+        return len( self._fifo )>=self.length or ( self.memory and self._bytes>=self.memory )
+
+    def Put( self, trace ):
+        size = TraceBytes( trace )
+        with self._cond:
+            while self._fifo and ( self.Full() or ( self.memory and self._bytes+size>self.memory ) ):
+                self._cond.wait()
+            self._fifo.append( ( trace, size ) )
+            self._bytes += size
+            self.received += 1
+
+    def Get( self ):
+        """ Returns the oldest trace, or None. """
+        with self._cond:
+            if not self._fifo:
+                return None
+            trace, size = self._fifo.popleft()
+            self._bytes -= size
+            self.displayed += 1
+            self._cond.notify()
+        return trace
+
+    def Empty( self ):
+        return len( self._fifo )==0
+
+    def Clear( self ):
+        with self._cond:
+            self.dropped += len( self._fifo )
+            self._fifo.clear()
+            self._bytes = 0
+            self._cond.notify_all()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+import numpy as np
+
+# Reduces the samples of a waveform to about two points per pixel column, for display.
+
+
+METHODS = ( 'minmax', 'lttb', 'none' )
+
+
+class Decimator:
+    """ Display decimation of the samples [first, last) of a waveform into about
+        points values. The min/max envelope keeps the minimum and the maximum of
+        each of points/2 columns, so that glitches stay visible. LTTB (Largest
+        Triangle Three Buckets) keeps one actual sample per bucket.
+
+        Buffers are preallocated, and the indexes of the columns are only
+        computed again when the length, the range or the number of points
+        change. Then, changed is True until the next call to Decimate. With
+        LTTB, the indexes depend on the samples, and changed is always True.
+
+    >>> decimator = Decimator( points=4 )
+    >>> indexes, values = decimator.Decimate( np.array( [0, 5, 1, 2, -3, 1, 0, 0] ) )
+    >>> print( indexes, values, decimator.changed )
+    [0 0 4 4] [ 0  5 -3  1] True
+    >>> indexes, values = decimator.Decimate( np.array( [1, 2, 3, 4, 5, 6, 7, 8] ) )
+    >>> print( indexes, values, decimator.changed )
+    [0 0 4 4] [1 4 5 8] False
+    >>> print( *Decimator( points=4, method='lttb' ).Decimate( np.array( [0, 5, 1, 2, -3, 1, 0, 0] ) ) )
+    [0 1 4 7] [ 0  5 -3  0]
+    """
+    def __init__( self, points=1280, method='minmax' ):
+        if method not in METHODS:
+            raise RuntimeError( "ERROR: Unknown decimation method "+str( method )+"." )
+        self.points = max( 4, points )
+        self.method = method
+        self.key = None
+        self.changed = True
+
+    def _Prepare( self, length, first, last, dtype ):
+        key = ( length, first, last, self.points, dtype )
+        if key==self.key:
+            self.changed = False
+            return
+        self.key = key
+        self.changed = True
+        count = last-first
+        if self.method=='none' or count<=self.points:
+            self.indexes = np.arange( first, last )
+            self.values = None
+        elif self.method=='minmax':
+            columns = self.points//2
+            self.starts = first + ( np.arange( columns )*count )//columns
+            self.indexes = np.repeat( self.starts, 2 )
+            self.values = np.empty( 2*columns, dtype=dtype )
+        else:
+            buckets = self.points-2
+            self.edges = first+1 + ( np.arange( buckets+1 )*( count-2 ) )//buckets
+            self.indexes = np.empty( self.points, dtype=np.int64 )
+            self.indexes[0], self.indexes[-1] = first, last-1
+            self.values = np.empty( self.points, dtype=dtype )
+
+    def Decimate( self, samples, first=0, last=None ):
+        """ Returns the indexes and the values of the decimated samples. They
+            are the buffers of the decimator, valid until the next call.
+        """
+        samples = np.asarray( samples )
+        length = len( samples )
+        first = min( max( 0, int( first ) ), length )
+        last = length if last is None else min( max( first, int( last ) ), length )
+        self._Prepare( length, first, last, samples.dtype )
+        if self.values is None:
+            return self.indexes, samples[first:last]
+        if self.method=='minmax':
+            np.minimum.reduceat( samples[:last], self.starts, out=self.values[0::2] )
+            np.maximum.reduceat( samples[:last], self.starts, out=self.values[1::2] )
+        else:
+            self._Lttb( samples )
+            self.changed = True
+        return self.indexes, self.values
+
+    def _Lttb( self, samples ):
+        edges, indexes = self.edges, self.indexes
+        # Average point of each bucket, and of the last sample as the bucket after the last one
+        sums = np.add.reduceat( samples[:edges[-1]].astype( np.float64 ), edges[:-1] )
+        avgY = np.append( sums/np.diff( edges ), samples[indexes[-1]] )
+        avgX = np.append( ( edges[:-1]+edges[1:]-1 )/2.0, indexes[-1] )
+        prev = indexes[0]
+        for b in range( len( edges )-1 ):
+            x = np.arange( edges[b], edges[b+1] )
+            y = samples[edges[b]:edges[b+1]]
+            area = np.abs( ( prev-avgX[b+1] )*( y-float( samples[prev] ) ) - ( prev-x )*( avgY[b+1]-float( samples[prev] ) ) )
+            prev = edges[b] + int( np.argmax( area ) )
+            indexes[b+1] = prev
+        self.values[...] = samples[indexes]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -3,8 +3,8 @@
 from subprocess import *
 
 from waveforms.trace import ReadTrace
+from waveforms.shmring import ReadShmRing
 from threading import Thread
-from queue import Queue
 import socket
 import sys
 import os
@@ -12,19 +12,21 @@ import re
 from os.path import expanduser
 import math
 import time
+from contextlib import nullcontext
 import select
 import warnings
 
-# Try to import SciPy, disables calculations if not
-try:
-    from scipy import arange, array, double, pi, polyfit, optimize, sin, sqrt
-    from numpy.lib.scimath import log10
-    from scipy.fft import fft
-    from numpy import maximum, minimum, linspace, sin, pi
-    USE_SCIPY = 1
-except ImportError:
-    sys.stderr.write("Live Viewer requires scipy for better experience. See http://www.scipy.org/\n")
-    USE_SCIPY = 0
+from waveforms.sinefit import RecordSamples
+from waveforms.spectral import AmplitudeSpectrum, SpectrumAverager, WINDOWS
+from viewer.analysis import VerticalScale, Ratios, CalcRatios, FittedSine, CalcFittedSine, GAIN, OMEGA, PHASE, OFFSET, RMS
+from viewer.analysis import Analyze, AnalysisPool
+from viewer.channel import LatestSlot, BoundedFifo
+from waveforms.telemetry import Telemetry, TimedInput, FormatReport
+from functools import partial
+from numpy import maximum, minimum, linspace, sin, pi, sqrt
+from numpy.lib.scimath import log10
+from viewer.decimator import Decimator, METHODS
+from viewer.render import Blitter, FrameCounter
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -32,90 +34,24 @@ import matplotlib.figure as fig
 from matplotlib.animation import FuncAnimation
 
 
-def VerticalScale( trace ):
-    if hasattr( trace, "ActualAverages" ):
-        return 2**trace.NbrAdcBits * trace.ActualAverages
-    if trace.SampleType=="Int32":
-        return 2**32
-    elif trace.SampleType=="Int16":
-        return 2**16
-    elif trace.SampleType=="Int8":
-        return 2**8
-    elif trace.SampleType=="Real64":
-        return 1.0
-    else:
-        raise RuntimeError( "ERROR: Unknown sample type "+str( trace.SampleType )+"." )
+SpectrumWindow = 'rect'
+SpectrumAveraging = None
 
 def CalcFourier( record, nbrSamples ):
+    global spectrumReset
     record.spectrums = []
     if len( record )>0 and len( record[0] )>0 and nbrSamples>0:
-        for wfm in record:
-            record.spectrums.append( abs( fft( wfm.Samples[:nbrSamples:1] )/(nbrSamples/2) ) )
-
-class Ratios:
-    def __init__(self):
-        pass
-
-def CalcRatios(trace, nbrHarmonics=6):
-    if len( trace.spectrums )==0 or len( trace.spectrums[0] )==0:
-        return None
-    ratios = Ratios()
-    nbrFreq = len( trace.spectrums[0] )
-    first = ( 0, 0.0 )
-    second = ( 0, 0.0 )
-    # Find the first and second higher frequencies
-    for freq in range(1, nbrFreq // 2):
-        val = trace.spectrums[0][freq]
-        if val > first[1]:
-            second = first
-            first = ( freq, val )
-        elif val > second[1]:
-            second = ( freq, val )
-    # Calculate the list of harmonic frequencies
-    harmonicLst = []
-    assert(trace.fittedSine)
-    fsamp = 1.0 / trace.XIncrement
-    fsig = trace.fittedSine.all[1] / 2.0 / pi * fsamp
-    for h in range(0, nbrHarmonics):
-        fharm = fsig * (h + 2)
-        while fharm > fsamp:
-            fharm = fharm - fsamp
-        if fharm > fsamp / 2.0:
-            fharm = fsamp - fharm
-        freq = int(fharm * float(nbrFreq) / fsamp)
-        #assert(freq >= 0 and freq < nbrFreq / 2)
-        if freq >= 0 and freq < nbrFreq / 2:
-            harmonicLst.append(freq)
-    # Calculate the THD
-    powThd = 0.0
-    ratios.powHarmLst = []
-    for freq in harmonicLst:
-        val = trace.spectrums[0][freq]
-        vals = trace.spectrums[0][max(0, freq-5):min(trace.spectrums[0].size-1, freq+5)]
-        val2 = max(vals)
-        #assert(val <= second[1])
-        ratios.powHarmLst.append(val2 ** 2.0)
-        powThd = powThd + val2**2.0
-    ratios.powThd = powThd
-    # Calculate the harmonics
-    carrier = first[0]
-    harms = [ (i*carrier)%nbrFreq for i in range(1, nbrHarmonics) ]
-    # Calculate the noise
-    powNoise = 0.0
-    for freq in range(1, nbrFreq // 2):
-        if freq != first[0]:
-            val = trace.spectrums[0][freq]
-            assert(val <= second[1])
-            powNoise = powNoise + val**2.0
-    ratios.powNoise = powNoise - powThd
-    # Calculate the signal
-    ratios.binSignal = first[0]
-    ratios.powSignal = float(first[1])**2.0
-    ratios.binSecond = second[0]
-    ratios.powSecond = float(second[1])**2.0
-    ratios.powFS = (VerticalScale(trace) / 2) ** 2.0
-    return ratios
-
+        if SpectrumAveraging:
+            if spectrumReset:
+                SpectrumAveraging.Reset()
+            if getattr( record, "power", None ) is not None:
+                average = SpectrumAveraging.AddPower( record.power )
+            else:
+                average = SpectrumAveraging.Add( RecordSamples( record, nbrSamples ) )
+            # Displayed as the amplitude of a sine of the same power
+            record.spectrums = list( np.sqrt( 2*average ) )
+        else:
+            record.spectrums = list( AmplitudeSpectrum( RecordSamples( record, nbrSamples ), window=SpectrumWindow ) )
 
 spectrumReset = False
 spectrumMax = []
@@ -125,111 +61,6 @@ def Clear():
     spectrumReset = True
 
 
-GAIN = 0
-OMEGA = 1
-PHASE = 2
-OFFSET = 3
-RMS = 4
-
-class FittedSine:
-
-    def __init__(self):
-        self.success = 0
-        self.all = [ 1., 1., 0., 0., 0. ]
-        self.adc = []
-        self.XIncrement = 0
-
-
-def CalcZeroCross(samples):
-    levelMin, levelMax = int( min(samples) ), int( max(samples) )
-    levelMean, levelGain = (levelMin + levelMax) / 2, (levelMax - levelMin) / 2
-    levelUp, levelDn = levelMean + levelGain * 0.1, levelMean - levelGain * 0.1
-    level = 0
-    phase = 0
-    crossLst = []
-    phaseLst = []
-    samplePrev = samples[0]
-    n = 0
-    for sample in samples[1:]:
-        if sample > levelUp:
-            if level == -1:
-                cross = (n - 1) + (levelMean - samplePrev) / (sample - samplePrev)
-                crossLst.append(cross)
-                phaseLst.append(phase)
-                phase = phase + pi
-            level = 1
-        if sample < levelDn:
-            if phase == 0:
-                phase = pi
-            if level == 1:
-                cross = (n - 1) + (levelMean - samplePrev) / (sample - samplePrev)
-                crossLst.append(cross)
-                phaseLst.append(phase)
-                phase = phase + pi
-            level = -1
-        if len(crossLst) > 50:
-            break
-        samplePrev = sample
-        n = n + 1
-    if len(crossLst) & 1:
-        crossLst = crossLst[:-1]
-        phaseLst = phaseLst[:-1]
-    return (crossLst, phaseLst)
-
-
-def CalcSinFitGuess(samples):
-    levelMin, levelMax = int( min(samples) ), int( max(samples) )
-    levelMean, levelGain = (levelMin + levelMax) / 2, (levelMax - levelMin) / 2
-    crossLst, phaseLst = CalcZeroCross(samples)
-    if len(crossLst) < 2:
-        return [ levelGain, 0.01, 0, levelMean ]
-    slope, cross = polyfit(crossLst, phaseLst, 1)
-    if cross > pi:
-        cross = cross - 2 * pi
-    return [ levelGain, slope, cross, levelMean ]
-
-
-def CalcFittedSine(trace):
-    if trace.ActualPoints<50:
-        return None
-    fittedSine = FittedSine()
-    nbrPoints = trace.ActualPoints
-    if nbrPoints > 100000:
-        nbrPoints = 100000
-    tx = linspace(0, nbrPoints-1, nbrPoints)
-    ty = trace[0].Samples[:nbrPoints]
-    # Fit the first set
-    fitfunc = lambda p, x: p[0] * sin(p[1]*x + p[2]) + p[3]  # Target function
-    errfunc = lambda p, x, y: fitfunc(p,x) -y                # Distance to the target function
-    p0 = CalcSinFitGuess(trace[0].Samples)                      # Initial guess for the parameters
-    p1, fittedSine.success = optimize.leastsq(errfunc, p0[:], args = (tx, ty))
-    if p1[0] < 0:
-        p1[0] = -p1[0]
-        p1[2] = p1[2] - pi
-    rms = sqrt(sum((errfunc(p1, tx, ty))**2) / nbrPoints)
-    fittedSine.all = [ p1[0], p1[1], p1[2], p1[3], rms ]
-
-    try:
-        nbrAdc = trace.nbrAdc
-        nbrPoints = nbrPoints - (nbrPoints % nbrAdc)
-        if nbrAdc > 1:
-            fittedSine.adc = []
-            for adc in range(0, nbrAdc):
-                atx = linspace(0, nbrPoints-nbrAdc, nbrPoints/nbrAdc)
-                aty = trace.samples[adc:nbrPoints:nbrAdc]
-                ap0 = p1
-                ap1, success = optimize.leastsq(errfunc, ap0[:], args = (atx, aty))
-                if ap1[0] < 0:
-                    ap1[0] = -ap1[0]
-                    ap1[2] = ap1[2] - pi
-                arms = sqrt(sum((errfunc(ap1, atx, aty))**2) / (nbrPoints/nbrAdc))
-                fittedSine.adc.append(  [ ap1[0], ap1[1], ap1[2], ap1[3], arms ]  )
-    except:
-        pass
-    fittedSine.XIncrement = trace.XIncrement
-    return fittedSine
-
-
 def CalcBestNbrSamples(trace, fsig):
     fsamp = 1 / trace.XIncrement
     best = [ 1, 1, 0 ] 
@@ -289,11 +120,22 @@ SubProcess = None
 ListenSocket = None
 ReadSocket = None
 IncomingAddr = None
+ShmName = None
 
 def GetTraceFromSource():
     global RunCommand, InputFile, SubProcess, TcpPort, TcpBind, TcpHost, ReadSocket, ListenSocket, IncomingAddr, Pause
     input = None
     filename = ""
+    if ShmName:
+        # The records of a runner with --output-shm, without parsing. With
+        # --nolive, they are copied out of the ring as they wait in the queue.
+        for rec in ReadShmRing( ShmName, copy=ShowAll, wait=True ):
+            rec.filename = "<SHM:" + ShmName + ">"
+            if telemetry:
+                rec.arrival = time.perf_counter()
+                telemetry.Count( "records" )
+            yield rec
+        return
     if InputFile and InputFile != "-":
         filename = InputFile
         input = open(InputFile)
@@ -349,9 +191,21 @@ def GetTraceFromSource():
         filename = "<STDIN>"
         input = sys.stdin
     if input:
+        if telemetry:
+            input = TimedInput( input )
+            start, read, size = time.perf_counter(), 0.0, 0
         for rec in ReadTrace( input ):
             rec.filename = filename
+            if telemetry:
+                # Time waiting for the source, and time parsing it
+                rec.arrival = time.perf_counter()
+                telemetry.Add( "read", input.seconds-read )
+                telemetry.Add( "parse", rec.arrival-start-( input.seconds-read ) )
+                telemetry.Count( "records" )
+                telemetry.Count( "bytes", input.bytes-size )
             yield rec
+            if telemetry:
+                start, read, size = time.perf_counter(), input.seconds, input.bytes
 #        if not TcpPort or TcpHost: # We are not listening
 #            Pause = True
     if SubProcess and SubProcess.poll() != None:
@@ -360,15 +214,20 @@ def GetTraceFromSource():
 
 def CalculateTrace(trace):
     global ShowSignal, ShowRatios, ShowSpectrum, ShowFittedSine
+    if getattr( trace, "analyzed", False ):
+        # Computed by the analysis workers, only the averaging of spectrums is left
+        if ShowSpectrum and SpectrumAveraging:
+            CalcFourier(trace, trace.nbrFftSamples)
+        return trace
     # Calculate sine fit
-    if USE_SCIPY and ShowFittedSine:
+    if ShowFittedSine:
         try:
             trace.fittedSine = CalcFittedSine(trace)
         except:
             trace.fittedSine = None
     # Calculate FFT
+    trace.nbrFftSamples = trace.ActualPoints if trace.ActualPoints<65536 else 65536
     if ShowSpectrum:
-        trace.nbrFftSamples = trace.ActualPoints if trace.ActualPoints<65536 else 65536
         CalcFourier(trace, trace.nbrFftSamples)
     # Calculate ratios
     trace.ratios = None
@@ -401,107 +260,140 @@ def _GetColor(index, light=False):
     return colors[index%len( colors )]
 
 
+ShowMinMax = False
+DecimationMethod = 'minmax'
+decimators = {}
+timeAxes = {}
+lastSignalKey = None
+
+def _SignalTimeAxis( trace ):
+    """ Returns the time of the first sample, and the time step, in us, of the signal plot.
+    """
+    timeFirst = 0.0 if trace.InitialXOffset == 0.0 else -trace.XIncrement*1e6
+    timeFull = trace.XIncrement * ( trace.ActualPoints-1 ) * 1e6 - timeFirst
+    return timeFirst, ( timeFull-timeFirst )/max( 1, trace.ActualPoints-1 )
+
+
+def _DecimatedSignal( key, trace, samples ):
+    """ Decimates samples to two points per pixel column of the visible part of the signal plot.
+    """
+    decimator = decimators.get( key )
+    if decimator is None:
+        decimator = decimators[key] = Decimator( method=DecimationMethod )
+    decimator.points = max( 4, 2*int( plotSignal.bbox.width ) )
+    timeFirst, timeStep = _SignalTimeAxis( trace )
+    left, right = sorted( plotSignal.get_xlim() )
+    first = math.floor( ( left-timeFirst )/timeStep )-1
+    last = math.ceil( ( right-timeFirst )/timeStep )+2
+    return decimator.Decimate( samples, first, last )
+
+
+def _SignalTime( key, trace, indexes, shift=0.0 ):
+    """ Returns the times in us of the decimated samples of the line key, and
+        whether they changed since the previous frame.
+    """
+    decimator = decimators[key]
+    cacheKey = ( decimator.key, trace.XIncrement, trace.InitialXOffset )
+    cached = timeAxes.get( key )
+    if cached and cached[0]==cacheKey and not decimator.changed:
+        return cached[1], False
+    timeFirst, timeStep = _SignalTimeAxis( trace )
+    time = timeFirst + indexes*timeStep + shift
+    timeAxes[key] = ( cacheKey, time )
+    return time, True
+
+
 def ShowImages(trace):
     global ShowSignal, ShowSpectrum, ShowFittedSine
     global plotSignal, linesSignals, lineMinSignals, minSignals, lineMaxSignals, maxSignals, plotSpectrum, lineSpectrum, lineMaxSpectrum, specMax, spectrumReset
+    global lastSignalKey
     if len( trace )==0 or len( trace[0] )==0:
         return
-    if USE_SCIPY:
-        nbrChannels = len( trace )
-        if ShowSignal:
-            if linesSignals and len( linesSignals )>0 and linesSignals[0] and \
-                    (   len(linesSignals[0].get_xdata()) != len( trace[0] ) \
-                     or (linesSignals[0].get_xdata()[1] - linesSignals[0].get_xdata()[0]) != trace.XIncrement   ):
-                plotSignal.clear()
-                linesSignals = []
-                minSignals = []
-                lineMinSignals = []
-                maxSignals = []
-                lineMaxSignals = []
-            while len( linesSignals ) < nbrChannels:
-                linesSignals.append( None )
-                if lineMinSignals:
-                    minSignals.append( None )
-                    lineMinSignals.append( None )
-                if lineMaxSignals:
-                    maxSignals.append( None )
-                    lineMaxSignals.append( None )
-            marker = None
-            if trace.ActualPoints <= 100:
-                marker = "."
-            for ch, wfm in enumerate( trace ):
-                if lineMinSignals:
-                    if not lineMinSignals[ch] or len(lineMinSignals[ch].get_xdata()) != len(minSignals[ch]):
-                        minSignals[ch] = wfm.Samples
-                        timeFirst = 0.0 if trace.InitialXOffset == 0.0 else -trace.XIncrement*1e6
-                        timeFull  = trace.XIncrement * ( trace.ActualPoints-1 ) * 1e6 - timeFirst
-                        time = linspace(timeFirst, timeFull, trace.ActualPoints)
-                        try: lineMinSignals[ch], = plotSignal.plot(time, minSignals[ch], color=_GetColor(ch, light=True))
-                        except: pass
-                    elif spectrumReset:
-                        minSignals[ch] = wfm.Samples
-                    else:
-                        minSignals[ch] = minimum(wfm.Samples, minSignals[ch])
-                        lineMinSignals[ch].set_ydata(minSignals[ch])
-                if lineMaxSignals:
-                    if not lineMaxSignals[ch] or len(lineMaxSignals[ch].get_xdata()) != len(maxSignals[ch]):
-                        maxSignals[ch] = wfm.Samples
-                        timeFirst = 0.0 if trace.InitialXOffset == 0.0 else -trace.XIncrement*1e6
-                        timeFull = trace.XIncrement * ( trace.ActualPoints-1 ) * 1e6 - timeFirst
-                        time = linspace(timeFirst, timeFull , trace.ActualPoints)
-                        try: lineMaxSignals[ch], = plotSignal.plot(time, maxSignals[ch], color=_GetColor(ch, light=True))
+    nbrChannels = len( trace )
+    if ShowSignal:
+        signalKey = ( len( trace[0] ), trace.XIncrement, trace.InitialXOffset==0.0 )
+        if linesSignals and len( linesSignals )>0 and linesSignals[0] and signalKey!=lastSignalKey:
+            plotSignal.clear()
+            linesSignals = []
+            minSignals = []
+            lineMinSignals = []
+            maxSignals = []
+            lineMaxSignals = []
+            decimators.clear()
+            timeAxes.clear()
+        lastSignalKey = signalKey
+        timeFirst, timeStep = _SignalTimeAxis( trace )
+        timeFull = timeFirst + timeStep*( trace.ActualPoints-1 )
+        if not linesSignals:
+            plotSignal.get_xaxis().axes.set_xlim(timeFirst, timeFull)
+        while len( linesSignals ) < nbrChannels:
+            linesSignals.append( None )
+            if ShowMinMax:
+                minSignals.append( None )
+                lineMinSignals.append( None )
+                maxSignals.append( None )
+                lineMaxSignals.append( None )
+        marker = None
+        if trace.ActualPoints <= 100:
+            marker = "."
+        for ch, wfm in enumerate( trace ):
+            if ShowMinMax:
+                if minSignals[ch] is None or spectrumReset:
+                    minSignals[ch] = np.array( wfm.Samples )
+                    maxSignals[ch] = np.array( wfm.Samples )
+                else:
+                    np.minimum( wfm.Samples, minSignals[ch], out=minSignals[ch] )
+                    np.maximum( wfm.Samples, maxSignals[ch], out=maxSignals[ch] )
+                for lines, holds, name in ( ( lineMinSignals, minSignals, 'min' ), ( lineMaxSignals, maxSignals, 'max' ) ):
+                    indexes, values = _DecimatedSignal( ( name, ch ), trace, holds[ch] )
+                    time, timeChanged = _SignalTime( ( name, ch ), trace, indexes )
+                    if not lines[ch]:
+                        try: lines[ch], = plotSignal.plot(time, values, color=_GetColor(ch, light=True))
                         except: pass
-                    elif spectrumReset:
-                        maxSignals[ch] = wfm.Samples
                     else:
-                        maxSignals[ch] = maximum(wfm.Samples, maxSignals[ch])
-                        lineMaxSignals[ch].set_ydata(maxSignals[ch])
-                if not linesSignals[ch]:
-                    plotSignal.set_title('Signal (us)')
-                    plotSignal.set_ylabel('magnitude')
-                    plotSignal.grid( which='both', linestyle='-' )
-                    timeFirst = 0.0 if trace.InitialXOffset == 0.0 else -trace.XIncrement*1e6
-                    timeFull = trace.XIncrement * ( trace.ActualPoints-1 ) * 1e6 - timeFirst
-                    time = linspace(timeFirst, timeFull, trace.ActualPoints)
-                    time = time + (trace.InitialXOffset%trace.XIncrement) * 1e6
-                    linesSignals[ch], = plotSignal.plot(time, wfm.Samples, color=_GetColor(ch), marker=marker)
-                    plotSignal.get_xaxis().axes.set_xlim(timeFirst, timeFull)
-                    yscale = VerticalScale( trace )
-                    ylim = (-yscale/2, yscale/2 - 1) if yscale>100 else (-yscale/2, yscale/2)
-                    plotSignal.get_yaxis().axes.set_ylim(*ylim)
-                    plotSignal.get_yaxis().axes.set_yticks([ylim[0]+n*yscale/8 for n in range(0, 8)] + [ylim[1]])
-                else:
-                    if trace.InitialXOffset!=0.0:
-                        timeFirst = 0.0 if trace.InitialXOffset == 0.0 else -trace.XIncrement*1e6
-                        timeFull = trace.XIncrement * ( trace.ActualPoints-1 ) * 1e6 - timeFirst
-                        time = linspace(timeFirst, timeFull, trace.ActualPoints)
-                        time = time + (trace.InitialXOffset%trace.XIncrement) * 1e6
-                        linesSignals[ch].set_xdata(time)
-                    linesSignals[ch].set_ydata( wfm.Samples )
-        if ShowSpectrum:
-            spec = 20.0 * log10(trace.spectrums[0][0:trace.ActualPoints // 2 + 1] / (VerticalScale(trace) / 2))
-            if spectrumReset or not lineSpectrum or len(lineSpectrum.get_xdata()) != len(spec):
-                plotSpectrum.clear()
-                lineSpectrum = None
-                lineMaxSpectrum = None
-                freqHalf = 0.5 / trace.XIncrement / 1e6
-                freq = linspace(0.0, freqHalf, len(spec))
-                specMax = spec
-                try: lineMaxSpectrum, = plotSpectrum.plot(freq, specMax, color='#9cdbd8')
-                except: pass
-                try: lineSpectrum, = plotSpectrum.plot(freq, spec, color='#0085d5')
-                except: pass
-                plotSpectrum.set_title('Spectrum (MHz)')
-                plotSpectrum.set_ylabel('dBFS')
-                plotSpectrum.grid( which='both', linestyle='-' )
-                plotSpectrum.get_xaxis().axes.set_xlim(0, freqHalf)
-                plotSpectrum.get_yaxis().axes.set_ylim(-120, 0)
+                        if timeChanged:
+                            lines[ch].set_xdata(time)
+                        lines[ch].set_ydata(values)
+            indexes, values = _DecimatedSignal( ( 'signal', ch ), trace, wfm.Samples )
+            time, timeChanged = _SignalTime( ( 'signal', ch ), trace, indexes, (trace.InitialXOffset%trace.XIncrement) * 1e6 )
+            if not linesSignals[ch]:
+                plotSignal.set_title('Signal (us)')
+                plotSignal.set_ylabel('magnitude')
+                plotSignal.grid( which='both', linestyle='-' )
+                linesSignals[ch], = plotSignal.plot(time, values, color=_GetColor(ch), marker=marker)
+                plotSignal.get_xaxis().axes.set_xlim(timeFirst, timeFull)
+                yscale = VerticalScale( trace )
+                ylim = (-yscale/2, yscale/2 - 1) if yscale>100 else (-yscale/2, yscale/2)
+                plotSignal.get_yaxis().axes.set_ylim(*ylim)
+                plotSignal.get_yaxis().axes.set_yticks([ylim[0]+n*yscale/8 for n in range(0, 8)] + [ylim[1]])
             else:
-                lineSpectrum.set_ydata(spec)
-                specMax = maximum(spec, specMax)
-                if lineMaxSpectrum: lineMaxSpectrum.set_ydata(specMax)
-        if spectrumReset:
-            spectrumReset = False
+                if timeChanged:
+                    linesSignals[ch].set_xdata(time)
+                linesSignals[ch].set_ydata( values )
+    if ShowSpectrum:
+        spec = 20.0 * log10(trace.spectrums[0][0:trace.ActualPoints // 2 + 1] / (VerticalScale(trace) / 2))
+        if spectrumReset or not lineSpectrum or len(lineSpectrum.get_xdata()) != len(spec):
+            plotSpectrum.clear()
+            lineSpectrum = None
+            lineMaxSpectrum = None
+            freqHalf = 0.5 / trace.XIncrement / 1e6
+            freq = linspace(0.0, freqHalf, len(spec))
+            specMax = spec
+            try: lineMaxSpectrum, = plotSpectrum.plot(freq, specMax, color='#9cdbd8')
+            except: pass
+            try: lineSpectrum, = plotSpectrum.plot(freq, spec, color='#0085d5')
+            except: pass
+            plotSpectrum.set_title('Spectrum (MHz)')
+            plotSpectrum.set_ylabel('dBFS')
+            plotSpectrum.grid( which='both', linestyle='-' )
+            plotSpectrum.get_xaxis().axes.set_xlim(0, freqHalf)
+            plotSpectrum.get_yaxis().axes.set_ylim(-120, 0)
+        else:
+            lineSpectrum.set_ydata(spec)
+            specMax = maximum(spec, specMax)
+            if lineMaxSpectrum: lineMaxSpectrum.set_ydata(specMax)
+    if spectrumReset:
+        spectrumReset = False
     # Fitted sine values
     mismatch = Mismatch()
     if ShowFittedSine and trace.fittedSine:
@@ -532,32 +424,105 @@ def ShowImages(trace):
 Pause = False
 Force = True
 
+Analysis = None
+
 def ReadInput( queue ):
-    global ShowAll
     for trace in GetTraceFromSource():
-        if not ShowAll and not Pause:
-            while not queue.empty():
-                queue.get_nowait()
-        queue.put( trace )
-        time.sleep( 1e-3 )
+        if Analysis:
+            Analysis.Submit( trace )
+        else:
+            queue.Put( trace )
+
+
+def Dropped():
+    return queue.dropped + ( Analysis.dropped if Analysis else 0 )
+
+
+def StatusText():
+    received = Analysis.submitted if Analysis else queue.received
+    return "%d received, %d displayed, %d dropped" % ( received, queue.displayed, Dropped() )
+
+
+telemetry = None
+overlay = None
+
+def _Stage( name ):
+    return telemetry.Stage( name ) if telemetry else nullcontext()
+
+
+def _Painted( trace ):
+    """ Accounts for the latency from the arrival of trace to its display. """
+    if telemetry and hasattr( trace, "arrival" ):
+        telemetry.Add( "latency", time.perf_counter()-trace.arrival )
+
+
+def _TickTelemetry():
+    if not telemetry:
+        return
+    telemetry.Set( "dropped", Dropped() )
+    report = telemetry.Tick()
+    if report and overlay:
+        _ShowOverlay( FormatReport( report, ( "read", "parse", "calculate", "draw", "latency" ) ) )
 
 
 def Update( index=None ):
     global queue
     global Pause, Force
+    _TickTelemetry()
     if Pause and not Force:
         return
-    if queue.empty() and not Pause:
+    if queue.Empty() and not Pause:
         return
     Force = False
-    if not queue.empty():
-        trace = queue.get()#_nowait()
-        CalculateTrace(trace)
-        ShowImages(trace)
+    trace = queue.Get()
+    if trace is not None:
+        with _Stage( "calculate" ):
+            CalculateTrace(trace)
+        with _Stage( "draw" ):
+            ShowImages(trace)
+            if blitter:
+                blitter.Update( _Artists() )
+        if blitter:
+            _Painted( trace )
+        else:
+            # Painted on the next draw of the figure
+            global paintPending
+            paintPending = trace
+        if frameCounter:
+            frameCounter.Tick()
     if not Pause:
         pass
 
 
+blitter = None
+frameCounter = None
+
+def _Artists():
+    """ Returns the lines redrawn on each frame.
+    """
+    artists = []
+    if ShowSignal:
+        artists += [line for line in linesSignals+lineMinSignals+lineMaxSignals if line]
+    if ShowSpectrum:
+        artists += [line for line in ( lineMaxSpectrum, lineSpectrum ) if line]
+    if overlay:
+        artists.append( overlay )
+    return artists
+
+
+paintPending = None
+
+def _OnDraw( event ):
+    global paintPending
+    if paintPending:
+        _Painted( paintPending )
+        paintPending = None
+
+
+def _ShowOverlay( text ):
+    overlay.set_text( text )
+
+
 def PauseText():
     global Pause
     if Pause:
@@ -581,14 +546,17 @@ def RunNext():
 
 def main():
     global ShowRatios, ShowSignal, ShowSpectrum, ShowFittedSine, ShowAll
-    global Pause, RunCommand, InputFile, TcpPort, TcpBind, TcpHost
+    global Pause, RunCommand, InputFile, TcpPort, TcpBind, TcpHost, ShmName
     global queue
     global ani
 
     from argparse import ArgumentParser
     parser = ArgumentParser( "Live Viewer" )
     parser.add_argument( "--signal", action='store_true', default=None )
-    parser.add_argument( "--spectrum", action='store_true' )
+    parser.add_argument( "--spectrum", nargs='?', const='single', default=None, choices=['single', 'exponential', 'average'] )
+    parser.add_argument( "--spectrum-averages", type=int, default=16 )
+    parser.add_argument( "--spectrum-segment", type=int, default=None )
+    parser.add_argument( "--spectrum-window", type=str, default=None, choices=list( WINDOWS ) )
     parser.add_argument( "--ratios", action='store_true' )
     parser.add_argument( "--fitted-sine", action='store_true' )
     parser.add_argument( "--size", type=str, default="640x320" )
@@ -597,8 +565,19 @@ def main():
     parser.add_argument( "--tcp", type=str, default=None )
     parser.add_argument( "--listen", type=int, default=None )
     parser.add_argument( "--bind", type=str, default=None )
+    parser.add_argument( "--shm", type=str, default=None, help="Read the records of a runner with --output-shm." )
     parser.add_argument( "--min-max-signal", action='store_true', default=False )
+    parser.add_argument( "--decimation", type=str, default='minmax', choices=METHODS )
+    parser.add_argument( "--blit", action='store_true', default=False, help="Redraw only the lines on each frame." )
+    parser.add_argument( "--interval", type=int, default=200, help="Delay between frames in ms." )
+    parser.add_argument( "--fps", action='store_true', default=False, help="Print the frame rate." )
+    parser.add_argument( "--telemetry", action='store_true', default=False, help="Print the timings of read, parse, calculate and draw as JSON lines." )
+    parser.add_argument( "--telemetry-interval", type=float, default=1.0 )
+    parser.add_argument( "--overlay", action='store_true', default=False, help="Show the timings on screen." )
     parser.add_argument( "--nolive", action='store_true', default=False )
+    parser.add_argument( "--workers", type=int, default=0, help="Number of processes for the sine fit, spectrum and ratios." )
+    parser.add_argument( "--queue-length", type=int, default=64, help="Maximum number of records waiting with --nolive." )
+    parser.add_argument( "--queue-memory", type=float, default=512, help="Maximum MB of samples waiting with --nolive." )
     parser.add_argument( "inputs", type=str, nargs="*" )
 
     args = parser.parse_args()
@@ -613,10 +592,19 @@ def main():
     TcpHost = args.tcp
     TcpBind = args.bind if args.bind else ""
     TcpPort = args.listen
+    ShmName = args.shm
     ShowRatios = args.ratios
     ShowSignal = args.signal if args.spectrum else True
     ShowSpectrum = args.spectrum
+    global SpectrumWindow, SpectrumAveraging
+    if args.spectrum and args.spectrum!='single':
+        SpectrumAveraging = SpectrumAverager( length=args.spectrum_segment, window=args.spectrum_window or 'hann', mode=args.spectrum, averages=args.spectrum_averages )
+    elif args.spectrum_window:
+        SpectrumWindow = args.spectrum_window
     ShowFittedSine = args.fitted_sine
+    global ShowMinMax, DecimationMethod
+    ShowMinMax = args.min_max_signal
+    DecimationMethod = args.decimation
         
 
     global plotSignal, linesSignals, lineMinSignals, minSignals, lineMaxSignals, maxSignals, plotSpectrum, lineSpectrum, lineMaxSpectrum, specMax
@@ -627,41 +615,61 @@ def main():
     figWhole, plots = plt.subplots(nbPlots, 1, figsize=(ImgWidth/100, ImgHeight/100), dpi=100)
     axSignal, axSpectrum = plots if nbPlots > 1 else (plots, None) if ShowSignal else (None, plots)
 
-    ani = FuncAnimation( figWhole, Update, frames=None )
-
-    if USE_SCIPY:
-        if ShowSignal:
-            plotSignal = axSignal
-            linesSignals = []
-            lineMinSignals = []
-            minSignals = []
-            lineMaxSignals = []
-            maxSignals = []
-
-            plotSignal.set_title('Signal (us)')
-            plotSignal.set_ylabel('magnitude')
-            plotSignal.grid( which='both', linestyle='-' )
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-
-        if ShowSpectrum:
-            plotSpectrum = axSpectrum
-            lineSpectrum = None
-            specMax = None
-            lineMaxSpectrum = None
-
-            plotSpectrum.set_title('Spectrum (MHz)')
-            plotSpectrum.set_ylabel('dBFS')
-            plotSpectrum.get_yaxis().axes.set_ylim(-120, 0)
-            plotSpectrum.grid( which='both', linestyle='-' )
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
+    global blitter, frameCounter, telemetry, overlay
+    if args.fps:
+        frameCounter = FrameCounter( status=StatusText )
+    if args.telemetry or args.overlay:
+        telemetry = Telemetry( "LiveViewer", interval=args.telemetry_interval, file=sys.stderr if args.telemetry else None )
+        figWhole.canvas.mpl_connect( 'draw_event', _OnDraw )
+    if args.overlay:
+        overlay = figWhole.text( 0.01, 0.99, "", va='top', fontsize=7, family='monospace' )
+    if args.blit:
+        blitter = Blitter( figWhole.canvas )
+        ani = figWhole.canvas.new_timer( interval=args.interval )
+        ani.add_callback( Update )
+        ani.start()
+    else:
+        ani = FuncAnimation( figWhole, Update, frames=None, interval=args.interval )
+
+    if ShowSignal:
+        plotSignal = axSignal
+        linesSignals = []
+        lineMinSignals = []
+        minSignals = []
+        lineMaxSignals = []
+        maxSignals = []
+
+        plotSignal.set_title('Signal (us)')
+        plotSignal.set_ylabel('magnitude')
+        plotSignal.grid( which='both', linestyle='-' )
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
 
-    queue = Queue()
+    if ShowSpectrum:
+        plotSpectrum = axSpectrum
+        lineSpectrum = None
+        specMax = None
+        lineMaxSpectrum = None
+
+        plotSpectrum.set_title('Spectrum (MHz)')
+        plotSpectrum.set_ylabel('dBFS')
+        plotSpectrum.get_yaxis().axes.set_ylim(-120, 0)
+        plotSpectrum.grid( which='both', linestyle='-' )
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+
+    queue = BoundedFifo( args.queue_length, int( args.queue_memory*1024*1024 ) ) if ShowAll else LatestSlot()
+    global Analysis
+    if args.workers>0:
+        welch = ( SpectrumAveraging.length, SpectrumAveraging.overlap, SpectrumAveraging.window ) if SpectrumAveraging else None
+        analyze = partial( Analyze, fittedSine=ShowFittedSine, spectrum=bool( ShowSpectrum ), window=SpectrumWindow, welch=welch, ratios=ShowRatios )
+        Analysis = AnalysisPool( analyze, args.workers, queue.Put, keepAll=ShowAll )
     cmdthread = Thread( target=ReadInput, args=( queue, ), daemon=True )
     cmdthread.start()
 
     plt.show()
+    if Analysis:
+        Analysis.Close()
 
 
 if __name__ == '__main__':
@@ -1,15 +1,105 @@
 #!/usr/bin/python3
 
-from sys import stdin, stdout
+from sys import stdin, stdout, stderr
 from waveforms.trace import ReadTrace
-from numpy import ones, float32
+from numpy import ones, zeros, float32
 from matplotlib import pyplot
 from math import fmod
 from argparse import ArgumentParser
+from threading import Thread, Lock
+import socket
+import numpy as np
 
 # Takes as input a .trc file, and output a .skew file.
 
 
+# Take usual colors, and translate them to tuple of three floats.
+C = ['#e90029', '#009fe3', '#8b3c8f', '#019642', '#ed5e1a', '#9c9c9c', '#fdc206', '#000000']
+#     Kt Red     Kt Blue    Kt Purple   Kt Green  Kt Orange  Kt MedGray Kt Yellow  Kt Black
+CC = [( int( c[1:3], 16 )/255, int( c[3:5], 16 )/255, int( c[5:7], 16 )/255 ) for c in C]
+
+
+class Persistence:
+    """ Hit count images, one per channel, of the samples of records.
+
+    >>> from waveforms.trace import Trace
+    >>> persist = Persistence( width=4, height=4, scale=4, length=4.0 )
+    >>> wave = Trace.Wave()
+    >>> wave._Samples = np.array( [1, 1, 0, -1, 7] )
+    >>> record = Trace()
+    >>> record._Waves = [wave]
+    >>> record.XIncrement, record.InitialXOffset = 1.0, 0.0
+    >>> persist.Add( record )
+    >>> persist.Add( record )
+    >>> print( persist.hits[0] )
+    [[0. 0. 0. 0.]
+     [2. 2. 0. 0.]
+     [0. 0. 2. 0.]
+     [0. 0. 0. 2.]]
+    """
+    def __init__( self, width=256, height=256, scale=65536, length=1e-9, offset=0.0, zeroDelay=False, decay=None ):
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.length = length
+        self.offset = offset
+        self.zeroDelay = zeroDelay
+        self.decay = decay
+        self.hits = []
+        self.records = 0
+
+    def _Hits( self, channel ):
+        while len( self.hits )<=channel:
+            self.hits.append( zeros( ( self.height, self.width ), dtype=float32 ) )
+        return self.hits[channel]
+
+    def Add( self, record, firstChannel=0 ):
+        """ Accumulates the samples of the waveforms of record, from the channel
+            image firstChannel on.
+        """
+        if self.decay:
+            for hits in self.hits:
+                hits *= self.decay
+        InitialXOffset = fmod( record.InitialXOffset, record.XIncrement ) if self.zeroDelay else record.InitialXOffset
+        for c, waveform in enumerate( record ):
+            samples = np.asarray( waveform.Samples )
+            times = InitialXOffset + np.arange( len( samples ) )*record.XIncrement
+            x = np.trunc( ( -self.offset+times )/self.length*self.width ).astype( np.int64 )
+            y = self.height//2 - np.trunc( samples/self.scale*self.height ).astype( np.int64 )
+            inside = ( x>=0 ) & ( x<self.width ) & ( y>=0 ) & ( y<self.height )
+            counts = np.bincount( y[inside]*self.width + x[inside], minlength=self.height*self.width )
+            self._Hits( firstChannel+c ).ravel()[...] += counts
+        self.records += 1
+
+    def Image( self, saturation=1.0 ):
+        """ Returns the RGB image, where a channel pixel has its full color after
+            saturation hits. First channels are drawn over the last ones.
+        """
+        bmp = ones( ( self.height, self.width, 3 ), dtype=float32 )
+        for c in reversed( range( len( self.hits ) ) ):
+            alpha = np.minimum( self.hits[c]/saturation, 1.0 )[:, :, None]
+            bmp *= 1.0-alpha
+            bmp += alpha*np.array( CC[c%len( CC )], dtype=float32 )
+        return bmp
+
+
+def Accumulate( persist, traces, lock=None ):
+    """ Adds all the records of traces to persist. The channels of each trace
+        have their own images.
+    """
+    c0 = 0
+    for trace in traces:
+        cr0 = 0
+        for record in ReadTrace( trace ):
+            cr0 = len( record )
+            if lock:
+                with lock:
+                    persist.Add( record, c0 )
+            else:
+                persist.Add( record, c0 )
+        c0 = c0+cr0
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument( "--width",   "-w",  type=int,   default=256   )
@@ -18,57 +108,54 @@ def main():
     parser.add_argument( "--length",  "-l",  type=float, default=1e-9  )
     parser.add_argument( "--offset",  "-o",  type=float, default=0.0   )
     parser.add_argument( "--zero-delay", "-zd", action='store_true', help="Warning: Use only with trigger delay multiple of sampling interval." )
+    parser.add_argument( "--decay",   "-d",  type=float, default=None,  help="Factor applied to the hit counts on each record, for a phosphor-like display." )
+    parser.add_argument( "--saturation", "-sat", type=float, default=1.0, help="Number of hits for the full color of a pixel." )
+    parser.add_argument( "--live",    "-lv", action='store_true', help="Redraw while records are read. Default when reading stdin or TCP." )
+    parser.add_argument( "--fps",            type=float, default=10.0,  help="Frame rate of the live display." )
+    parser.add_argument( "--tcp",            type=str,   default=None,  help="Read records from HOST:PORT." )
     parser.add_argument( "files", nargs='*', type=str )
 
     args = parser.parse_args()
 
+    persist = Persistence( width=args.width, height=args.height, scale=args.scale, length=args.length,
+                           offset=args.offset, zeroDelay=args.zero_delay, decay=args.decay )
 
-    # Take usual colors, and translate them to tuple of three floats.
-    C = ['#e90029', '#009fe3', '#8b3c8f', '#019642', '#ed5e1a', '#9c9c9c', '#fdc206', '#000000']
-    #     Kt Red     Kt Blue    Kt Purple   Kt Green  Kt Orange  Kt MedGray Kt Yellow  Kt Black
-    CC = [( int( c[1:3], 16 )/255, int( c[3:5], 16 )/255, int( c[5:7], 16 )/255 ) for c in C]
-
-    height = args.height
-    width = args.width
-
-    scale = args.scale
-    length = args.length
-    offset = args.offset
-
-    bmp = ones( (height, width, 3), dtype=float32 )
-
-    r_enumerate= lambda iterable: zip( reversed( range( len(iterable) ) ), reversed( iterable ) )
-
-    if len( args.files )==0:
+    if args.tcp:
+        host, port = args.tcp.rsplit( ":", 1 )
+        traces = [socket.create_connection( ( host, int( port ) ) ).makefile( 'rt' )]
+    elif len( args.files )==0:
         traces = [stdin]
     else:
         traces = [open( name, 'rt' ) for name in args.files]
+    live = args.live or args.tcp or len( args.files )==0
 
-    c0 = 0
-    for trace in traces:
-        cr0 = 0
-        for record in ReadTrace( trace ):
-            InitialXOffset = fmod( record.InitialXOffset, record.XIncrement ) if args.zero_delay else record.InitialXOffset
-            cr0 = len(record)
-            for c, waveform in r_enumerate( record ):
-                for i in range( len(waveform) ):
-                    time = InitialXOffset+i*record.XIncrement
-                    sample = waveform[i]
-                    x = int( ( -offset+time )/length*width )
-                    y = height//2-int( sample/scale*height )
-                    if x>width:
-                        break
-                    if 0<=x<width and 0<=y<height:
-                        bmp[y, x] = CC[c+c0]
-        c0 = c0+cr0
-
+    width, height, offset, length, scale = args.width, args.height, args.offset, args.length, args.scale
     pyplot.xlabel( "Time (ns)" )
     pyplot.xticks( [0, width-1], ["%g"%(offset*1e9), "%g"%(( offset+length )*1e9)] )
     pyplot.yticks( [0, height//2-1, height-1], [str(scale//2-1), "0", str(-scale//2)] )
-    pyplot.imshow( bmp, interpolation='hanning' )
+
+    if not live:
+        Accumulate( persist, traces )
+        pyplot.imshow( persist.Image( args.saturation ), interpolation='hanning' )
+        pyplot.show()
+        return
+
+    from matplotlib.animation import FuncAnimation
+    lock = Lock()
+    reader = Thread( target=Accumulate, args=( persist, traces, lock ), daemon=True )
+    reader.start()
+    image = pyplot.imshow( persist.Image( args.saturation ), interpolation='hanning', animated=True )
+
+    def Redraw( frame ):
+        with lock:
+            bmp = persist.Image( args.saturation )
+        image.set_data( bmp )
+        return image,
+
+    global animation
+    animation = FuncAnimation( pyplot.gcf(), Redraw, interval=1000.0/args.fps, blit=True, cache_frame_data=False )
     pyplot.show()
 
 
 if __name__=="__main__":
     main()
-
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+
+from sys import stderr
+import time
+
+# Helpers for the rendering of the live viewers.
+
+
+class Blitter:
+    """ Redraws only the given artists over a cached background of the figure.
+        The background is captured on each full draw of the canvas, which
+        happens when the artists change, or when matplotlib redraws the figure
+        itself, like after a zoom or a resize.
+    """
+    def __init__( self, canvas ):
+        self.canvas = canvas
+        self.artists = []
+        self.background = None
+        canvas.mpl_connect( 'draw_event', self._OnDraw )
+
+    def _OnDraw( self, event ):
+        self.background = self.canvas.copy_from_bbox( self.canvas.figure.bbox )
+        self._DrawArtists()
+
+    def _DrawArtists( self ):
+        for artist in self.artists:
+            self.canvas.figure.draw_artist( artist )
+
+    def Update( self, artists ):
+        """ Redraws artists. The figure is fully drawn when they are not the
+            ones of the previous update.
+        """
+        if artists!=self.artists:
+            for artist in artists:
+                artist.set_animated( True )
+            self.artists = list( artists )
+            self.background = None
+        if self.background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region( self.background )
+            self._DrawArtists()
+            self.canvas.blit( self.canvas.figure.bbox )
+        self.canvas.flush_events()
+
+
+class FrameCounter:
+    """ Counts the frames, and prints the frame rate every period seconds,
+        followed by the text returned by status, if any.
+
+    >>> from sys import stdout
+    >>> counter = FrameCounter( period=2.0, name="Test", file=stdout )
+    >>> for now in ( 0.0, 0.5, 1.0, 1.5, 2.0 ):
+    ...     counter.Tick( now )
+    Test: 2.0 frames/s
+    """
+    def __init__( self, period=2.0, name="Live Viewer", file=stderr, status=None ):
+        self.period = period
+        self.status = status
+        self.name = name
+        self.file = file
+        self.start = None
+        self.frames = 0
+        self.fps = None
+
+    def Tick( self, now=None ):
+        now = time.perf_counter() if now is None else now
+        if self.start is None:
+            self.start = now
+            return
+        self.frames += 1
+        if now-self.start>=self.period:
+            self.fps = self.frames/( now-self.start )
+            if self.file:
+                status = ", "+self.status() if self.status else ""
+                print( f"{self.name}: {self.fps:.1f} frames/s{status}", file=self.file, flush=True )
+            self.start = now
+            self.frames = 0
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
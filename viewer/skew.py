@@ -4,6 +4,7 @@ from sys import stdin, stderr, argv, exit
 from numpy import array, float64, mean, std
 from matplotlib.pyplot import xkcd, plot, ylabel, show, ylim, xticks, grid
 from matplotlib.pyplot import xlim, xticks
+import numpy as np
 
 
 DIFFNONE=-1
@@ -17,100 +18,216 @@ def _Style( c ):
     return { 'color':C[ c%len(C) ], 'marker':'x', 'linestyle':'-' }
 
 
-from argparse import ArgumentParser
-
-parser = ArgumentParser()
-grpSignal = parser.add_mutually_exclusive_group()
-grpSignal.add_argument( "--signal-period", "-sp", nargs=None, type=float )
-grpSignal.add_argument( "--signal-frequency", "-sf", nargs=None, type=float )
-grpDiff = parser.add_mutually_exclusive_group()
-grpDiff.add_argument( "--diff-with-zero",  "-d0", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-one",   "-d1", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-two",   "-d2", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-three", "-d3", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-four",  "-d4", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-five",  "-d5", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-six",   "-d6", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-seven", "-d7", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-mean",  "-dm", default=False, action='store_true' )
-grpDiff.add_argument( "--diff-with-median", "-dd", default=False, action='store_true' )
-parser.add_argument( "--picoseconds", "-ps", default=False, action='store_true' )
-parser.add_argument( "--vertical-range", "-vr", type=float )
-
-args = parser.parse_args()
-
-if   args.diff_with_zero:   showDiff = DIFFZERO
-elif args.diff_with_one:    showDiff = DIFFZERO+1
-elif args.diff_with_two:    showDiff = DIFFZERO+2
-elif args.diff_with_three:  showDiff = DIFFZERO+3
-elif args.diff_with_four:   showDiff = DIFFZERO+4
-elif args.diff_with_five:   showDiff = DIFFZERO+5
-elif args.diff_with_six:    showDiff = DIFFZERO+6
-elif args.diff_with_seven:  showDiff = DIFFZERO+7
-elif args.diff_with_mean:   showDiff = DIFFMEAN
-elif args.diff_with_median: showDiff = DIFFDIV2
-else:                       showDiff = DIFFNONE
-
-unit = 1.0
-if args.picoseconds:
-    unit = 1e12
-
-if   args.signal_period:    signalPeriod = unit*args.signal_period
-elif args.signal_frequency: signalPeriod = unit/args.signal_frequency
-else:                       signalPeriod = None
-halfSignalPeriod = signalPeriod/2.0 if signalPeriod else None
-
-#xkcd()
-
-delays = None
-for line in stdin:
-    line = line.strip()
-    if len(line)<1 or line[1]=='#':
-        continue
-    dd = list( map( float, line.split() ) )
-    # First check if values of a same line are not too far apart
+def ReadChunks( lines, size=65536 ):
+    """ Parses lines of delays into 2-D arrays of at most size rows. Empty lines
+        and comments are skipped.
+
+    >>> [chunk.tolist() for chunk in ReadChunks( ["1 2", "# comment", "", "3 4", "5 6"], size=2 )]
+    [[[1.0, 2.0], [3.0, 4.0]], [[5.0, 6.0]]]
+    """
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if len( line )<1 or line[0]=='#':
+            continue
+        chunk.append( line )
+        if len( chunk )>=size:
+            yield _ParseChunk( chunk )
+            chunk = []
+    if chunk:
+        yield _ParseChunk( chunk )
+
+
+def _ParseChunk( chunk ):
+    values = np.array( " ".join( chunk ).split(), dtype=float64 )
+    if values.size % len( chunk ):
+        raise RuntimeError( "ERROR: Lines do not have the same number of delays." )
+    return values.reshape( len( chunk ), -1 )
+
+
+def WrapDelays( delays, signalPeriod ):
+    """ Brings, in place, the delays of each line within half a period of the first one.
+
+    >>> print( WrapDelays( np.array( [[1.0, 9.5, 2.0], [0.0, 7.0, -4.5]] ), 10.0 ) )
+    [[ 1.  -0.5  2. ]
+     [ 0.  -3.  -4.5]]
+    """
     if signalPeriod:
-        refDelay = dd[0]
-        for i, delay in enumerate( dd[1:] ):
-            diff = delay-refDelay
-            diff = ( ( diff+halfSignalPeriod )% signalPeriod )-halfSignalPeriod
-            dd[i+1] = refDelay+diff
-    # Calculate the mean/avg according to choice
+        half = signalPeriod/2.0
+        refDelay = delays[:, :1]
+        delays[:, 1:] = refDelay + ( ( delays[:, 1:]-refDelay+half ) % signalPeriod ) - half
+    return delays
+
+
+def ReferenceDelays( delays, showDiff ):
+    """ Returns the reference delay of each line, according to showDiff.
+
+    >>> delays = np.array( [[1.0, 2.0, 6.0]] )
+    >>> [ReferenceDelays( delays, mode ).tolist() for mode in ( DIFFNONE, DIFFZERO+1, DIFFMEAN, DIFFDIV2 )]
+    [[0.0], [2.0], [3.0], [3.5]]
+    """
     if showDiff>=DIFFZERO and showDiff<DIFFMEAN:
-        dm = dd[showDiff-DIFFZERO]
+        return delays[:, showDiff-DIFFZERO]
     elif showDiff==DIFFMEAN:
-        dm = mean( dd )
+        return delays.mean( axis=1 )
     elif showDiff==DIFFDIV2:
-        dm = ( max( dd )+min( dd ) )/2
-    else:
-        dm = 0.0
-    # Calculate delays
-    if not delays:
-        delays = [[] for _ in dd]
-    for i, d in enumerate( dd ):
-        diff = d-dm
-        delays[i].append( diff )
-
-if not delays:
-    print( "ERROR: No data.", file=stderr )
-    exit( 1 )
-
-print( " ".join( [ str( mean(d) ) for d in delays ] ) )
-print( " ".join( [ str( std(d) ) for d in delays ] ) )
-
-minval =  10e10
-maxval = -10e10
-for c, d in enumerate( delays ):
-    minval = min( minval, *d )
-    maxval = max( maxval, *d )
-    plot( d, **_Style( c ) )
-meanval = 0#( minval+maxval )/2
-if args.vertical_range:
-    vr = args.vertical_range
-    ylim( -vr/2, vr/2 )
-#ylim( meanval-75.0e-12, meanval+75.0e-12 )
-#xlim( 0, 12500 )
-#xticks( range( 0, 12501, 2500 ) )
-grid( True )
-show()
-
+        return ( delays.max( axis=1 )+delays.min( axis=1 ) )/2
+    return np.zeros( len( delays ) )
+
+
+class SkewStatistics:
+    """ Online mean and standard deviation of each column.
+
+    >>> stats = SkewStatistics()
+    >>> data = np.arange( 20.0 ).reshape( 10, 2 )
+    >>> stats.Add( data[:3] )
+    >>> stats.Add( data[3:] )
+    >>> print( stats.count, stats.Mean(), stats.Std(), np.std( data, axis=0 ) )
+    10 [ 9. 10.] [5.74456265 5.74456265] [5.74456265 5.74456265]
+    """
+    def __init__( self ):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def Add( self, diffs ):
+        n = len( diffs )
+        if n==0:
+            return
+        mean = diffs.mean( axis=0 )
+        m2 = ( ( diffs-mean )**2 ).sum( axis=0 )
+        if self.count==0:
+            self.count, self.mean, self.m2 = n, mean, m2
+            return
+        # Chan et al. merge of the two sets
+        total = self.count+n
+        delta = mean-self.mean
+        self.mean = self.mean + delta*n/total
+        self.m2 = self.m2 + m2 + delta**2*self.count*n/total
+        self.count = total
+
+    def Mean( self ):
+        return self.mean
+
+    def Std( self ):
+        return np.sqrt( self.m2/self.count )
+
+
+class Decimator:
+    """ Keeps at most 2*points lines of the diffs, for plotting. When full, every
+        other line is dropped, and the step between kept lines doubles.
+
+    >>> deci = Decimator( points=4 )
+    >>> deci.Add( np.arange( 20.0 ).reshape( 20, 1 ) )
+    >>> print( deci.indexes, deci.step )
+    [ 0  4  8 12 16] 4
+    """
+    def __init__( self, points=10000 ):
+        self.points = points
+        self.step = 1
+        self.count = 0
+        self.indexes = np.zeros( 0, dtype=np.int64 )
+        self.values = None
+
+    def Add( self, diffs ):
+        indexes = np.arange( self.count, self.count+len( diffs ) )
+        keep = indexes % self.step==0
+        self.indexes = np.concatenate( ( self.indexes, indexes[keep] ) )
+        self.values = diffs[keep] if self.values is None else np.concatenate( ( self.values, diffs[keep] ) )
+        self.count += len( diffs )
+        while len( self.indexes )>2*self.points:
+            self.step *= 2
+            keep = self.indexes % self.step==0
+            self.indexes = self.indexes[keep]
+            self.values = self.values[keep]
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    grpSignal = parser.add_mutually_exclusive_group()
+    grpSignal.add_argument( "--signal-period", "-sp", nargs=None, type=float )
+    grpSignal.add_argument( "--signal-frequency", "-sf", nargs=None, type=float )
+    grpDiff = parser.add_mutually_exclusive_group()
+    grpDiff.add_argument( "--diff-with-zero",  "-d0", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-one",   "-d1", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-two",   "-d2", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-three", "-d3", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-four",  "-d4", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-five",  "-d5", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-six",   "-d6", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-seven", "-d7", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-mean",  "-dm", default=False, action='store_true' )
+    grpDiff.add_argument( "--diff-with-median", "-dd", default=False, action='store_true' )
+    parser.add_argument( "--picoseconds", "-ps", default=False, action='store_true' )
+    parser.add_argument( "--vertical-range", "-vr", type=float )
+    parser.add_argument( "--chunk-lines", "-cl", type=int, default=65536 )
+    parser.add_argument( "--summary-every", "-se", type=int, default=None, help="Print the means and standard deviations every N lines." )
+    parser.add_argument( "--plot-points", "-pp", type=int, default=10000, help="Maximum number of points plotted per channel." )
+    parser.add_argument( "--no-plot", "-np", default=False, action='store_true' )
+
+    args = parser.parse_args()
+
+    if   args.diff_with_zero:   showDiff = DIFFZERO
+    elif args.diff_with_one:    showDiff = DIFFZERO+1
+    elif args.diff_with_two:    showDiff = DIFFZERO+2
+    elif args.diff_with_three:  showDiff = DIFFZERO+3
+    elif args.diff_with_four:   showDiff = DIFFZERO+4
+    elif args.diff_with_five:   showDiff = DIFFZERO+5
+    elif args.diff_with_six:    showDiff = DIFFZERO+6
+    elif args.diff_with_seven:  showDiff = DIFFZERO+7
+    elif args.diff_with_mean:   showDiff = DIFFMEAN
+    elif args.diff_with_median: showDiff = DIFFDIV2
+    else:                       showDiff = DIFFNONE
+
+    unit = 1.0
+    if args.picoseconds:
+        unit = 1e12
+
+    if   args.signal_period:    signalPeriod = unit*args.signal_period
+    elif args.signal_frequency: signalPeriod = unit/args.signal_frequency
+    else:                       signalPeriod = None
+
+    #xkcd()
+
+    stats = SkewStatistics()
+    decimated = Decimator( args.plot_points )
+    chunkLines = min( args.chunk_lines, args.summary_every ) if args.summary_every else args.chunk_lines
+    nextSummary = args.summary_every
+    for dd in ReadChunks( stdin, chunkLines ):
+        # First check if values of a same line are not too far apart
+        WrapDelays( dd, signalPeriod )
+        # Calculate delays
+        diffs = dd - ReferenceDelays( dd, showDiff )[:, None]
+        stats.Add( diffs )
+        if not args.no_plot:
+            decimated.Add( diffs )
+        if nextSummary and stats.count>=nextSummary:
+            print( " ".join( [ str( m ) for m in stats.Mean() ] ) )
+            print( " ".join( [ str( s ) for s in stats.Std() ] ), flush=True )
+            nextSummary += args.summary_every
+
+    if stats.count==0:
+        print( "ERROR: No data.", file=stderr )
+        exit( 1 )
+
+    print( " ".join( [ str( m ) for m in stats.Mean() ] ) )
+    print( " ".join( [ str( s ) for s in stats.Std() ] ) )
+
+    if args.no_plot:
+        return
+    for c in range( decimated.values.shape[1] ):
+        plot( decimated.indexes, decimated.values[:, c], **_Style( c ) )
+    if args.vertical_range:
+        vr = args.vertical_range
+        ylim( -vr/2, vr/2 )
+    #ylim( meanval-75.0e-12, meanval+75.0e-12 )
+    #xlim( 0, 12500 )
+    #xticks( range( 0, 12501, 2500 ) )
+    grid( True )
+    show()
+
+
+if __name__=="__main__":
+    main()
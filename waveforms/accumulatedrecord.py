@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 
-from numpy import int16, int32, array, zeros, resize, fromfunction, sqrt, arctan2
+from numpy import int16, int32, int64, float64, array, zeros, resize, fromfunction, sqrt, arctan2
 from sys import stderr
 from waveforms.trace import ReadTrace
 
@@ -124,8 +124,10 @@ class _AccSubWaveform:
 
     @property
     def Samples( self ):
-        first = self.mwfm[self.index].FirstValidSample
-        actual = self.mwfm[self.index].ActualSamples
+        if hasattr( self.mwfm, 'SampleArray' ):
+            first = self.mwfm.FirstValidPoint[self.index]
+            actual = self.mwfm.ActualPoints[self.index]
+            return self.mwfm.SampleArray[first:first+actual]
         return self.mwfm[self.index].Samples
 
 
@@ -148,11 +150,11 @@ class _AccSubRecord:
 
     @property
     def ActualPoints( self ):
-        return self.mrec.mwfms[0][self.index].ActualSamples
+        return self[0].ActualPoints
 
     @property
     def ActualSamples( self ):
-        return self.mrec.mwfms[0][self.index].ActualSamples
+        return self[0].ActualPoints
 
     @property
     def ActualAverages( self ):
@@ -160,7 +162,7 @@ class _AccSubRecord:
 
     @property
     def InitialXOffset( self ):
-        return self.mrec.mwfms[0][0].InitialXOffset#[self.index]
+        return self[0].InitialXOffset
 
     @property
     def InitialXTimeSeconds( self ):
@@ -172,10 +174,16 @@ class _AccSubRecord:
 
     @property
     def XIncrement( self ):
-        return self.mrec.mwfms[0][0].XIncrement
+        return self[0].XIncrement
 
     @property
     def SampleType( self ):
+        # Host averages are accumulated in int64, or in float64 for samples in volts.
+        array = getattr( self.mrec.mwfms[0], 'SampleArray', None )
+        if array is not None and array.dtype==int64:
+            return "Int64"
+        if array is not None and array.dtype==float64:
+            return "Real64"
         return "Int32"
 
 
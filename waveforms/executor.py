@@ -0,0 +1,341 @@
+#!/usr/bin/python3
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from numpy import ndarray
+from copy import copy
+import pickle
+import atexit
+
+
+""" The executor module runs per-record filters on a pool of processes.
+
+    Records are independent from each other, so a filter can compute them in
+    parallel as long as the results are written in input order. ProcessRecords
+    sends records, or chunks of records, to the pool, keeps a bounded number
+    of them in flight, and yields the results in the same order as the input.
+
+    Arrays larger than a threshold do not go through pickle. They are copied
+    into a shared memory block, and only the name of the block is sent to the
+    other process, which maps it as a numpy array.
+
+    for result in ProcessRecords( function, ReadTrace( stdin ), jobs=4 ):
+        print( result )
+
+"""
+
+
+SHARED_THRESHOLD = 256*1024
+
+# Shared blocks created by this process and not yet unlinked.
+_Created = set()
+
+
+@atexit.register
+def _UnlinkCreated():
+    for name in list( _Created ):
+        try:
+            block = SharedMemory( name=name )
+            block.close()
+            block.unlink()
+        except FileNotFoundError:
+            pass
+    _Created.clear()
+
+
+class _SharedArray:
+    """ Picklable reference to a numpy array stored in a shared memory block.
+
+    >>> from numpy import arange
+    >>> shared = _SharedArray( arange( 8 ) )
+    >>> other = pickle.loads( pickle.dumps( shared ) )
+    >>> print( other.Attach() )
+    [0 1 2 3 4 5 6 7]
+    >>> other.Release()
+    >>> shared.Release( unlink=True )
+    """
+    def __init__( self, array ):
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self._shm = SharedMemory( create=True, size=max( 1, array.nbytes ) )
+        self.name = self._shm.name
+        _Created.add( self.name )
+        ndarray( self.shape, dtype=self.dtype, buffer=self._shm.buf )[...] = array
+
+    def __getstate__( self ):
+        return ( self.name, self.shape, self.dtype )
+
+    def __setstate__( self, state ):
+        self.name, self.shape, self.dtype = state
+        self._shm = None
+
+    def Attach( self ):
+        """ Maps the shared block and returns it as an array. The array is valid until Release. """
+        if self._shm is None:
+            self._shm = SharedMemory( name=self.name )
+        return ndarray( self.shape, dtype=self.dtype, buffer=self._shm.buf )
+
+    def Release( self, unlink=False ):
+        if self._shm is None:
+            if not unlink:
+                return
+            try:
+                self._shm = SharedMemory( name=self.name )
+            except FileNotFoundError:
+                _Created.discard( self.name )
+                return
+        try:
+            self._shm.close()
+        except BufferError:
+            # Some arrays still use the mapping, it is closed when they are released.
+            pass
+        if unlink:
+            try: self._shm.unlink()
+            except FileNotFoundError: pass
+            _Created.discard( self.name )
+        self._shm = None
+
+
+def _Export( obj, threshold, shared, memo ):
+    """ Returns a copy of obj where large arrays are replaced by _SharedArray.
+        The _SharedArray created are appended to shared.
+    """
+    if id( obj ) in memo:
+        return memo[id( obj )]
+    if isinstance( obj, ndarray ):
+        result = obj
+        if obj.nbytes>=threshold:
+            result = _SharedArray( obj )
+            shared.append( result )
+    elif isinstance( obj, tuple ):
+        result = tuple( _Export( o, threshold, shared, memo ) for o in obj )
+    elif isinstance( obj, list ):
+        result = [_Export( o, threshold, shared, memo ) for o in obj]
+    elif isinstance( obj, dict ):
+        result = { k: _Export( v, threshold, shared, memo ) for k, v in obj.items() }
+    elif hasattr( obj, '__dict__' ) and not isinstance( obj, type ) and not callable( obj ):
+        result = copy( obj )
+        memo[id( obj )] = result
+        for key, value in vars( obj ).items():
+            setattr( result, key, _Export( value, threshold, shared, memo ) )
+    else:
+        result = obj
+    memo[id( obj )] = result
+    return result
+
+
+def _Import( obj, attached, memo ):
+    """ Replaces in place the _SharedArray of obj by the arrays they refer to.
+        The _SharedArray attached are appended to attached.
+    """
+    if id( obj ) in memo:
+        return memo[id( obj )]
+    if isinstance( obj, _SharedArray ):
+        result = obj.Attach()
+        attached.append( obj )
+    elif isinstance( obj, tuple ):
+        result = tuple( _Import( o, attached, memo ) for o in obj )
+    elif isinstance( obj, list ):
+        obj[:] = [_Import( o, attached, memo ) for o in obj]
+        result = obj
+    elif isinstance( obj, dict ):
+        for key, value in obj.items():
+            obj[key] = _Import( value, attached, memo )
+        result = obj
+    elif hasattr( obj, '__dict__' ) and not isinstance( obj, type ) and not callable( obj ):
+        memo[id( obj )] = obj
+        for key, value in vars( obj ).items():
+            setattr( obj, key, _Import( value, attached, memo ) )
+        result = obj
+    else:
+        result = obj
+    memo[id( obj )] = result
+    return result
+
+
+def _Materialize( obj, memo ):
+    """ Same as _Import, but copies the shared arrays so that they can be unlinked. """
+    if id( obj ) in memo:
+        return memo[id( obj )]
+    if isinstance( obj, _SharedArray ):
+        result = obj.Attach().copy()
+        obj.Release( unlink=True )
+    elif isinstance( obj, tuple ):
+        result = tuple( _Materialize( o, memo ) for o in obj )
+    elif isinstance( obj, list ):
+        obj[:] = [_Materialize( o, memo ) for o in obj]
+        result = obj
+    elif isinstance( obj, dict ):
+        for key, value in obj.items():
+            obj[key] = _Materialize( value, memo )
+        result = obj
+    elif hasattr( obj, '__dict__' ) and not isinstance( obj, type ) and not callable( obj ):
+        memo[id( obj )] = obj
+        for key, value in vars( obj ).items():
+            setattr( obj, key, _Materialize( value, memo ) )
+        result = obj
+    else:
+        result = obj
+    memo[id( obj )] = result
+    return result
+
+
+def Share( obj, threshold=SHARED_THRESHOLD ):
+    """ Returns a picklable copy of obj, where the arrays larger than threshold
+        bytes are stored in shared memory, and the list of shared blocks to
+        release once the other process is done.
+    """
+    shared = []
+    return _Export( obj, threshold, shared, {} ), shared
+
+
+def Unshare( obj ):
+    """ Returns obj with its shared arrays copied back to private memory, and
+        their blocks unlinked.
+    """
+    return _Materialize( obj, {} )
+
+
+def _RunChunk( function, chunk, threshold ):
+    """ Runs in the worker process: maps the shared inputs, computes the results,
+        and sends them back, large arrays through shared memory.
+    """
+    attached = []
+    records = _Import( chunk, attached, {} )
+    results = [function( record ) for record in records]
+    results, shared = Share( results, threshold )
+    # Pickle here, while the input blocks are still mapped
+    data = pickle.dumps( results, protocol=pickle.HIGHEST_PROTOCOL )
+    del results, records
+    for block in attached:
+        block.Release()
+    for block in shared:
+        block.Release()
+        # The parent process unlinks the result blocks.
+        _Created.discard( block.name )
+    return data
+
+
+def _Chunks( records, size ):
+    chunk = []
+    for record in records:
+        chunk.append( record )
+        if len( chunk )>=size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ProcessRecords( function, records, jobs=1, window=None, chunk=1, threshold=SHARED_THRESHOLD ):
+    """ Applies function to every record, and yields the results in input order.
+
+        function must be picklable, that is defined at the top level of a
+        module. Use functools.partial to give it extra arguments.
+        jobs is the number of worker processes. With one job, or less, the
+        records are processed in the current process.
+        window is the maximum number of chunks in flight, default is twice
+        the number of jobs.
+        chunk is the number of records sent at once to a worker.
+        threshold is the size in bytes above which arrays go through shared
+        memory instead of being pickled.
+
+    >>> from math import sqrt
+    >>> list( ProcessRecords( sqrt, [1, 4, 9] ) )
+    [1.0, 2.0, 3.0]
+    >>> list( ProcessRecords( sqrt, range( 100 ), jobs=2, chunk=7 ) )==[sqrt( n ) for n in range( 100 )]
+    True
+    >>> from numpy import arange, sum
+    >>> [int( s ) for s in ProcessRecords( sum, [arange( n ) for n in range( 5 )], jobs=2, threshold=0 )]
+    [0, 0, 1, 3, 6]
+    """
+    if not jobs or jobs<=1:
+        for record in records:
+            yield function( record )
+        return
+
+    window = window if window and window>0 else 2*jobs
+    pending = deque()
+    pool = ProcessPoolExecutor( max_workers=jobs )
+    try:
+        for batch in _Chunks( records, max( 1, chunk ) ):
+            shared, blocks = Share( batch, threshold )
+            pending.append( ( pool.submit( _RunChunk, function, shared, threshold ), blocks ) )
+            while len( pending )>=window:
+                future, blocks = pending.popleft()
+                yield from _Collect( future, blocks )
+        while pending:
+            future, blocks = pending.popleft()
+            yield from _Collect( future, blocks )
+    finally:
+        for future, blocks in pending:
+            future.cancel()
+        pool.shutdown( wait=True, cancel_futures=True )
+        for future, blocks in pending:
+            # Results already computed may hold shared blocks as well.
+            try:
+                _Collect( future, blocks )
+            except BaseException:
+                pass
+
+
+def _Collect( future, blocks ):
+    try:
+        results = pickle.loads( future.result() )
+    finally:
+        for block in blocks:
+            block.Release( unlink=True )
+    return Unshare( results )
+
+
+def Submit( pool, function, record, threshold=SHARED_THRESHOLD ):
+    """ Submits function( record ) to a ProcessPoolExecutor, large arrays going
+        through shared memory. The result is read with Result, or thrown away
+        with Discard, so that the shared blocks are released.
+
+    >>> from numpy import arange, sum
+    >>> with ProcessPoolExecutor( max_workers=1 ) as pool:
+    ...     print( Result( Submit( pool, sum, arange( 5 ), threshold=0 ) ) )
+    10
+    """
+    shared, blocks = Share( [record], threshold )
+    future = pool.submit( _RunChunk, function, shared, threshold )
+    future.blocks = blocks
+    return future
+
+
+def Result( future ):
+    """ Returns the result of a future from Submit. """
+    return _Collect( future, future.blocks )[0]
+
+
+def _Release( future ):
+    try:
+        Result( future )
+    except BaseException:
+        pass
+
+
+def Discard( future ):
+    """ Cancels a future from Submit, or ignores its result if it is already running. """
+    future.cancel()
+    future.add_done_callback( _Release )
+
+
+def AddJobsArguments( parser ):
+    """ Adds to an ArgumentParser the options used by ProcessRecordsArgs. """
+    parser.add_argument( "--jobs", "-j",           type=int, default=1,    help="Number of worker processes." )
+    parser.add_argument( "--jobs-window", "-jw",   type=int, default=None, help="Maximum number of chunks in flight." )
+    parser.add_argument( "--jobs-chunk", "-jc",    type=int, default=1,    help="Number of records sent at once to a worker." )
+
+
+def ProcessRecordsArgs( function, records, args ):
+    """ ProcessRecords using the options added by AddJobsArguments. """
+    return ProcessRecords( function, records, jobs=args.jobs, window=args.jobs_window, chunk=args.jobs_chunk )
+
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+
+from waveforms.accumulatedrecord import AccMultiRecord
+from waveforms.summary import ChannelRows
+from waveforms.trace import OutputTrace, OutputTraces
+import numpy as np
+
+
+""" The hostaverage module averages the records of successive acquisitions
+    on the host.
+
+    The AVG mode depends on a firmware option, and the DGT mode can only
+    average by piping the records to external tools. HostAverager sums the
+    samples of the records of averages acquisitions in int64 arrays, one row
+    per record, and returns an AccMultiRecord of the sums, with ActualAverages
+    the number of acquisitions summed. As in the AVG mode, the sums are of
+    ADC codes: the MSB-justified samples of the DGT mode are shifted right to
+    NbrAdcBits before they are summed, and the ScaleFactor is scaled back:
+
+    averager = HostAverager( averages=100 )
+    for mrec in acquisitions:
+        acc = averager.Add( mrec )
+        if acc:
+            OutputTraces( acc, stdout )
+
+    With --host-average N, the runners put the acquisitions to the output
+    sink through HostAverager.PutTo: with a --pipeline-depth, the sums are
+    computed on the writer thread, while the next acquisition runs.
+
+"""
+
+
+class HostAverager:
+    """ Sums the samples of the records of averages acquisitions.
+
+        The sums of each channel are a 2-D int64 array, or float64 for
+        samples in volts, allocated at the first acquisition, to which the
+        next ones are added in place. The InitialXOffset and timestamps of the
+        result are the ones of the first acquisition. A change in the shape
+        of the acquisitions starts a new average.
+
+    >>> from waveforms import MultiRecord
+    >>> averager = HostAverager( 3 )
+    >>> for value in ( 1, 2, 4 ):
+    ...     samples = 16*np.array( [0, value, 2*value, 0, 0, 3*value, 4*value, 0], dtype=np.int16 )
+    ...     acc = averager.Add( MultiRecord( ( samples, 8, 2, [2, 2], [1, 5], [0.0, 0.0], [1.0, 1.0], [0.1, 0.2], 1e-9, 0.5, 0.0 ), nbrAdcBits=12 ) )
+    >>> print( acc.ActualAverages, acc[1][0].Samples, acc[1].SampleType, acc[1].InitialXTimeFraction, acc[1][0].ScaleFactor )
+    3 [21 28] Int64 0.2 8.0
+    >>> print( averager.count, averager.sums )
+    0 None
+
+        Samples read in volts are summed in float64:
+
+    >>> averager = HostAverager( 2 )
+    >>> for value in ( 0.25, 0.5 ):
+    ...     samples = np.array( [0.0, value, -value, 0.0, 0.0, 2*value, value, 0.0] )
+    ...     acc = averager.Add( MultiRecord( ( samples, 8, 2, [2, 2], [1, 5], [0.0, 0.0], [1.0, 1.0], [0.1, 0.2], 1e-9 ), nbrAdcBits=12 ) )
+    >>> print( acc[0][0].Samples, acc[1][0].Samples, acc[1].SampleType, acc[1][0].ScaleFactor )
+    [ 0.75 -0.75] [1.5  0.75] Real64 1.0
+
+        The same acquisitions averaged by the firmware:
+
+    >>> fw = AccMultiRecord( ( np.array( [0, 7, 14, 0, 0, 21, 28, 0], dtype=np.int32 ), 3, 2, [2, 2], [1, 5], 0.0, [1.0, 1.0], [0.1, 0.2], 1e-9, 8.0, 0.0, [0, 0] ), nbrAdcBits=12 )
+    >>> print( fw[1][0].Samples, fw[1][0].ScaleFactor, fw.NbrAdcBits==acc.NbrAdcBits )
+    [21 28] 8.0 True
+    """
+    def __init__( self, averages=1 ):
+        self.averages = averages
+        self.Reset()
+
+    def Reset( self ):
+        """ Drops the sums of the acquisitions added. """
+        self.count = 0
+        self.sums = None
+        self.first = None
+        self.shift = 0
+
+    def Add( self, mrec ):
+        """ Adds the samples of mrec to the sums. Returns the AccMultiRecord
+            of the sums when averages acquisitions are summed, else None.
+        """
+        rows = ChannelRows( mrec )
+        if self.sums is None or [s.shape for s in self.sums]!=[r.shape for r in rows]:
+            self.sums = [r.astype( np.float64 if r.dtype.kind=='f' else np.int64 ) for r in rows]
+            self.count = 1
+            self.first = mrec
+            self.shift = _Shift( rows[0], getattr( mrec, 'NbrAdcBits', None ) )
+            if self.shift:
+                for sums in self.sums:
+                    np.right_shift( sums, self.shift, out=sums )
+        else:
+            for sums, row in zip( self.sums, rows ):
+                np.add( sums, row>>self.shift if self.shift else row, out=sums )
+            self.count += 1
+        if self.count<self.averages:
+            return None
+        acc = self.Record()
+        self.Reset()
+        return acc
+
+    def Record( self ):
+        """ Returns the AccMultiRecord of the sums. The arrays of sums are
+            used by the record, not copied.
+        """
+        records = list( self.first ) if hasattr( self.first, 'ActualRecords' ) else [self.first]
+        acc = AccMultiRecord( checkXOffset=False, nbrAdcBits=getattr( self.first, 'NbrAdcBits', None ) )
+        for channel, sums in enumerate( self.sums ):
+            nbrRecords, points = sums.shape
+            wfm = records[0][channel]
+            acc.append( ( sums.reshape( -1 ), self.count, nbrRecords, [points]*nbrRecords, [r*points for r in range( nbrRecords )],
+                          wfm.InitialXOffset, [rec.InitialXTimeSeconds for rec in records], [rec.InitialXTimeFraction for rec in records], wfm.XIncrement,
+                          getattr( wfm, 'ScaleFactor', 1.0 )*2**self.shift, getattr( wfm, 'ScaleOffset', 0.0 ), [0]*nbrRecords ) )
+        return acc
+
+    def Put( self, mrec, file, output ):
+        """ Adds mrec, and writes the average with output( acc, file ) when
+            complete. It is to be put to an OutputSink, after the records of
+            the previous acquisitions.
+        """
+        acc = self.Add( mrec )
+        if acc is not None:
+            output( acc, file )
+
+    def PutTo( self, sink, mrec, output ):
+        """ Puts output( mrec, sink.file ) to sink, or Put when averages is
+            more than 1. The average is a multi-record: it is output with
+            OutputTraces instead of OutputTrace. Returns False when the
+            output of sink is broken.
+
+        >>> from io import StringIO
+        >>> from waveforms.sink import OutputSink
+        >>> from waveforms import MultiRecord
+        >>> sink = OutputSink( StringIO(), length=0 )
+        >>> averager = HostAverager( averages=2 )
+        >>> mrec = MultiRecord( ( np.arange( 4, dtype=np.int16 ), 4, 1, [4], [0], [0.0], [1.0], [0.0], 1e-9 ) )
+        >>> print( [averager.PutTo( sink, mrec, OutputTraces ) for loop in range( 2 )], averager.count, sink.written )
+        [True, True] 0 2
+        """
+        if self.averages<=1:
+            return sink.Put( output, mrec, sink.file )
+        return sink.Put( self.Put, mrec, sink.file, OutputTraces if output is OutputTrace else output )
+
+
+def _Shift( row, nbrAdcBits ):
+    """ Number of bits the integer samples of row are MSB-justified by. """
+    if not nbrAdcBits or row.dtype.kind!='i':
+        return 0
+    return max( 8*row.dtype.itemsize-nbrAdcBits, 0 )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -63,6 +63,12 @@ class _MultiWaveform():
             self.ScaleFactor      = 1.0
             self.ScaleOffset      = 0.0
 
+    def __len__( self ):
+        return self.ActualRecords
+
+    def __getitem__( self, index ):
+        return _SubWaveform( self, index )
+
 
 class _SubWaveform:
     def __init__( self, mwfm, index ):
@@ -139,25 +145,25 @@ class _SubRecord:
     @property
     def ActualPoints( self ):
         try:
-            return self.mrec.mwfms[0][self.index].ActualPoints
+            return self[0].ActualPoints
         except:
-            return self.mrec.mwfms[0][self.index].ActualSamples
+            return self[0].ActualSamples
 
     @property
     def InitialXOffset( self ):
-        return self.mrec.mwfms[0][self.index].InitialXOffset
+        return self[0].InitialXOffset
 
     @property
     def InitialXTimeSeconds( self ):
-        return self.mrec.mwfms[0][self.index].InitialXTimeSeconds
+        return self[0].InitialXTimeSeconds
 
     @property
     def InitialXTimeFraction( self ):
-        return self.mrec.mwfms[0][self.index].InitialXTimeFraction
+        return self[0].InitialXTimeFraction
 
     @property
     def XIncrement( self ):
-        return self.mrec.mwfms[0][self.index].XIncrement
+        return self[0].XIncrement
 
     @property
     def SampleType( self ):
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+from numpy import asarray, ascontiguousarray, empty, zeros, int16, int32, uint16, uint32
+from math import gcd
+
+
+""" The packed module converts the packed samples of the stream elements.
+
+    With data truncation, the digitizer packs samples of N bits in the 32-bit
+    elements of a stream, from the least significant bit of the first element
+    on. A group of N/gcd(N,32) elements holds 32/gcd(N,32) samples: 8 samples
+    in 3 elements for 12 bits.
+
+    UnpackSamples converts them to int16, a column of samples of the groups
+    at a time, so that numpy does the work for all the groups at once:
+
+    samples = UnpackSamples( elements, 12 )
+
+    The samples are justified to the 16 bits of int16 by default, the way the
+    digitizer delivers its samples, or sign extended.
+
+"""
+
+
+# Groups unpacked at a time, so that the temporary columns stay in the cache.
+_BLOCK = 16384
+
+
+def _Layout( bits ):
+    """ Returns the number of elements, and of samples, of a group. """
+    if not 1<=bits<=16:
+        raise RuntimeError( "ERROR: Packed samples of "+str( bits )+" bits are not supported." )
+    return bits//gcd( bits, 32 ), 32//gcd( bits, 32 )
+
+
+def _UnpackGroups( words, bits, samples, justify ):
+    """ Unpacks the 2D array of uint32 words, one group per row, into the 2D
+        array of int16 samples.
+    """
+    mask = ( 1<<bits )-1
+    shift = 16-bits
+    for k in range( samples.shape[1] ):
+        w, o = divmod( k*bits, 32 )
+        value = words[:, w] >> o
+        if o+bits>32:
+            value |= words[:, w+1] << ( 32-o )
+        value &= mask
+        value = ( value << shift ).astype( uint16 ).view( int16 )
+        samples[:, k] = value if justify else value >> shift
+
+
+def UnpackSamples( elements, bits, out=None, count=None, justify=True ):
+    """ Unpacks samples of bits bits, packed in 32-bit elements, into int16.
+
+        The samples are written to out when given, which avoids an allocation
+        for each stream fetch. Returns the unpacked samples: count of them, or
+        as many as fit in out, or as the elements hold.
+
+    >>> from numpy import array
+    >>> elements = array( [0x89abcdef, 0x01234567, 0x76543210], dtype=uint32 ).view( int32 )
+    >>> print( [hex( s ) for s in UnpackSamples( elements, 12 ).view( uint16 )] )
+    ['0xdef0', '0xabc0', '0x7890', '0x4560', '0x1230', '0x1000', '0x4320', '0x7650']
+    >>> print( UnpackSamples( elements, 12 )[:4] )
+    [ -8464 -21568  30864  17760]
+    >>> print( UnpackSamples( elements, 12, justify=False )[:4] )
+    [ -529 -1348  1929  1110]
+    >>> out = zeros( 10, dtype=int16 )
+    >>> print( len( UnpackSamples( elements, 12, out=out, count=5 ) ), out[4:7] )
+    5 [4656    0    0]
+    """
+    group, perGroup = _Layout( bits )
+    words = ascontiguousarray( elements ).view( uint32 )
+    available = ( len( words )//group )*perGroup
+    count = available if count is None else min( count, available )
+    if out is None:
+        out = empty( count, dtype=int16 )
+    count = min( count, len( out ) )
+
+    full = count//perGroup
+    words2d = words[:full*group].reshape( full, group )
+    samples2d = out[:full*perGroup].reshape( full, perGroup )
+    for start in range( 0, full, _BLOCK ):
+        _UnpackGroups( words2d[start:start+_BLOCK], bits, samples2d[start:start+_BLOCK], justify )
+    rest = count-full*perGroup
+    if rest:
+        tail = empty( ( 1, perGroup ), dtype=int16 )
+        _UnpackGroups( words[full*group:( full+1 )*group].reshape( 1, group ), bits, tail, justify )
+        out[full*perGroup:count] = tail[0, :rest]
+    return out[:count]
+
+
+def PackSamples( samples, bits, justify=True ):
+    """ Packs int16 samples in 32-bit elements, as the digitizer does. The
+        last group is completed with zeros. It is the reverse of UnpackSamples.
+
+    >>> from numpy import random, array_equal
+    >>> rng = random.default_rng( 0 )
+    >>> for bits in ( 8, 10, 12, 14, 16 ):
+    ...     samples = rng.integers( -2**( bits-1 ), 2**( bits-1 ), 1000 ).astype( int16 )
+    ...     elements = PackSamples( samples, bits, justify=False )
+    ...     assert array_equal( UnpackSamples( elements, bits, justify=False, count=len( samples ) ), samples )
+    ...     assert array_equal( UnpackSamples( elements, bits, count=len( samples ) ), samples<<( 16-bits ) )
+    >>> print( len( elements ), len( PackSamples( samples[:7], 12 ) ) )
+    500 3
+    """
+    group, perGroup = _Layout( bits )
+    samples = asarray( samples, dtype=int16 )
+    groups = -( -len( samples )//perGroup )
+    values = zeros( groups*perGroup, dtype=uint32 )
+    if justify:
+        values[:len( samples )] = samples.view( uint16 ) >> ( 16-bits )
+    else:
+        values[:len( samples )] = samples.view( uint16 ) & ( ( 1<<bits )-1 )
+    values = values.reshape( groups, perGroup )
+    words = zeros( ( groups, group ), dtype=uint32 )
+    for k in range( perGroup ):
+        w, o = divmod( k*bits, 32 )
+        words[:, w] |= values[:, k] << o
+        if o+bits>32:
+            words[:, w+1] |= values[:, k] >> ( 32-o )
+    return words.ravel().view( int32 )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,409 @@
+#!/usr/bin/python3
+
+from multiprocessing import shared_memory
+from waveforms.trace import Trace
+import numpy as np
+import time
+import weakref
+
+
+""" The shmring module passes the records from a runner to the viewers of the
+    same computer through shared memory, instead of text traces.
+
+    Text traces format every sample on the runner side, and parse it again on
+    the viewer side. A ShmRing is a ring of fixed-size slots in a block of
+    shared memory. The writer copies the samples of each record in the next
+    slot, with a small header of its properties, and the readers map the
+    samples of the slots as numpy arrays:
+
+    ring = ShmRingWriter( "digitizer", slots=16, slotBytes=1<<20 )
+    ring.WriteRecords( mrec )
+    ...
+    ring.Close()
+
+    for rec in ReadShmRing( "digitizer" ):
+        plot( rec[0].Samples )
+
+    The writer never waits for the readers. Each slot has the sequence number
+    of its record written before, and after, its samples. A reader that falls
+    behind by more than the number of slots skips the records overwritten,
+    and counts them as lost. The records read are Trace objects, as the ones
+    of ReadTrace, so that the viewers handle them the same way.
+
+    When a record does not fit in the slots, after a change of the setup, the
+    writer replaces the ring by a new one of larger slots, under the same name
+    and with the next generation number. The readers attach to it, and go on
+    with the same sequence numbers.
+
+"""
+
+
+# Properties of the ring, at the start of the shared memory.
+_HEADER = np.dtype( [( 'magic', '<u4' ), ( 'version', '<u4' ), ( 'slots', '<u8' ), ( 'slotBytes', '<u8' ), ( 'head', '<i8' ), ( 'closed', '<u8' ), ( 'generation', '<u8' )] )
+
+# Maximum number of channels of a record.
+MAX_CHANNELS = 16
+
+# Properties of the record of a slot, and of its waveforms.
+_SLOT = np.dtype( [( 'begin', '<i8' ), ( 'end', '<i8' ), ( 'channels', '<u4' ), ( 'points', '<u4' ), ( 'dtype', 'S8' ), ( 'nbrAdcBits', '<i4' ), ( 'averages', '<i4' ),
+                   ( 'xIncrement', '<f8' ), ( 'xOffset', '<f8' ), ( 'seconds', '<f8' ), ( 'fraction', '<f8' ),
+                   ( 'scaleFactor', '<f8', ( MAX_CHANNELS, ) ), ( 'scaleOffset', '<f8', ( MAX_CHANNELS, ) )] )
+
+_MAGIC = 0x52575653
+_ALIGN = 64
+
+# Values of closed in the header: no more records, or replaced by a new ring.
+_CLOSED = 1
+_REPLACED = 2
+
+# Names of the shared memories created by the writers of this process.
+_Created = set()
+
+
+def _Align( size ):
+    return ( size+_ALIGN-1 )//_ALIGN*_ALIGN
+
+
+class _ShmRing:
+    """ Views of the header, slot headers and slot samples of a shared memory. """
+    def _Map( self, shm ):
+        self.shm = shm
+        self.header = np.ndarray( (), dtype=_HEADER, buffer=shm.buf )
+        self.slots = int( self.header['slots'] )
+        self.slotBytes = int( self.header['slotBytes'] )
+        self.headers = np.ndarray( ( self.slots, ), dtype=_SLOT, buffer=shm.buf, offset=_Align( _HEADER.itemsize ) )
+        self.data = _Align( _HEADER.itemsize )+_Align( self.slots*_SLOT.itemsize )
+
+    def _Samples( self, index, channels, points, dtype ):
+        return np.ndarray( ( channels, points ), dtype=dtype, buffer=self.shm.buf, offset=self.data+index*self.slotBytes )
+
+    @property
+    def head( self ):
+        """ Sequence number of the last record written, 0 when none. """
+        return int( self.header['head'] )
+
+    @property
+    def generation( self ):
+        """ Number of rings this one replaces. """
+        return int( self.header['generation'] )
+
+
+class _Mapping:
+    """ Shared memory of a reader, unmapped once the reader is closed and
+        the samples of the records read from it are gone.
+
+    >>> ring = ShmRingWriter( "shmring-doctest", slots=2, slotBytes=64 )
+    >>> mapping = _Mapping( shared_memory.SharedMemory( name="shmring-doctest" ) )
+    >>> samples = mapping.View( np.ndarray( ( 4, ), dtype=np.int16, buffer=mapping.shm.buf ) )
+    >>> mapping.Close()
+    >>> print( mapping.views, mapping.shm.buf is None )
+    1 False
+    >>> del samples
+    >>> print( mapping.views, mapping.shm.buf is None )
+    0 True
+    >>> ring.Close()
+    """
+    def __init__( self, shm ):
+        self.shm = shm
+        self.views = 0
+        self.closed = False
+
+    def View( self, samples ):
+        """ Keeps the shared memory mapped while samples exists. """
+        self.views += 1
+        weakref.finalize( samples, self._Release )
+        return samples
+
+    def _Release( self ):
+        self.views -= 1
+        if self.closed and self.views==0:
+            self.shm.close()
+
+    def Close( self ):
+        """ Unmaps the shared memory, now or when the last samples are gone. """
+        self.closed = True
+        if self.views==0:
+            self.shm.close()
+
+
+class ShmRingWriter( _ShmRing ):
+    """ Creates a ring of slots of slotBytes bytes in the shared memory name,
+        and writes records in it.
+
+    >>> from waveforms import MultiRecord
+    >>> samples = np.array( [0, 1, 2, 3, 0, 0, 4, 5, 6, 7, 0, 0], dtype=np.int16 )
+    >>> ring = ShmRingWriter( "shmring-doctest", slots=2, slotBytes=64 )
+    >>> reader = ShmRingReader( "shmring-doctest" )
+    >>> for loop in range( 2 ):
+    ...     ring.WriteRecords( MultiRecord( ( samples, 12, 2, [4, 4], [0, 6], [0.0, 0.0], [12.0, 12.0], [0.5, 0.25], 1e-9, 0.5, 0.0 ) ) )
+    >>> rec = reader.Read()
+    >>> print( reader.head, reader.lost, rec.InitialXTimeFraction, rec[0].ScaleFactor, rec[0].Samples )
+    4 2 0.5 0.5 [0 1 2 3]
+    >>> ring.Close()
+    >>> print( reader.Read()[0].Samples, reader.Read() )
+    [4 5 6 7] None
+    >>> reader.Close()
+
+        A ring replaced by one of larger slots, while a reader reads it:
+
+    >>> ring = ShmRingWriter( "shmring-doctest", slots=2, slotBytes=64 )
+    >>> reader = ShmRingReader( "shmring-doctest" )
+    >>> ring.WriteRecords( MultiRecord( ( samples, 12, 2, [4, 4], [0, 6], [0.0, 0.0], [12.0, 12.0], [0.5, 0.25], 1e-9, 0.5, 0.0 ) ) )
+    >>> ring = ShmRingWriter( "shmring-doctest", slots=2, slotBytes=128, replace=ring )
+    >>> ring.WriteRecords( MultiRecord( ( np.arange( 40, dtype=np.int16 ), 40, 1, [40], [0], [0.0], [12.0], [0.5], 1e-9, 0.5, 0.0 ) ) )
+    >>> print( [len( reader.Read( timeout=0 )[0].Samples ) for loop in range( 3 )], reader.generation, reader.lost )
+    [4, 4, 40] 1 0
+    >>> ring.Close()
+    >>> reader.Close()
+    """
+    def __init__( self, name, slots=16, slotBytes=1<<20, replace=None ):
+        slotBytes = _Align( slotBytes )
+        size = _Align( _HEADER.itemsize )+_Align( slots*_SLOT.itemsize )+slots*slotBytes
+        if replace is not None:
+            # The readers keep the mapping of the replaced ring until they attach to this one.
+            replace.shm.unlink()
+        shm = shared_memory.SharedMemory( name=name, create=True, size=size )
+        _Created.add( name )
+        header = np.ndarray( (), dtype=_HEADER, buffer=shm.buf )
+        header['magic'], header['version'], header['slots'], header['slotBytes'], header['closed'] = _MAGIC, 1, slots, slotBytes, 0
+        header['head'] = replace.head if replace is not None else 0
+        header['generation'] = replace.generation+1 if replace is not None else 0
+        del header
+        self._Map( shm )
+        self.headers['begin'] = -1
+        self.headers['end'] = -1
+        if replace is not None:
+            replace._Close( _REPLACED )
+
+    def Write( self, rec ):
+        """ Writes the record rec, a list of waveforms, in the next slot. """
+        waves = [np.asarray( wave.Samples ) for wave in rec]
+        points = min( len( w ) for w in waves )
+        dtype = np.result_type( *waves )
+        if len( waves )>MAX_CHANNELS:
+            raise RuntimeError( "ERROR: Record of %d channels, the shared memory ring holds at most %d." % ( len( waves ), MAX_CHANNELS ) )
+        if len( waves )*points*dtype.itemsize>self.slotBytes:
+            raise RuntimeError( "ERROR: Record of %d bytes, the slots of the shared memory ring are of %d bytes." % ( len( waves )*points*dtype.itemsize, self.slotBytes ) )
+        seq = self.head+1
+        index = seq%self.slots
+        slot = self.headers[index]
+        # The readers check that the slot is not written while they read it.
+        slot['begin'] = seq
+        slot['channels'], slot['points'], slot['dtype'] = len( waves ), points, dtype.str.encode()
+        slot['nbrAdcBits'] = getattr( rec, 'NbrAdcBits', None ) or 0
+        slot['averages'] = getattr( rec, 'ActualAverages', None ) or 0
+        slot['xIncrement'] = rec.XIncrement
+        slot['xOffset'] = rec.InitialXOffset
+        slot['seconds'] = getattr( rec, 'InitialXTimeSeconds', 0.0 )
+        slot['fraction'] = getattr( rec, 'InitialXTimeFraction', 0.0 )
+        samples = self._Samples( index, len( waves ), points, dtype )
+        for channel, wave in enumerate( waves ):
+            samples[channel] = wave[:points]
+            slot['scaleFactor'][channel] = getattr( rec[channel], 'ScaleFactor', 1.0 )
+            slot['scaleOffset'][channel] = getattr( rec[channel], 'ScaleOffset', 0.0 )
+        slot['end'] = seq
+        self.header['head'] = seq
+
+    def WriteRecords( self, traces ):
+        """ Writes each record of traces, or traces when it is a single record. """
+        for rec in ( traces if hasattr( traces, 'ActualRecords' ) else [traces] ):
+            self.Write( rec )
+
+    def Close( self ):
+        """ Tells the readers that no more records are written, and removes
+            the shared memory. The readers keep their mapping.
+        """
+        self._Close( _CLOSED )
+        self.shm.unlink()
+
+    def _Close( self, closed ):
+        self.header['closed'] = closed
+        del self.header, self.headers
+        self.shm.close()
+
+
+class ShmRingReader( _ShmRing ):
+    """ Reads the records written in the shared memory name, from the next
+        one written, or from the oldest one still in the ring with oldest.
+        See ShmRingWriter.
+    """
+    def __init__( self, name, oldest=True ):
+        self.name = name
+        self._Open()
+        self.next = max( self.head-self.slots+1, 1 ) if oldest else self.head+1
+        self.lost = 0
+
+    def _Open( self ):
+        shm = shared_memory.SharedMemory( name=self.name )
+        # The writer owns the shared memory: it is not removed when the reader exits.
+        if self.name not in _Created:
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister( shm._name, "shared_memory" )
+            except Exception:
+                pass
+        self._Map( shm )
+        self.mapping = _Mapping( shm )
+        if int( self.header['magic'] )!=_MAGIC:
+            raise RuntimeError( "ERROR: Shared memory "+self.name+" is not a ring of records." )
+
+    def _Attach( self, interval, timeout=1.0 ):
+        """ Maps the ring that replaces the current one. Returns False when
+            it is not found within timeout seconds: it is closed already.
+        """
+        generation = self.generation
+        self.Close()
+        start = time.perf_counter()
+        while time.perf_counter()-start<timeout:
+            try:
+                self._Open()
+                if self.generation>generation:
+                    return True
+                self.Close()
+            except ( FileNotFoundError, ValueError ):
+                pass
+            time.sleep( interval )
+        return False
+
+    def Read( self, timeout=None, copy=False, interval=0.001 ):
+        """ Returns the next record, as a Trace, or None when the writer is
+            closed, or after timeout seconds.
+
+            With copy, the samples are copied before the slot is checked to
+            be unchanged: they are the ones of the record. Else, they map the
+            slot, and are overwritten when the writer goes around the ring,
+            even while they are used: the record can mix samples of two
+            records written in the slot.
+        """
+        start = time.perf_counter()
+        while True:
+            head = self.head
+            if self.next>head:
+                if self.header['closed']==_REPLACED and self.head==head:
+                    if self._Attach( interval ):
+                        continue
+                    return None
+                if self.header['closed'] or ( timeout is not None and time.perf_counter()-start>=timeout ):
+                    return None
+                time.sleep( interval )
+                continue
+            if head-self.next>=self.slots:
+                # Overwritten by the writer.
+                self.lost += head-self.slots+1-self.next
+                self.next = head-self.slots+1
+            seq = self.next
+            self.next += 1
+            slot = self.headers[seq%self.slots].copy()
+            if slot['begin']!=seq or slot['end']!=seq:
+                self.lost += 1
+                continue
+            trace = self._Trace( seq%self.slots, slot, copy )
+            if self.headers[seq%self.slots]['begin']!=seq:
+                # Written again while it was read.
+                self.lost += 1
+                continue
+            return trace
+
+    def _Trace( self, index, slot, copy ):
+        channels, points = int( slot['channels'] ), int( slot['points'] )
+        samples = self._Samples( index, channels, points, np.dtype( slot['dtype'].decode() ) )
+        if copy:
+            samples = samples.copy()
+        else:
+            self.mapping.View( samples )
+        trace = Trace()
+        for channel in range( channels ):
+            wave = Trace.Wave()
+            wave._Samples = samples[channel]
+            wave.ScaleFactor = float( slot['scaleFactor'][channel] )
+            wave.ScaleOffset = float( slot['scaleOffset'][channel] )
+            trace._Waves.append( wave )
+        trace.SampleType = { 'i1': "Int8", 'i2': "Int16", 'i4': "Int32", 'i8': "Int64", 'f8': "Real64" }.get( samples.dtype.str[1:], samples.dtype.name )
+        if slot['nbrAdcBits']:
+            trace.NbrAdcBits = int( slot['nbrAdcBits'] )
+        if slot['averages']:
+            trace.ActualAverages = int( slot['averages'] )
+        trace.XIncrement = float( slot['xIncrement'] )
+        trace.InitialXOffset = float( slot['xOffset'] )
+        trace.InitialXTimeSeconds = float( slot['seconds'] )
+        trace.InitialXTimeFraction = float( slot['fraction'] )
+        trace.ActualPoints = points
+        return trace
+
+    def Close( self ):
+        """ Stops reading. The shared memory stays mapped until the samples
+            of the records read are gone, it is unmapped now when they are
+            copies.
+        """
+        if self.shm is None:
+            return
+        del self.header, self.headers
+        self.mapping.Close()
+        self.shm = None
+
+
+def ReadShmRing( name, copy=False, wait=False ):
+    """ Yields the records of the shared memory ring name, as ReadTrace does
+        for a file, until its writer is closed. With wait, it waits for the
+        writer to create the ring.
+    """
+    while True:
+        try:
+            reader = ShmRingReader( name )
+            break
+        except ( FileNotFoundError, ValueError ):
+            # ValueError while the writer sizes the shared memory it created.
+            if not wait:
+                raise
+            time.sleep( 0.1 )
+    try:
+        while True:
+            trace = reader.Read( copy=copy )
+            if trace is None:
+                break
+            yield trace
+    finally:
+        reader.Close()
+
+
+class ShmRingOutput:
+    """ Output function of the runners for --output-shm. The ring is created
+        at the first records, with slots of slotBytes, or of the size of these
+        records when larger. It is replaced by a ring of larger slots when
+        records do not fit.
+    """
+    def __init__( self, name, slots=16, slotBytes=None ):
+        self.name = name
+        self.slots = slots
+        self.slotBytes = slotBytes
+        self.ring = None
+
+    def __call__( self, traces, file=None, **kwargs ):
+        records = traces if hasattr( traces, 'ActualRecords' ) else [traces]
+        size = max( sum( np.asarray( wave.Samples ).nbytes for wave in rec ) for rec in records )
+        if self.ring is None:
+            self.ring = ShmRingWriter( self.name, self.slots, max( self.slotBytes or 0, size ) )
+        elif size>self.ring.slotBytes:
+            # The setup changed: the readers attach to a ring of larger slots.
+            self.ring = ShmRingWriter( self.name, self.slots, size, replace=self.ring )
+        for rec in records:
+            self.ring.Write( rec )
+
+    def Close( self ):
+        if self.ring is not None:
+            self.ring.Close()
+            self.ring = None
+
+
+def ShmRingOutputArgs( args ):
+    """ ShmRingOutput of the --output-shm option, or None without it. """
+    name = getattr( args, 'output_shm', None )
+    if not name:
+        return None
+    slotSize = getattr( args, 'shm_slot_size', None )
+    return ShmRingOutput( name, getattr( args, 'shm_slots', 16 ), int( slotSize*1024*1024 ) if slotSize else None )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+from functools import lru_cache
+import numpy as np
+
+
+""" The sinefit module fits sine waves on the channels of a record.
+
+    FitSine4 is the IEEE-1057 four-parameter fit, for signals whose frequency
+    is not known. The frequency is first estimated with an interpolated FFT,
+    then the fit iterates Gauss-Newton steps on the linear three-parameter
+    solve, with the frequency correction as fourth parameter.
+
+    All channels are fitted together, samples is a 2-D array with one row per
+    channel. The fitted model, for sample index n, is:
+
+        amplitude * sin( omega*n + phase ) + offset
+
+    with omega in radians per sample.
+
+"""
+
+
+class SineFits:
+    """ Fitted parameters, each attribute is an array with one value per channel. """
+    def __init__( self, amplitude, omega, phase, offset, rms, iterations ):
+        self.amplitude = amplitude
+        self.omega = omega
+        self.phase = phase
+        self.offset = offset
+        self.rms = rms
+        self.iterations = iterations
+
+    def __len__( self ):
+        return len( self.amplitude )
+
+    def __getitem__( self, index ):
+        """ Returns the parameters of a channel as [gain, omega, phase, offset, rms]. """
+        return [self.amplitude[index], self.omega[index], self.phase[index], self.offset[index], self.rms[index]]
+
+
+@lru_cache( maxsize=16 )
+def _HannWindow( size ):
+    window = np.hanning( size )
+    window.flags.writeable = False
+    return window
+
+
+@lru_cache( maxsize=16 )
+def _Indexes( size ):
+    indexes = np.arange( size, dtype=np.float64 )
+    indexes.flags.writeable = False
+    return indexes
+
+
+def EstimateOmega( samples ):
+    """ Returns the frequency, in radians per sample, of the strongest tone of
+        each channel. It uses the ratio of the two highest bins of the Hann
+        windowed spectrum to interpolate between them.
+
+    >>> n = np.arange( 4096 )
+    >>> omega = EstimateOmega( [np.sin( 0.1234*n ), np.cos( 0.5*n )] )
+    >>> print( np.round( omega, 4 ) )
+    [0.1234 0.5   ]
+    """
+    samples = np.atleast_2d( np.asarray( samples, dtype=np.float64 ) )
+    size = samples.shape[-1]
+    centered = samples - samples.mean( axis=-1, keepdims=True )
+    spectrum = np.abs( np.fft.rfft( centered * _HannWindow( size ), axis=-1 ) )
+    # The Hann window spreads DC on the first bin.
+    spectrum[:, :2] = 0.0
+    rows = np.arange( len( spectrum ) )
+    peak = np.argmax( spectrum, axis=-1 )
+    last = spectrum.shape[-1] - 1
+    prev = spectrum[rows, np.maximum( peak-1, 0 )]
+    next = spectrum[rows, np.minimum( peak+1, last )]
+    high = spectrum[rows, peak]
+    right = next>prev
+    alpha = np.where( right, next, prev ) / np.where( high>0, high, 1.0 )
+    delta = ( 2*alpha - 1 ) / ( alpha + 1 )
+    delta = np.where( right, delta, -delta )
+    return 2*np.pi * ( peak + delta ) / size
+
+
+def FitSine3( samples, omega ):
+    """ Least squares fit of amplitude, phase and offset, for known omega.
+        omega is either a scalar, or an array with one value per channel.
+
+    >>> n = np.arange( 1000 )
+    >>> fit = FitSine3( [3*np.sin( 0.2*n + 1 ) + 2], 0.2 )
+    >>> print( np.round( [fit.amplitude[0], fit.phase[0], fit.offset[0]], 6 ) )
+    [3. 1. 2.]
+    """
+    samples = np.atleast_2d( np.asarray( samples, dtype=np.float64 ) )
+    omega = np.broadcast_to( np.asarray( omega, dtype=np.float64 ), samples.shape[:1] ).copy()
+    cos, sin, params = _Solve3( samples, omega )
+    return _Results( samples, omega, params, cos, sin, 0 )
+
+
+def _Solve3( samples, omega ):
+    phases = omega[:, None] * _Indexes( samples.shape[-1] )
+    cos, sin = np.cos( phases ), np.sin( phases )
+    design = np.stack( ( cos, sin, np.ones_like( cos ) ), axis=-1 )
+    params = _LeastSquares( design, samples )
+    return cos, sin, params
+
+
+def _LeastSquares( design, samples ):
+    """ Solves the normal equations of each channel. """
+    normal = np.matmul( design.transpose( 0, 2, 1 ), design )
+    rhs = np.matmul( design.transpose( 0, 2, 1 ), samples[:, :, None] )
+    # pinv keeps flat channels, whose matrix is singular, from failing the others.
+    return np.matmul( np.linalg.pinv( normal ), rhs )[:, :, 0]
+
+
+def _Results( samples, omega, params, cos, sin, iterations ):
+    a, b, c = params[:, 0], params[:, 1], params[:, 2]
+    residuals = samples - ( a[:, None]*cos + b[:, None]*sin + c[:, None] )
+    rms = np.sqrt( np.mean( residuals**2, axis=-1 ) )
+    return SineFits( np.hypot( a, b ), omega, np.arctan2( a, b ), c, rms, iterations )
+
+
+def FitSine4( samples, omega=None, maxIterations=10, tolerance=1e-10 ):
+    """ IEEE-1057 four-parameter fit of amplitude, omega, phase and offset.
+        omega is the initial estimate, it is computed by EstimateOmega if not
+        given. Iterations stop when the correction of omega is smaller than
+        tolerance radians per sample, on all channels.
+
+    >>> n = np.arange( 5000 )
+    >>> rng = np.random.default_rng( 1 )
+    >>> samples = [ 1000*np.sin( 0.0123*n + 0.5 ) - 20 + rng.normal( 0, 3, n.size ),
+    ...             400*np.sin( 0.0123*n - 2.0 ) + 11 + rng.normal( 0, 3, n.size ) ]
+    >>> fit = FitSine4( samples )
+    >>> print( np.round( fit.amplitude ), np.round( fit.omega, 6 ), np.round( fit.phase, 2 ), np.round( fit.offset ) )
+    [1000.  400.] [0.0123 0.0123] [ 0.5 -2. ] [-20.  11.]
+    >>> print( np.round( fit.rms ) )
+    [3. 3.]
+    """
+    samples = np.atleast_2d( np.asarray( samples, dtype=np.float64 ) )
+    size = samples.shape[-1]
+    if omega is None:
+        omega = EstimateOmega( samples )
+    omega = np.broadcast_to( np.asarray( omega, dtype=np.float64 ), samples.shape[:1] ).copy()
+    indexes = _Indexes( size )
+
+    cos, sin, params = _Solve3( samples, omega )
+    iterations = 0
+    while iterations<maxIterations:
+        iterations += 1
+        a, b = params[:, 0], params[:, 1]
+        # Derivative of the model by omega, scaled by 1/size to keep the system well conditioned.
+        derivative = ( b[:, None]*cos - a[:, None]*sin ) * ( indexes/size )
+        design = np.stack( ( cos, sin, np.ones_like( cos ), derivative ), axis=-1 )
+        step = _LeastSquares( design, samples )
+        correction = step[:, 3] / size
+        omega = omega + correction
+        phases = omega[:, None] * indexes
+        cos, sin = np.cos( phases ), np.sin( phases )
+        params = step[:, :3]
+        if np.all( np.abs( correction )<tolerance ):
+            break
+    # Final linear solve at the converged frequency
+    design = np.stack( ( cos, sin, np.ones_like( cos ) ), axis=-1 )
+    params = _LeastSquares( design, samples )
+    return _Results( samples, omega, params, cos, sin, iterations )
+
+
+def RecordSamples( record, maxPoints=None ):
+    """ Returns the samples of the waveforms of a record as a 2-D array, truncated
+        to the shortest waveform, and to maxPoints.
+    """
+    size = min( len( wfm.Samples ) for wfm in record )
+    if maxPoints:
+        size = min( size, maxPoints )
+    return np.array( [wfm.Samples[:size] for wfm in record], dtype=np.float64 )
+
+
+def FitRecord( record, maxPoints=None, omega=None ):
+    """ FitSine4 on all the waveforms of a record. """
+    return FitSine4( RecordSamples( record, maxPoints ), omega=omega )
+
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
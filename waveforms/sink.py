@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+from collections import deque
+from threading import Thread, Condition
+from numpy import ndarray
+from sys import stdout, stderr
+import time
+
+
+""" The sink module writes the output of an acquisition loop on a thread.
+
+    The runners fetch records, and call OutputTrace or OutputTraces to print
+    them on stdout. When the receiver of stdout is slower than the digitizer,
+    the acquisition loop waits for it. An OutputSink queues these writes to a
+    writer thread instead, within a budget of memory:
+
+    sink = OutputSink( stdout, memory=256*1024*1024, policy='drop-oldest' )
+    if not sink.Put( OutputTraces, mrec, stdout ):
+        ...  # stdout is broken, the receiver is gone
+    sink.Close()
+
+    When the budget is exhausted, the policy decides: 'block' waits for the
+    writer, 'drop-oldest' throws away the oldest pending write, and
+    'drop-newest' throws away the new one. Dropped writes are counted, and
+    reported on stderr.
+
+"""
+
+
+POLICIES = ( 'block', 'drop-oldest', 'drop-newest' )
+
+
+def ObjectBytes( obj, memo=None ):
+    """ Returns the size in bytes of the numpy arrays held by obj, its lists,
+        tuples, dictionaries and attributes. Each array is counted once.
+
+    >>> from numpy import zeros
+    >>> class Record: pass
+    >>> rec = Record()
+    >>> rec.samples = zeros( 100, dtype='int16' )
+    >>> rec.fetch = ( rec.samples, 100, [0.0] )
+    >>> ObjectBytes( [rec, zeros( 10 )] )
+    280
+    """
+    memo = set() if memo is None else memo
+    if id( obj ) in memo:
+        return 0
+    memo.add( id( obj ) )
+    if isinstance( obj, ndarray ):
+        return obj.nbytes
+    if isinstance( obj, ( list, tuple ) ):
+        return sum( ObjectBytes( o, memo ) for o in obj )
+    if isinstance( obj, dict ):
+        return sum( ObjectBytes( o, memo ) for o in obj.values() )
+    if hasattr( obj, '__dict__' ) and not isinstance( obj, type ) and not callable( obj ):
+        return sum( ObjectBytes( o, memo ) for o in vars( obj ).values() )
+    return 0
+
+
+class OutputSink:
+    """ Calls write functions on a writer thread, in the order they are put.
+
+        memory is the budget in bytes of the arrays waiting to be written,
+        length the maximum number of writes waiting, or None. A write is
+        always accepted when none is waiting, whatever its size. With a length
+        of 0, writes are done by Put itself, as without a sink.
+
+        A BrokenPipeError of the writer marks the sink as broken: the pending
+        writes are thrown away, and Put returns False. Other errors of the
+        writer are raised by the next call to Put, Drain or Close.
+
+        With a telemetry, each Put is timed as the "output" stage: the wait of
+        the acquisition loop for the sink. Each write is timed as the "write"
+        stage, on the thread that does it.
+
+    >>> from io import StringIO
+    >>> out = StringIO()
+    >>> sink = OutputSink( out, length=2, policy='drop-oldest', report=None )
+    >>> with sink.condition:
+    ...     # Holds the writer, so that the writes pile up
+    ...     for n in range( 5 ):
+    ...         accepted = sink.Put( print, n, file=out )
+    >>> sink.Close()
+    >>> print( out.getvalue().split(), sink.written, sink.dropped )
+    ['3', '4'] 2 3
+    """
+    def __init__( self, file=stdout, memory=256*1024*1024, length=None, policy='block', name="Output", report=5.0, telemetry=None ):
+        if policy not in POLICIES:
+            raise RuntimeError( "ERROR: Unknown output policy "+str( policy )+"." )
+        self.file = file
+        self.memory = memory
+        self.length = length
+        self.policy = policy
+        self.name = name
+        self.report = report
+        self.telemetry = telemetry
+        self.condition = Condition()
+        self.pending = deque()
+        self.bytes = 0
+        self.busy = False
+        self.closed = False
+        self.broken = False
+        self.error = None
+        self.written = 0
+        self.dropped = 0
+        self.reported = 0
+        self.lastReport = time.perf_counter()
+        self.thread = None
+        if length!=0:
+            self.thread = Thread( target=self._Write, name=name+" writer", daemon=True )
+            self.thread.start()
+
+    def _Full( self, size ):
+        if not self.pending:
+            return False
+        if self.length is not None and len( self.pending )>=self.length:
+            return True
+        return self.memory and self.bytes+size>self.memory
+
+    def _Raise( self ):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def Put( self, function, *args, **kwargs ):
+        """ Queues function( *args, **kwargs ). Returns False when the output is broken. """
+        if self.telemetry is None:
+            return self._Put( function, args, kwargs )
+        with self.telemetry.Stage( "output" ):
+            return self._Put( function, args, kwargs )
+
+    def _Put( self, function, args, kwargs ):
+        if self.thread is None:
+            if not self.broken:
+                try:
+                    self._Call( function, args, kwargs )
+                    self.written += 1
+                except BrokenPipeError:
+                    self.broken = True
+            return not self.broken
+        size = ObjectBytes( ( args, kwargs ) )
+        with self.condition:
+            self._Raise()
+            while not self.broken and self._Full( size ):
+                if self.policy=='block':
+                    self.condition.wait()
+                elif self.policy=='drop-oldest':
+                    self.bytes -= self.pending.popleft()[3]
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    self._ReportDropped()
+                    return True
+            if self.broken:
+                return False
+            self.pending.append( ( function, args, kwargs, size ) )
+            self.bytes += size
+            self._ReportDropped()
+            self.condition.notify_all()
+        return True
+
+    def _Write( self ):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                function, args, kwargs, size = self.pending.popleft()
+                self.busy = True
+            try:
+                self._Call( function, args, kwargs )
+                self.written += 1
+                if not self.pending:
+                    self.file.flush()
+            except BrokenPipeError:
+                with self.condition:
+                    self.broken = True
+                    self.pending.clear()
+                    self.bytes = 0
+            except Exception as e:
+                self.error = e
+            with self.condition:
+                self.bytes = max( 0, self.bytes-size )
+                self.busy = False
+                self.condition.notify_all()
+
+    def _Call( self, function, args, kwargs ):
+        if self.telemetry is None:
+            function( *args, **kwargs )
+            return
+        start = time.perf_counter()
+        try:
+            function( *args, **kwargs )
+        finally:
+            self.telemetry.Add( "write", time.perf_counter()-start )
+
+    def _ReportDropped( self, force=False ):
+        """ Prints the number of writes dropped since the previous report. """
+        now = time.perf_counter()
+        if self.dropped==self.reported or not ( force or ( self.report is not None and now-self.lastReport>=self.report ) ):
+            return
+        if self.report is not None or force:
+            print( "%s: %d dropped, %d in total" % ( self.name, self.dropped-self.reported, self.dropped ), file=stderr, flush=True )
+        self.reported = self.dropped
+        self.lastReport = now
+
+    def Drain( self ):
+        """ Waits until all the pending writes are done. """
+        if self.thread is not None:
+            with self.condition:
+                while self.pending or self.busy:
+                    self.condition.wait()
+        self._Raise()
+
+    def Close( self ):
+        """ Writes the pending writes, and stops the writer thread. """
+        if self.thread is not None:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            self.thread.join()
+            self.thread = None
+        if self.report is not None:
+            self._ReportDropped( force=True )
+        self._Raise()
+
+
+def OutputSinkArgs( args, file=stdout, telemetry=None ):
+    """ OutputSink using the options of DigitizerParser. A --pipeline-depth of
+        N keeps at most N-1 writes waiting, 1 writes without a thread, and 0
+        only limits the memory to --output-memory MB.
+    """
+    depth = getattr( args, 'pipeline_depth', 0 )
+    return OutputSink( file, memory=getattr( args, 'output_memory', 256 )*1024*1024,
+                       length=None if depth<=0 else depth-1,
+                       policy=getattr( args, 'output_policy', 'block' ), telemetry=telemetry )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,362 @@
+#!/usr/bin/python3
+
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+
+
+""" The spectral module computes the spectrum of records, and the dynamic
+    performance metrics of a sine wave: SNR, THD, SINAD, SFDR and ENOB.
+
+    Functions work on arrays of samples of any shape, the last axis being the
+    samples of a waveform. A record gives a 2-D array, one row per channel, a
+    sweep of records a 3-D array.
+
+    Spectrums are one-sided power spectrums, in the square unit of the samples,
+    normalized so that the sum of the bins is the mean square of the windowed
+    signal. A sine of amplitude A sums to A*A/2 over its main lobe.
+
+    metrics = Metrics( samples, fullScale=2**16 )
+    print( metrics.Snr(), metrics.Enob() )
+
+    To read the noise floor, SpectrumAverager averages the Welch spectrums,
+    that is the mean power spectrum of overlapping windowed segments, of
+    successive records.
+
+    averager = SpectrumAverager( length=4096, mode='exponential', averages=16 )
+    for record in records:
+        averager.AddRecord( record )
+    plot( averager.average )
+
+"""
+
+
+# Window definitions: cosine sum coefficients, and the number of bins on each
+# side of a tone that hold its main lobe.
+WINDOWS = {
+    'rect':             ( (1.0,), 1 ),
+    'hann':             ( (0.5, 0.5), 2 ),
+    'blackman':         ( (0.42, 0.5, 0.08), 3 ),
+    'blackmanharris':   ( (0.35875, 0.48829, 0.14128, 0.01168), 4 ),
+}
+
+
+@lru_cache( maxsize=32 )
+def Window( name, size ):
+    """ Returns the named window of size points. Windows are cached, and read-only.
+
+    >>> print( Window( 'hann', 5 ) )
+    [0.  0.5 1.  0.5 0. ]
+    """
+    if name not in WINDOWS:
+        raise RuntimeError( "ERROR: Unknown window "+str( name )+"." )
+    coefs, span = WINDOWS[name]
+    phases = 2*np.pi*np.arange( size ) / max( 1, size-1 )
+    window = np.zeros( size )
+    for k, coef in enumerate( coefs ):
+        window += (-1)**k * coef * np.cos( k*phases )
+    window.flags.writeable = False
+    return window
+
+
+def WindowSpan( name ):
+    """ Returns the number of bins on each side of a tone that hold its main lobe. """
+    return WINDOWS[name][1]
+
+
+@lru_cache( maxsize=32 )
+def _OneSided( size ):
+    """ Factors that fold the negative frequencies on the positive ones. """
+    factors = np.full( size//2 + 1, 2.0 )
+    factors[0] = 1.0
+    if size%2==0:
+        factors[-1] = 1.0
+    factors.flags.writeable = False
+    return factors
+
+
+def PowerSpectrum( samples, window='blackmanharris' ):
+    """ Returns the one-sided power spectrum of the samples, along the last axis.
+
+    >>> n = np.arange( 1024 )
+    >>> spectrum = PowerSpectrum( 4*np.sin( 2*np.pi*100*n/1024 ), window='hann' )
+    >>> print( round( float( spectrum[98:103].sum() ), 6 ) )
+    8.0
+    """
+    samples = np.asarray( samples )
+    size = samples.shape[-1]
+    weights = Window( window, size )
+    spectrum = np.fft.rfft( samples * weights, axis=-1 )
+    power = spectrum.real**2 + spectrum.imag**2
+    power *= _OneSided( size ) / ( size * np.dot( weights, weights ) )
+    return power
+
+
+def AmplitudeSpectrum( samples, window='rect' ):
+    """ Returns the one-sided amplitude spectrum, where a sine of amplitude A has a peak of A.
+
+    >>> n = np.arange( 1000 )
+    >>> print( np.round( AmplitudeSpectrum( 3*np.cos( 2*np.pi*50*n/1000 ) )[49:52], 6 ) )
+    [0. 3. 0.]
+    """
+    samples = np.asarray( samples )
+    size = samples.shape[-1]
+    weights = Window( window, size )
+    return np.abs( np.fft.rfft( samples * weights, axis=-1 ) ) * ( _OneSided( size ) / weights.sum() )
+
+
+def WelchSpectrum( samples, length=None, overlap=0.5, window='hann' ):
+    """ Returns the mean of the power spectrums of segments of length points,
+        overlapping by the overlap fraction, along the last axis of samples.
+        All the segments of all the waveforms go through a single rfft.
+
+    >>> rng = np.random.default_rng( 0 )
+    >>> spectrum = WelchSpectrum( rng.normal( 0, 2, ( 2, 65536 ) ), length=1024 )
+    >>> print( spectrum.shape, np.round( spectrum.sum( axis=-1 ), 1 ) )
+    (2, 513) [4. 4.]
+    """
+    samples = np.asarray( samples, dtype=np.float64 )
+    size = samples.shape[-1]
+    length = min( length, size ) if length else size
+    step = max( 1, int( length*( 1.0-overlap ) ) )
+    segments = sliding_window_view( samples, length, axis=-1 )[..., ::step, :]
+    return PowerSpectrum( segments, window ).mean( axis=-2 )
+
+
+class SpectrumAverager:
+    """ Averages the Welch spectrums of successive records.
+
+        mode is either 'exponential', the weight of the new spectrums being
+        1/averages once averages records are accumulated, or 'average', the
+        mean of the last averages records.
+        average and maximum are the average and the max-hold spectrums, with
+        one row per channel. They are allocated on the first record, and
+        reallocated only when the shape of the spectrums changes. segment is
+        the length of the Welch segments of the last samples added.
+
+    >>> rng = np.random.default_rng( 0 )
+    >>> averager = SpectrumAverager( length=256, mode='average', averages=4 )
+    >>> for n in range( 10 ):
+    ...     average = averager.Add( rng.normal( 0, 1, ( 2, 4096 ) ) )
+    >>> print( averager.count, averager.average.shape, np.round( averager.average.sum( axis=-1 ), 1 ) )
+    10 (2, 129) [1. 1.]
+    >>> bool( np.all( averager.maximum>=averager.average ) )
+    True
+    >>> averager = SpectrumAverager()
+    >>> print( averager.Add( np.ones( ( 1, 255 ) ) ).shape, averager.segment )
+    (1, 128) 255
+    """
+    MODES = ( 'exponential', 'average' )
+
+    def __init__( self, length=None, overlap=0.5, window='hann', mode='exponential', averages=16 ):
+        if mode not in self.MODES:
+            raise RuntimeError( "ERROR: Unknown averaging mode "+str( mode )+"." )
+        self.length = length
+        self.overlap = overlap
+        self.window = window
+        self.mode = mode
+        self.averages = max( 1, averages )
+        self.average = None
+        self.maximum = None
+        self._history = None
+        self._sum = None
+        self.segment = None
+        self.Reset()
+
+    def Reset( self ):
+        """ Restarts the averaging and the max-hold on the next record. """
+        self.count = 0
+
+    def _Allocate( self, shape ):
+        self.average = np.zeros( shape )
+        self.maximum = np.zeros( shape )
+        if self.mode=='average':
+            self._history = np.zeros( ( self.averages, )+shape )
+            self._sum = np.zeros( shape )
+
+    def Add( self, samples ):
+        """ Adds the spectrums of samples, one row per channel. Returns the average. """
+        size = np.shape( samples )[-1]
+        self.segment = min( self.length, size ) if self.length else size
+        return self.AddPower( WelchSpectrum( samples, self.length, self.overlap, self.window ) )
+
+    def AddPower( self, power ):
+        """ Adds power spectrums already computed by WelchSpectrum with the
+            parameters of the averager. power is modified. Returns the average.
+        """
+        if self.average is None or self.average.shape!=power.shape:
+            self._Allocate( power.shape )
+            self.count = 0
+        if self.count==0:
+            self.average[...] = power
+            self.maximum[...] = power
+            if self.mode=='average':
+                self._history[...] = 0.0
+                self._history[0] = power
+                self._sum[...] = power
+            self.count = 1
+            return self.average
+
+        np.maximum( self.maximum, power, out=self.maximum )
+        if self.mode=='exponential':
+            # Plain mean until there are enough records, so that the start is not biased.
+            weight = 1.0 / min( self.count+1, self.averages )
+            power -= self.average
+            power *= weight
+            self.average += power
+        else:
+            slot = self.count % self.averages
+            self._sum -= self._history[slot]
+            self._history[slot] = power
+            if slot==0:
+                # Recompute the sum once in a while, so that rounding errors do not build up.
+                np.sum( self._history, axis=0, out=self._sum )
+            else:
+                self._sum += power
+            np.divide( self._sum, min( self.count+1, self.averages ), out=self.average )
+        self.count += 1
+        return self.average
+
+    def AddRecord( self, record, maxPoints=None ):
+        """ Adds a record, or all the records of a MultiRecord. """
+        if hasattr( record, "ActualRecords" ):
+            for index in range( record.ActualRecords ):
+                self.AddRecord( record[index], maxPoints )
+            return self.average
+        size = min( len( wfm ) for wfm in record )
+        if maxPoints:
+            size = min( size, maxPoints )
+        return self.Add( np.array( [wfm.Samples[:size] for wfm in record], dtype=np.float64 ) )
+
+
+def FullScale( record ):
+    """ Returns the peak to peak full scale of a record, from its sample type. """
+    if hasattr( record, "ActualAverages" ):
+        return 2**record.NbrAdcBits * record.ActualAverages
+    return { "Int8": 2**8, "Int16": 2**16, "Int32": 2**32 }.get( record.SampleType, None )
+
+
+def AliasedBins( frequencies, size ):
+    """ Returns the bins where frequencies, in bins of a size points spectrum,
+        appear after aliasing in the first Nyquist zone.
+
+    >>> print( AliasedBins( np.array( [100.0, 600.0, 1100.0, 1400.0] ), 1000 ) )
+    [100. 400. 100. 400.]
+    """
+    folded = np.mod( frequencies, size )
+    return np.where( folded>size/2, size-folded, folded )
+
+
+class SpectralMetrics:
+    """ Dynamic performance of a sine wave. Powers are arrays of the shape of
+        the samples without their last axis. Ratios are in dB, relative to the
+        carrier (dBc), or to the full scale (dBFS) if the full scale is known.
+    """
+    def __init__( self, size, carrierBin, frequency, signal, noise, harmonics, distortion, spur, spurBin, fullScale=None ):
+        self.size = size
+        self.carrierBin = carrierBin
+        self.frequency = frequency
+        self.signal = signal
+        self.noise = noise
+        self.harmonics = harmonics
+        self.distortion = distortion
+        self.spur = spur
+        self.spurBin = spurBin
+        self.fullScale = fullScale
+
+    def FullScalePower( self ):
+        """ Mean square of a full scale sine. """
+        return ( self.fullScale/2 )**2 / 2 if self.fullScale else None
+
+    def Snr( self ):
+        return _Decibels( self.signal, self.noise )
+
+    def Thd( self ):
+        return _Decibels( self.distortion, self.signal )
+
+    def Sinad( self ):
+        return _Decibels( self.signal, self.noise+self.distortion )
+
+    def Sfdr( self ):
+        return _Decibels( self.signal, self.spur )
+
+    def Enob( self ):
+        """ Effective number of bits, corrected to full scale when it is known. """
+        sinad = self.Sinad()
+        if self.fullScale:
+            sinad = sinad + _Decibels( self.FullScalePower(), self.signal )
+        return ( sinad - 1.76 ) / 6.02
+
+
+def _Decibels( num, den ):
+    with np.errstate( divide='ignore', invalid='ignore' ):
+        return 10*np.log10( np.asarray( num, dtype=np.float64 ) / den )
+
+
+def Metrics( samples, nbrHarmonics=5, window='blackmanharris', fullScale=None, spectrum=None ):
+    """ Locates the carrier, its harmonics including the aliased ones, and
+        returns the SpectralMetrics of every waveform of samples.
+        spectrum is the PowerSpectrum of samples, if already computed with the
+        same window.
+
+    >>> n = np.arange( 4096 )
+    >>> rng = np.random.default_rng( 0 )
+    >>> carrier = 2*np.pi*1001.3/4096*n
+    >>> samples = [ 1000*np.sin( carrier ) + 10*np.sin( 2*carrier ) + rng.normal( 0, 1, n.size ),
+    ...             1000*np.sin( carrier ) + 1*np.sin( 3*carrier ) + rng.normal( 0, 10, n.size ) ]
+    >>> metrics = Metrics( samples, fullScale=4096 )
+    >>> print( metrics.carrierBin, np.round( metrics.frequency, 1 ) )
+    [1001 1001] [1001.3 1001.3]
+    >>> print( np.round( metrics.Snr() ), np.round( metrics.Thd() ), np.round( metrics.Sfdr() ) )
+    [57. 37.] [-40. -52.] [40. 58.]
+    >>> print( np.round( metrics.Enob(), 1 ) )
+    [7.4 6.9]
+    """
+    samples = np.asarray( samples, dtype=np.float64 )
+    size = samples.shape[-1]
+    span = WindowSpan( window )
+    if spectrum is None:
+        spectrum = PowerSpectrum( samples, window )
+    nbins = spectrum.shape[-1]
+    bins = np.arange( nbins )
+
+    # Carrier: highest bin out of the DC lobe.
+    dc = bins<=span
+    carrierBin = np.argmax( np.where( dc, -1.0, spectrum ), axis=-1 )
+    lobes = np.clip( carrierBin[..., None] + np.arange( -span, span+1 ), 0, nbins-1 )
+    lobe = np.take_along_axis( spectrum, lobes, axis=-1 )
+    signal = lobe.sum( axis=-1 )
+    frequency = ( lobe*lobes ).sum( axis=-1 ) / np.where( signal>0, signal, 1.0 )
+    signalMask = np.abs( bins - carrierBin[..., None] )<=span
+
+    # Harmonics 2 to nbrHarmonics+1, folded in the first Nyquist zone.
+    orders = np.arange( 2, nbrHarmonics+2 )
+    harmonicBins = np.rint( AliasedBins( frequency[..., None]*orders, size ) ).astype( int )
+    distances = np.abs( bins - harmonicBins[..., None] )
+    harmonicMasks = distances<=span
+    # Harmonics falling in the DC or carrier lobes cannot be separated from them.
+    valid = ~np.any( harmonicMasks & ( dc | signalMask )[..., None, :], axis=-1 )
+    harmonicMasks &= valid[..., None]
+    harmonics = np.sum( harmonicMasks*spectrum[..., None, :], axis=-1 )
+    # A bin shared by two harmonics is counted once in the total.
+    harmonicMask = np.any( harmonicMasks, axis=-2 )
+    distortion = np.sum( np.where( harmonicMask, spectrum, 0.0 ), axis=-1 )
+
+    # Noise: every other bin, extrapolated to the bins that were excluded.
+    noiseMask = ~( dc | signalMask | harmonicMask )
+    noiseBins = np.maximum( noiseMask.sum( axis=-1 ), 1 )
+    noise = np.sum( np.where( noiseMask, spectrum, 0.0 ), axis=-1 ) * ( nbins - span - 1 ) / noiseBins
+
+    # Spur: highest bin out of the DC and carrier lobes, compared bin to bin with the carrier.
+    spurs = np.where( dc | signalMask, -1.0, spectrum )
+    spurBin = np.argmax( spurs, axis=-1 )
+    spur = np.take_along_axis( spurs, spurBin[..., None], axis=-1 )[..., 0]
+    spur = spur * signal / np.take_along_axis( spectrum, carrierBin[..., None], axis=-1 )[..., 0]
+
+    return SpectralMetrics( size, carrierBin, frequency, signal, noise, harmonics, distortion, spur, spurBin, fullScale )
+
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,216 @@
+#!/usr/bin/python3
+
+from numpy import zeros, empty, arange, concatenate, ascontiguousarray, floor, searchsorted, int16, int32, int64, uint64
+from waveforms.singlerecord import Record
+from waveforms.packed import UnpackSamples, _Layout
+
+
+""" The streaming module assembles records from the streams of a digitizer.
+
+    In triggered streaming, the digitizer streams the samples of its channels
+    with no record boundaries, and the timestamps of its triggers in a stream
+    of their own, StreamTriggers. Each trigger is an uint64, two int32
+    elements, with the time of the trigger in 1/256 of the sample period since
+    the start of the streams.
+
+    StreamAssembler keeps the samples of each stream in a ring buffer, decodes
+    the triggers, and returns a Record for each trigger whose samples have all
+    been fetched. The stream elements are copied once, from the fetch to the
+    ring, so a record split across fetches costs nothing more:
+
+    assembler = StreamAssembler( ["StreamCh1", "StreamCh2"], recordSize, xIncrement )
+    assembler.AppendTriggers( triggerElements )
+    assembler.Append( "StreamCh1", elements1 )
+    assembler.Append( "StreamCh2", elements2 )
+    for record in assembler.Records():
+        OutputTrace( record, stdout )
+
+"""
+
+
+def DecodeTriggers( elements ):
+    """ Returns the sample index, and the fraction of sample, of the triggers
+        of the int32 elements of StreamTriggers.
+
+    >>> from numpy import array
+    >>> index, fraction = DecodeTriggers( array( [100*256+64, 2**32*256+128], dtype=uint64 ).view( int32 ) )
+    >>> print( index, fraction )
+    [       100 4294967296] [0.25 0.5 ]
+    """
+    timestamps = ascontiguousarray( elements ).view( uint64 )
+    return ( timestamps>>8 ).astype( int64 ), ( timestamps & 0xff )/256.0
+
+
+class StreamRing:
+    """ Ring buffer of the samples of a stream. Samples are addressed by their
+        index since the start of the stream, and the last capacity of them are
+        kept. Elements of packed samples, of bits bits, are unpacked.
+
+    >>> from numpy import array
+    >>> ring = StreamRing( 8 )
+    >>> ring.Append( arange( 6, dtype=int16 ).view( int32 ) )
+    >>> ring.Append( arange( 6, 12, dtype=int16 ).view( int32 ) )
+    >>> print( ring.written, ring.oldest, ring.Get( 4, 8 ) )
+    12 4 [ 4  5  6  7  8  9 10 11]
+    >>> ring.Get( 2, 4 )
+    Traceback (most recent call last):
+    ...
+    IndexError: Samples 2 to 6 are not in the ring, which holds 4 to 12.
+    """
+    def __init__( self, capacity, bits=None ):
+        self.capacity = capacity
+        self.buffer = zeros( capacity, dtype=int16 )
+        self.written = 0
+        self.bits = bits if bits and bits<16 else None
+        self.rest = empty( 0, dtype=int32 )
+
+    @property
+    def oldest( self ):
+        return max( 0, self.written-self.capacity )
+
+    def Append( self, elements ):
+        """ Appends the samples of the int32 elements of a fetch. """
+        if self.bits:
+            # Elements of an incomplete group of samples wait for the next fetch.
+            if len( self.rest ):
+                elements = concatenate( ( self.rest, elements ) )
+            group = _Layout( self.bits )[0]
+            usable = len( elements )//group*group
+            self.rest = elements[usable:].copy()
+            samples = UnpackSamples( elements[:usable], self.bits )
+        else:
+            samples = ascontiguousarray( elements ).view( int16 )
+        count = len( samples )
+        if count>self.capacity:
+            self.written += count-self.capacity
+            samples = samples[-self.capacity:]
+            count = self.capacity
+        start = self.written%self.capacity
+        first = min( count, self.capacity-start )
+        self.buffer[start:start+first] = samples[:first]
+        self.buffer[:count-first] = samples[first:]
+        self.written += count
+
+    def Get( self, start, count ):
+        """ Returns a copy of count samples from start. """
+        if start<self.oldest or start+count>self.written:
+            raise IndexError( "Samples %d to %d are not in the ring, which holds %d to %d." % ( start, start+count, self.oldest, self.written ) )
+        begin = start%self.capacity
+        if begin+count<=self.capacity:
+            return self.buffer[begin:begin+count].copy()
+        return concatenate( ( self.buffer[begin:], self.buffer[:begin+count-self.capacity] ) )
+
+
+class StreamAssembler:
+    """ Assembles the records of the streams from the triggers.
+
+        The records start preTrigger samples before their trigger. A record
+        whose samples are no longer in the rings, because its trigger came too
+        late, is counted as lost. bits gives the sample bits of the streams of
+        packed samples, like { "StreamCh1": 12 }.
+
+    >>> from numpy import array
+    >>> Elements = lambda first, last, sign=1: ( sign*arange( first, last, dtype=int16 ) ).view( int32 )
+    >>> assembler = StreamAssembler( ["StreamCh1", "StreamCh2"], 4, 1e-3, preTrigger=1 )
+    >>> triggers = array( [2*256+128, 7*256, 13*256], dtype=uint64 ).view( int32 )
+    >>> assembler.AppendTriggers( triggers[:3] )
+    >>> assembler.Append( "StreamCh1", Elements( 0, 10 ) )
+    >>> assembler.Append( "StreamCh2", Elements( 0, 6, -1 ) )
+    >>> for rec in assembler.Records():
+    ...     print( rec[0].Samples, rec[1].Samples, rec.InitialXOffset, rec.InitialXTimeSeconds, rec.InitialXTimeFraction )
+    [1 2 3 4] [-1 -2 -3 -4] -0.0015 0.0 0.0025
+    >>> assembler.AppendTriggers( triggers[3:] )
+    >>> assembler.Append( "StreamCh2", Elements( 6, 16, -1 ) )
+    >>> assembler.Append( "StreamCh1", Elements( 10, 14 ) )
+    >>> for rec in assembler.Records():
+    ...     print( rec[0].Samples, rec[1].Samples, rec.InitialXTimeFraction )
+    [6 7 8 9] [-6 -7 -8 -9] 0.007
+    >>> print( assembler.pending, assembler.assembled, assembler.lost )
+    1 2 0
+    """
+    def __init__( self, streams, recordSize, xIncrement, preTrigger=0, capacity=1<<24, bits=None, scaleFactor=1.0, scaleOffset=0.0, nbrAdcBits=None ):
+        self.streams = list( streams )
+        self.recordSize = recordSize
+        self.xIncrement = xIncrement
+        self.preTrigger = preTrigger
+        self.scaleFactor = scaleFactor
+        self.scaleOffset = scaleOffset
+        self.nbrAdcBits = nbrAdcBits
+        bits = bits or {}
+        self.rings = { stream: StreamRing( max( capacity, 2*recordSize ), bits.get( stream ) ) for stream in self.streams }
+        self.triggerRest = empty( 0, dtype=int32 )
+        self.indexes = empty( 0, dtype=int64 )
+        self.fractions = empty( 0 )
+        self.nextCut = 0
+        self.assembled = 0
+        self.lost = 0
+
+    @property
+    def pending( self ):
+        """ Number of triggers waiting for their samples. """
+        return len( self.indexes )
+
+    def AddTriggers( self, indexes, fractions=None ):
+        """ Adds triggers at the given sample indexes, with fractions of sample. """
+        fractions = zeros( len( indexes ) ) if fractions is None else fractions
+        self.indexes = concatenate( ( self.indexes, indexes ) )
+        self.fractions = concatenate( ( self.fractions, fractions ) )
+
+    def AppendTriggers( self, elements ):
+        """ Appends the int32 elements fetched from StreamTriggers. """
+        if len( self.triggerRest ):
+            elements = concatenate( ( self.triggerRest, elements ) )
+        usable = len( elements )//2*2
+        self.triggerRest = elements[usable:].copy()
+        self.AddTriggers( *DecodeTriggers( elements[:usable] ) )
+
+    def Append( self, stream, elements ):
+        """ Appends the int32 elements fetched from stream. """
+        self.rings[stream].Append( elements )
+
+    def Cut( self ):
+        """ Adds a trigger every recordSize samples, for the continuous
+            streaming, where the records follow each other.
+
+        >>> assembler = StreamAssembler( ["StreamCh1"], 4, 1.0 )
+        >>> assembler.Append( "StreamCh1", arange( 10, dtype=int16 ).view( int32 ) )
+        >>> assembler.Cut()
+        >>> print( [rec[0].Samples.tolist() for rec in assembler.Records()], assembler.nextCut )
+        [[0, 1, 2, 3], [4, 5, 6, 7]] 8
+        """
+        written = min( ring.written for ring in self.rings.values() )
+        end = self.nextCut+( written-self.nextCut )//self.recordSize*self.recordSize
+        self.AddTriggers( arange( self.nextCut, end, self.recordSize, dtype=int64 )+self.preTrigger )
+        self.nextCut = end
+
+    def Records( self ):
+        """ Returns the records of the triggers whose samples have been
+            fetched in all the streams, in the order of the triggers.
+        """
+        written = min( ring.written for ring in self.rings.values() )
+        oldest = max( ring.oldest for ring in self.rings.values() )
+        starts = self.indexes-self.preTrigger
+        ready = searchsorted( starts+self.recordSize, written, side='right' )
+        starts, fractions = starts[:ready], self.fractions[:ready]
+        self.indexes, self.fractions = self.indexes[ready:], self.fractions[ready:]
+
+        kept = starts>=oldest
+        self.lost += int( ready-kept.sum() )
+        starts, fractions = starts[kept], fractions[kept]
+        xoffsets = ( -self.preTrigger-fractions )*self.xIncrement
+        times = ( starts+self.preTrigger+fractions )*self.xIncrement
+        seconds = floor( times )
+        records = []
+        for start, xoffset, second, fraction in zip( starts.tolist(), xoffsets.tolist(), seconds.tolist(), ( times-seconds ).tolist() ):
+            rec = Record( nbrAdcBits=self.nbrAdcBits )
+            for stream in self.streams:
+                samples = self.rings[stream].Get( start, self.recordSize )
+                rec.append( ( samples, self.recordSize, 0, xoffset, second, fraction, self.xIncrement, self.scaleFactor, self.scaleOffset ) )
+            records.append( rec )
+        self.assembled += len( records )
+        return records
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+
+from waveforms.sinefit import EstimateOmega, FitSine3
+import numpy as np
+
+
+""" The summary module outputs the statistics of the records, instead of
+    their samples.
+
+    Long monitoring runs only look at the minimum, maximum, mean and RMS of
+    each channel, piping whole text traces to filter/MinMax.py. The runners
+    compute them with --output-summary, on the arrays they fetched, and
+    write one line per record, after a header line written once, or again
+    when the channels change:
+
+    $Summary Record Seconds Min1 Max1 Mean1 Rms1 Min2 Max2 Mean2 Rms2
+    0 12.000000125 -8192 8191 -0.5 5792.6 -8190 8192 1.25 5791.9
+
+    Record counts the records output since the start. Seconds is the time of
+    the trigger of the record. With --summary-fit, the amplitude and phase of
+    a sine wave fitted on each channel follow its RMS. Values are in the
+    units of the samples, as in the traces: ADC codes, not scaled by the
+    ScaleFactor and ScaleOffset, unless the samples are read in volts with
+    --read-type real64.
+
+"""
+
+
+def ChannelRows( records ):
+    """ Returns the list, by channel, of the 2-D arrays of the samples of
+        records, one row per record. Records of different lengths are cut to
+        the shortest one. Complex samples are replaced by their magnitude.
+
+        The samples of a multi-record fetch are gathered from its buffer in
+        one indexing, without going through each record.
+
+    >>> from waveforms import MultiRecord
+    >>> samples = np.array( [0, 1, 2, 3, 0, 0, 4, 5, 6, 7, 0, 0], dtype=np.int16 )
+    >>> rows = ChannelRows( MultiRecord( ( samples, 12, 2, [4, 4], [0, 6], [0.0, 0.0], [0.0, 0.0], [0.0, 0.0], 1e-9 ) ) )
+    >>> print( rows[0] )
+    [[0 1 2 3]
+     [4 5 6 7]]
+    """
+    mwfms = getattr( records, 'mwfms', None )
+    if mwfms and not hasattr( records, 'view' ) and all( hasattr( m, 'SampleArray' ) and hasattr( m, 'FirstValidPoint' ) for m in mwfms ):
+        rows = []
+        for mwfm in mwfms:
+            points = min( mwfm.ActualPoints )
+            first = np.asarray( mwfm.FirstValidPoint[:mwfm.ActualRecords] )
+            rows.append( mwfm.SampleArray[first[:, None]+np.arange( points )] )
+        return rows
+
+    records = list( records ) if hasattr( records, 'ActualRecords' ) else [records]
+    rows = []
+    for channel in range( len( records[0] ) ):
+        samples = [np.asarray( rec[channel].Samples ) for rec in records]
+        points = min( len( s ) for s in samples )
+        row = np.stack( [s[:points] for s in samples] )
+        rows.append( np.abs( row ) if np.iscomplexobj( row ) else row )
+    return rows
+
+
+def Summarize( rows, fit=False ):
+    """ Returns the statistics of each row of samples: a 2-D array with one
+        row of min, max, mean, RMS, and with fit amplitude and phase, for
+        each row of samples.
+
+    >>> n = np.arange( 1000 )
+    >>> print( Summarize( [np.full( 1000, 3 ), [-1, 1]*500] ) )
+    [[ 3.  3.  3.  3.]
+     [-1.  1.  0.  1.]]
+    >>> print( np.round( Summarize( 2*np.sin( 0.3*n+1 ), fit=True )[0, 4:], 2 ) )
+    [2. 1.]
+    """
+    samples = np.atleast_2d( np.asarray( rows ) )
+    values = samples.astype( np.float64, copy=False )
+    columns = [samples.min( axis=-1 ), samples.max( axis=-1 ), values.mean( axis=-1 ), np.sqrt( np.einsum( 'ij,ij->i', values, values )/max( values.shape[-1], 1 ) )]
+    if fit:
+        fits = FitSine3( values, EstimateOmega( values ) )
+        columns += [fits.amplitude, fits.phase]
+    return np.stack( columns, axis=-1 )
+
+
+def OutputSummary( records, file, Fit=False, FirstIndex=0, Header=True ):
+    """ Writes the summary line of each record of records to file, numbered
+        from FirstIndex, after the header line with Header.
+
+    >>> from io import StringIO
+    >>> from waveforms import MultiRecord
+    >>> samples = np.array( [0, 1, 2, 3, 0, 0, 4, 5, 6, 7, 0, 0], dtype=np.int16 )
+    >>> out = StringIO()
+    >>> OutputSummary( MultiRecord( ( samples, 12, 2, [4, 4], [0, 6], [0.0, 0.0], [12.0, 12.0], [0.5, 0.25], 1e-9 ) ), out )
+    >>> print( out.getvalue(), end='' )
+    $Summary Record Seconds Min1 Max1 Mean1 Rms1
+    0 12.500000000 0 3 1.5 1.87083
+    1 12.250000000 4 7 5.5 5.61249
+    """
+    rows = ChannelRows( records )
+    stats = [Summarize( row, Fit ) for row in rows]
+    if Header:
+        print( SummaryHeader( len( rows ), Fit ), file=file )
+    records = list( records ) if hasattr( records, 'ActualRecords' ) else [records]
+    for index, rec in enumerate( records ):
+        seconds = getattr( rec, 'InitialXTimeSeconds', 0.0 )+getattr( rec, 'InitialXTimeFraction', 0.0 )
+        values = " ".join( "%g"%( value ) for stat in stats for value in stat[index] )
+        file.write( "%d %.9f %s\n"%( FirstIndex+index, seconds, values ) )
+    file.flush()
+
+
+def SummaryHeader( channels, fit=False ):
+    """ Returns the header line of the summaries of channels. """
+    names = ["Min", "Max", "Mean", "Rms"]+( ["Amplitude", "Phase"] if fit else [] )
+    return " ".join( ["$Summary Record Seconds"]+[name+str( channel+1 ) for channel in range( channels ) for name in names] )
+
+
+class SummaryOutput:
+    """ Output function of the runners for --output-summary. The header is
+        written with the first records, and again when the number of
+        channels, or fit, changes. The records are numbered from the start.
+
+    >>> from io import StringIO
+    >>> from waveforms import MultiRecord
+    >>> samples = np.array( [0, 1, 2, 3, 0, 0, 4, 5, 6, 7, 0, 0], dtype=np.int16 )
+    >>> out, output = StringIO(), SummaryOutput()
+    >>> for loop in range( 2 ):
+    ...     output( MultiRecord( ( samples, 12, 2, [4, 4], [0, 6], [0.0, 0.0], [12.0, 12.0], [0.5, 0.25], 1e-9 ) ), out, NbrSamples=4 )
+    >>> print( out.getvalue(), end='' )
+    $Summary Record Seconds Min1 Max1 Mean1 Rms1
+    0 12.500000000 0 3 1.5 1.87083
+    1 12.250000000 4 7 5.5 5.61249
+    2 12.500000000 0 3 1.5 1.87083
+    3 12.250000000 4 7 5.5 5.61249
+    """
+    def __init__( self, fit=False ):
+        self.fit = fit
+        self.header = None
+        self.index = 0
+
+    def __call__( self, records, file, **kwargs ):
+        first = records[0] if hasattr( records, 'ActualRecords' ) else records
+        header = ( file, len( first ), self.fit )
+        OutputSummary( records, file, Fit=self.fit, FirstIndex=self.index, Header=header!=self.header )
+        self.header = header
+        self.index += records.ActualRecords if hasattr( records, 'ActualRecords' ) else 1
+
+
+def OutputSummaryArgs( args, output=None ):
+    """ Returns the SummaryOutput of --output-summary, or None when the
+        traces are output. It takes, and ignores, the keywords of the trace
+        outputs. output, the one of the previous setup, goes on numbering the
+        records.
+    """
+    if not getattr( args, 'output_summary', False ):
+        return None
+    output = output or SummaryOutput()
+    output.fit = getattr( args, 'summary_fit', False )
+    return output
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+
+from sys import stderr
+from threading import Lock
+from collections import deque
+from contextlib import contextmanager
+import time
+import json
+
+
+""" The telemetry module measures where the time goes in a processing loop.
+
+    Stages are timed with a monotonic clock, counters accumulate values such
+    as records or bytes, and Tick reports, once per interval, the statistics
+    since the previous report as a JSON line:
+
+    telemetry = Telemetry( "LiveViewer", interval=1.0 )
+    with telemetry.Stage( "parse" ):
+        ...
+    telemetry.Count( "bytes", len( line ) )
+    telemetry.Tick()
+
+    Stages and counters can be updated from several threads. With a window,
+    the reports also give the percentiles of the last window durations of
+    each stage, whatever the interval they belong to.
+
+"""
+
+
+class Telemetry:
+    """ Stage timings and counters, reported periodically as JSON lines.
+
+    >>> telemetry = Telemetry( "test", interval=1.0, file=None )
+    >>> telemetry.Reset( now=10.0 )
+    >>> for seconds in ( 0.001, 0.003 ):
+    ...     telemetry.Add( "parse", seconds )
+    >>> telemetry.Count( "records", 2 )
+    >>> telemetry.Count( "bytes", 3e6 )
+    >>> print( telemetry.Tick( now=10.5 ) )
+    None
+    >>> report = telemetry.Tick( now=12.0 )
+    >>> print( json.dumps( report["stages"] ), json.dumps( report["rates"] ) )
+    {"parse": {"count": 2, "mean_ms": 2.0, "max_ms": 3.0}} {"records": 1.0, "bytes": 1500000.0}
+    >>> print( FormatReport( report ) )
+    parse 2.0 ms | 1.0 rec/s 1.5 MB/s
+    >>> print( telemetry.Tick( now=13.0 )["rates"], telemetry.totals )
+    {'records': 0.0, 'bytes': 0.0} {'records': 2, 'bytes': 3000000.0}
+    >>> telemetry = Telemetry( "test", file=None, window=100 )
+    >>> for ms in range( 1, 201 ):
+    ...     telemetry.Add( "fetch", ms/1e3 )
+    >>> stats = telemetry.Report()["stages"]["fetch"]
+    >>> print( stats["count"], stats["p50_ms"], stats["p90_ms"], stats["p99_ms"] )
+    200 150.0 190.0 199.0
+    """
+    def __init__( self, name, interval=1.0, file=stderr, window=None ):
+        self.name = name
+        self.interval = interval
+        self.file = file
+        self.window = window
+        self.lock = Lock()
+        self.latest = None
+        self.totals = {}
+        self.recent = {}
+        self.owned = False
+        self.Reset()
+
+    def Reset( self, now=None ):
+        """ Starts a new interval. """
+        with self.lock:
+            self.start = time.perf_counter() if now is None else now
+            self.stages = {}
+            self.counters = { name: 0 for name in self.totals }
+
+    def Add( self, stage, seconds ):
+        """ Adds a duration to stage. """
+        with self.lock:
+            stats = self.stages.get( stage )
+            if stats is None:
+                self.stages[stage] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                if seconds>stats[2]:
+                    stats[2] = seconds
+            if self.window:
+                recent = self.recent.get( stage )
+                if recent is None:
+                    recent = self.recent[stage] = deque( maxlen=self.window )
+                recent.append( seconds )
+
+    @contextmanager
+    def Stage( self, stage ):
+        """ Times the enclosed statements as stage. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.Add( stage, time.perf_counter()-start )
+
+    def Count( self, counter, value=1 ):
+        with self.lock:
+            self.counters[counter] = self.counters.get( counter, 0 ) + value
+            self.totals[counter] = self.totals.get( counter, 0 ) + value
+
+    def Set( self, counter, total ):
+        """ Sets a counter from a running total kept elsewhere. """
+        with self.lock:
+            self.counters[counter] = self.counters.get( counter, 0 ) + total - self.totals.get( counter, 0 )
+            self.totals[counter] = total
+
+    def Report( self, now=None ):
+        """ Returns the statistics of the current interval, and starts a new one. """
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            elapsed = max( now-self.start, 1e-9 )
+            report = { "name": self.name,
+                       "time": time.time(),
+                       "interval": elapsed,
+                       "stages": { stage: { "count": count, "mean_ms": total/count*1e3, "max_ms": maximum*1e3 }
+                                   for stage, ( count, total, maximum ) in self.stages.items() },
+                       "rates": { counter: value/elapsed for counter, value in self.counters.items() },
+                       "totals": dict( self.totals ) }
+            for stage, stats in report["stages"].items():
+                if stage in self.recent:
+                    recent = sorted( self.recent[stage] )
+                    for percent in ( 50, 90, 99 ):
+                        stats["p%d_ms" % percent] = recent[max( -( -len( recent )*percent//100 )-1, 0 )]*1e3
+        self.Reset( now )
+        return report
+
+    def Tick( self, now=None ):
+        """ Reports when the interval is over. Returns the report, or None. """
+        now = time.perf_counter() if now is None else now
+        if self.interval is None or now-self.start<self.interval:
+            return None
+        report = self.Report( now )
+        self.latest = report
+        if self.file:
+            print( json.dumps( report ), file=self.file, flush=True )
+        return report
+
+    def Close( self ):
+        """ Reports the last interval, and closes the file opened for the
+            telemetry, if any.
+        """
+        if self.interval is not None and self.file:
+            print( json.dumps( self.Report() ), file=self.file, flush=True )
+        if self.owned:
+            self.file.close()
+            self.file = None
+
+
+def TelemetryArgs( args, name ):
+    """ Telemetry using the options of DigitizerParser. The reports are
+        written to the --telemetry file, or to stderr for '-', every
+        --telemetry-interval seconds. Without --telemetry, the statistics are
+        kept but never reported.
+    """
+    filename = getattr( args, 'telemetry', None )
+    if not filename:
+        return Telemetry( name, interval=None, file=None )
+    file = stderr if filename=='-' else open( filename, 'w' )
+    telemetry = Telemetry( name, interval=getattr( args, 'telemetry_interval', 1.0 ), file=file, window=1024 )
+    telemetry.owned = file is not stderr
+    return telemetry
+
+
+def FormatReport( report, order=() ):
+    """ Returns a report as a line of text, for display. Stages in order come first. """
+    if not report:
+        return ""
+    items = sorted( report["stages"].items(), key=lambda item: order.index( item[0] ) if item[0] in order else len( order ) )
+    stages = " ".join( "%s %.1f ms" % ( stage, stats["mean_ms"] ) for stage, stats in items )
+    rates = report["rates"]
+    text = [stages] if stages else []
+    values = []
+    if "records" in rates:
+        values.append( "%.1f rec/s" % rates["records"] )
+    if "bytes" in rates:
+        values.append( "%.1f MB/s" % ( rates["bytes"]/1e6 ) )
+    if "dropped" in report["totals"]:
+        values.append( "%d dropped" % report["totals"]["dropped"] )
+    if values:
+        text.append( " ".join( values ) )
+    return " | ".join( text )
+
+
+class TimedInput:
+    """ Wraps a file read by lines, so that the time spent waiting in readline,
+        and the bytes read, are counted.
+
+    >>> from io import StringIO
+    >>> timed = TimedInput( StringIO( "$A 1\\n12\\n" ) )
+    >>> print( repr( timed.readline() ), repr( timed.readline() ), repr( timed.readline() ), timed.bytes )
+    '$A 1\\n' '12\\n' '' 8
+    """
+    def __init__( self, input ):
+        self.input = input
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def readline( self ):
+        start = time.perf_counter()
+        line = self.input.readline()
+        self.seconds += time.perf_counter()-start
+        self.bytes += len( line )
+        return line
+
+    def __getattr__( self, name ):
+        return getattr( self.input, name )
+
+
+class TimedOutput:
+    """ Wraps a file written to, so that the time spent in write, and the
+        bytes written, are counted.
+
+    >>> from io import StringIO
+    >>> timed = TimedOutput( StringIO() )
+    >>> print( timed.write( "$A 1\\n" ), timed.write( "12\\n" ), timed.bytes, timed.getvalue().split() )
+    5 3 8 ['$A', '1', '12']
+    """
+    def __init__( self, output ):
+        self.output = output
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def write( self, text ):
+        start = time.perf_counter()
+        written = self.output.write( text )
+        self.seconds += time.perf_counter()-start
+        self.bytes += len( text )
+        return written
+
+    def __getattr__( self, name ):
+        return getattr( self.output, name )
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,7 +1,7 @@
 #!/usr/bin/python3
 
 from sys import stderr
-from numpy import int8, int16, int32, float64, array, ndarray, zeros, resize
+from numpy import int8, int16, int32, int64, float64, array, ndarray, zeros, resize
 from waveforms.singlerecord import Record
 import collections
 
@@ -54,7 +54,9 @@ class Trace:
 
 
 def SampleType( dataType ):
-    if dataType==int32:
+    if dataType==int64:
+        return "Int64"
+    elif dataType==int32:
         return "Int32"
     elif dataType==int16:
         return "Int16"
@@ -67,7 +69,9 @@ def SampleType( dataType ):
 
 def DataType( sampleType ):
     sampleType = str( sampleType ).strip()
-    if sampleType=="Int32":
+    if sampleType=="Int64":
+        return int64
+    elif sampleType=="Int32":
         return int32
     elif sampleType=="Int16":
         return int16
@@ -77,7 +81,9 @@ def DataType( sampleType ):
         return float64
     else:
         normalized = sampleType.lower()
-        if normalized in ( "int32", "i32" ):
+        if normalized in ( "int64", "i64" ):
+            return int64
+        elif normalized in ( "int32", "i32" ):
             return int32
         elif normalized in ( "int16", "i16" ):
             return int16